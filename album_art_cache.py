@@ -0,0 +1,168 @@
+# Album art cache
+#
+# Notes:
+#  Loads album art thumbnails without stalling the GUI. Full-size cover scans can be several
+# megabytes, so decoding and scaling them is done in a worker thread, using QImage (QPixmap can
+# only be used in the GUI thread). The results are handed back through a signal, and turned into
+# pixmaps in the GUI thread.
+#  Scaled thumbnails are saved to a cache dir on disk, named after the art's path, its mtime, and
+# the thumbnail size, so an image is only decoded at full size once, and a changed image gets a new
+# thumbnail. On top of that, the most recently used pixmaps are kept in memory, keyed the same way,
+# so a changed image doesn't keep showing its old pixmap either.
+#  Requests can be put into groups, as with the query executor. Only the latest request in a group
+# gets its callback run, so quickly skipping through tracks can't leave the wrong art showing.
+
+
+import os, threading, hashlib
+from collections import OrderedDict
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+from qt import *
+import gbl
+
+
+# Default caching values.
+MAX_CACHED_PIXMAPS = 64
+
+
+class _Request:
+	def __init__(self, artPath, mtime, size, callback, group):
+		self.artPath = artPath
+		self.mtime = mtime
+		self.size = size
+		self.callback = callback
+		self.group = group
+		self.bCanceled = False
+		self.image = None
+
+
+class AlbumArtCache(QThread):
+	"""
+	Loads album art thumbnails in a worker thread, and caches them on disk and in memory.
+	Quick guide:
+	Call Request() to get a thumbnail of an image, which is passed to a callback in the GUI thread.
+	Call Cancel() to cancel the requests in a group.
+	Call Stop() before the program exits.
+	"""
+	
+	imageLoaded = Signal(object)
+	
+	def __init__(self, cacheDir=None, maxCachedPixmaps=MAX_CACHED_PIXMAPS):
+		super(AlbumArtCache, self).__init__()
+		self.cacheDir = cacheDir if cacheDir is not None else gbl.thumbnailDir
+		self.maxCachedPixmaps = maxCachedPixmaps
+		self.pixmaps = OrderedDict()   # (art path, mtime, size): pixmap. Ordered from least to most recently used.
+		self.requests = queue.Queue()
+		self.lock = threading.Lock()   # Guards the latest requests.
+		self.latestRequests = {}   # Group: latest request made in that group.
+		self.imageLoaded.connect(self._OnImageLoaded)   # The cache object itself belongs to the GUI thread, so this is a queued connection.
+	
+	def Request(self, artPath, size, callback, group=None):
+		"""Get a thumbnail of an image, scaled to fit within a square of the given size, and run callback(pixmap) in the GUI thread. The pixmap is None if the image can't be loaded. If the thumbnail is in memory, the callback is run right away. If a group is given (any hashable value), earlier requests in the same group are canceled."""
+		if group is not None:
+			self.Cancel(group)
+		
+		try:
+			mtime = os.stat(artPath).st_mtime
+		except OSError:
+			mtime = None   # The worker will find that it can't be loaded.
+		pixmap = self.pixmaps.pop((artPath, mtime, size), None)
+		if pixmap is not None:
+			self.pixmaps[(artPath, mtime, size)] = pixmap   # Mark it as the most recently used.
+			callback(pixmap)
+			return
+		
+		request = _Request(artPath, mtime, size, callback, group)
+		if group is not None:
+			with self.lock:
+				self.latestRequests[group] = request
+		self.requests.put(request)
+	
+	def Cancel(self, group):
+		with self.lock:
+			request = self.latestRequests.pop(group, None)
+			if request is not None:
+				request.bCanceled = True
+	
+	def Stop(self):
+		"""Stop the worker thread after its current request, and wait for it to finish."""
+		self.requests.put(None)
+		self.wait()
+	
+	def GetThumbnailPath(self, artPath, mtime, size):
+		"""Get the path of the cached thumbnail of an image. The thumbnail may not exist."""
+		key = u'{}|{!r}|{}'.format(artPath, mtime, size)
+		return os.path.join(self.cacheDir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.png')
+	
+	def _LoadImage(self, artPath, mtime, size):
+		"""Load a thumbnail of an image with the given mtime, from the disk cache if possible. Runs in the worker thread. Returns None if the image can't be loaded."""
+		if mtime is None:
+			return None
+		
+		thumbnailPath = self.GetThumbnailPath(artPath, mtime, size)
+		image = QImage()
+		if image.load(thumbnailPath):
+			return image
+		
+		if not image.load(artPath):
+			return None
+		image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+		
+		try:
+			if not os.path.isdir(self.cacheDir):
+				os.makedirs(self.cacheDir)
+			image.save(thumbnailPath, 'PNG')   # A partly written thumbnail won't load, so it would just be made again.
+		except OSError:
+			pass
+		return image
+	
+	def run(self):
+		while True:
+			request = self.requests.get()
+			if request is None:
+				break
+			if request.bCanceled:
+				continue
+			
+			request.image = self._LoadImage(request.artPath, request.mtime, request.size)
+			if not request.bCanceled:
+				self.imageLoaded.emit(request)
+	
+	def _OnImageLoaded(self, request):
+		if request.bCanceled:   # It may have been canceled after it was loaded.
+			return
+		with self.lock:
+			if request.group is not None and self.latestRequests.get(request.group) is request:
+				del self.latestRequests[request.group]
+		
+		pixmap = None
+		if request.image is not None:
+			pixmap = QPixmap.fromImage(request.image)
+			key = (request.artPath, request.mtime, request.size)
+			self.pixmaps.pop(key, None)
+			if len(self.pixmaps) >= self.maxCachedPixmaps:
+				self.pixmaps.popitem(last=False)
+			self.pixmaps[key] = pixmap
+		request.callback(pixmap)
+
+
+_cache = None
+
+def GetAlbumArtCache():
+	"""Get the program's album art cache, starting its thread if this is the first time it's been asked for."""
+	global _cache
+	if _cache is None:
+		_cache = AlbumArtCache()
+		_cache.start()
+	return _cache
+
+def StopAlbumArtCache():
+	"""Stop the program's album art cache, if it was ever started."""
+	global _cache
+	if _cache is not None:
+		_cache.Stop()
+		_cache = None
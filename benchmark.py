@@ -0,0 +1,493 @@
+# Benchmarks
+#
+# Notes:
+#  A programmer's maintenance module, for timing kea's hot paths. Run it directly to print the
+# results; run it with --help for its options.
+#  The query plan check makes sure that none of the queries that are run most often (per file
+# during scans, or on every click in the interfaces) has to scan a whole table or index. Running this
+# module exits with an error if any of them do.
+#  The name resolution benchmark times the step of a library import that turns artist, album,
+# and genre names into IDs. The time taken per file should stay flat as the library grows. The
+# old linear-scan approach is timed alongside it, for comparison; its time per file grows with
+# the number of distinct names, making the import as a whole quadratic.
+#  The library benchmarks generate a synthetic music library of tiny MP3, Ogg Vorbis, FLAC, and WAV
+# files in a temp dir, and time walking, adding, rescanning, and removing it, along with the track
+# table queries, the dir tree, and the artist, album, and genre totals. They use a database of
+# their own in the same temp dir, so the real library is never touched. The generated files have
+# real headers and tags, but the Vorbis setup header and the audio itself are placeholders, so
+# they won't actually play. Since the files were just written, they'll all be in the OS's file
+# cache; the scan timings are for a warm cache.
+#  Reloading a track table (as sorting it, or clicking a dir, does) is timed the way the table
+# does it, through a query pager. The statement counts are printed afterwards: each query shape
+# should only be prepared once per connection, however many times it's reloaded.
+#  Each library benchmark is run several times, and the fastest time is kept. The results can be
+# saved as JSON, and compared against an earlier saved run, to catch regressions. Timings are only
+# comparable between runs on the same machine with the same library settings.
+
+
+from __future__ import print_function
+import sys, os, time, json, struct, shutil, tempfile, argparse, platform
+
+try:
+	import configparser
+except ImportError:
+	import ConfigParser as configparser
+
+import gbl_helper
+
+if __name__ == '__main__':
+	# Use a database of our own, in a temp dir. This has to come before anything that imports gbl.
+	_workDir = tempfile.mkdtemp(prefix='kea_benchmark_')
+	gbl_helper.programDir = os.path.dirname(os.path.abspath(__file__))
+	gbl_helper.bChangeDir = False
+	gbl_helper.dbPath = os.path.join(_workDir, 'data.db')
+
+import gbl
+import db
+import walker
+from walker import NameIDIndex
+from util import SepException
+import query_builder
+from query_builder import GetTrackQuery, TRACK_FIELDS
+from query_pager import QueryPager
+
+
+# Default library benchmark settings.
+FILE_NUM = 2000
+ARTIST_NUM = 50
+ALBUM_NUM = 200
+GENRE_NUM = 20
+DIR_DEPTH = 2
+FORMATS = ('mp3', 'ogg', 'flac', 'wav')
+REPEAT_NUM = 3
+TOLERANCE = 0.25   # How much slower than the baseline a benchmark can be (as a fraction) before it counts as a regression.
+
+# The version of the saved results format.
+RESULTS_VERSION = 1
+
+# Queries (with sample arguments) that must be answerable through indexes. The track table and shaped interface queries are made by the query builder, the same way the interfaces make them.
+_trackQuery = GetTrackQuery(['track', 'title', 'path'])
+_albumTrackQuery = query_builder.InsertAlbumSearchIntoQuery(_trackQuery, 'a')
+_albumTrackQuery.SetOrder([('track', None, False)])
+_artistAlbumQuery = query_builder.Query(['album'], 'AlbumContainsArtist, Album, Artist', ['AlbumContainsArtist.artistid=Artist.artistid AND AlbumContainsArtist.albumid=Album.albumid'], [('album', 'NOCASE', False)])
+HOT_QUERIES = [
+	("SELECT COUNT(*) FROM File WHERE path=?", ('/a.mp3',)),
+	("DELETE FROM File WHERE path=?", ('/a.mp3',)),
+	("SELECT path, length FROM File WHERE path IN (?, ?)", ('/a.mp3', '/b.mp3')),
+	("DELETE FROM File WHERE path IN (?, ?)", ('/a.mp3', '/b.mp3')),
+	("SELECT artistid, albumid, genreid FROM File WHERE path=?", ('/a.mp3',)),
+	("SELECT COUNT(*) FROM File WHERE artistid=?", (1,)),
+	("SELECT COUNT(*) FROM File WHERE albumid=?", (1,)),
+	("SELECT COUNT(*) FROM File WHERE genreid=?", (1,)),
+	("SELECT path, fileid, mtime, size, length FROM File WHERE path >= ? AND path < ?", ('/music/', '/music0')),
+	("SELECT COUNT(*), IFNULL(SUM(length), 0) FROM File WHERE artistid=?", (1,)),
+	("SELECT COUNT(*), IFNULL(SUM(length), 0) FROM File WHERE albumid=?", (1,)),
+	("SELECT trackCount, length FROM Dir WHERE dir=?", ('/music',)),
+]
+HOT_QUERIES += [(query.GetSQL(), query.GetArgs()) for query in (query_builder.InsertArtistSearchIntoQuery(_trackQuery, 'a'), _albumTrackQuery, query_builder.InsertDirSearchIntoQuery(_trackQuery, '/music'), query_builder.InsertArtistSearchIntoQuery(_artistAlbumQuery, 'a'))]
+
+
+def GetSyntheticTags(fileNum, tracksPerAlbum=10, albumsPerArtist=3, genreNum=50):
+	"""Get a list of [artist, album, genre] name lists, for a synthetic library in which the number of distinct artists and albums grows along with the number of files, as it does in real libraries."""
+	tags = []
+	for i in range(fileNum):
+		albumNum = i // tracksPerAlbum
+		tags.append(['Artist {}'.format(albumNum // albumsPerArtist), 'Album {}'.format(albumNum), 'Genre {}'.format(albumNum % genreNum)])
+	return tags
+
+def ResolveNamesLinearly(tags):
+	"""The old name-to-ID approach, which scans every name found so far for each file."""
+	maps = [{}, {}, {}]
+	nextIDs = [1, 1, 1]
+	for fileTags in tags:
+		for i in range(3):
+			id = None
+			for k, v in maps[i].items():
+				if v == fileTags[i]:
+					id = k
+					break
+			if id is None:
+				id = nextIDs[i]
+				maps[i][id] = fileTags[i]
+				nextIDs[i] += 1
+
+def ResolveNamesIndexed(tags):
+	"""The current name-to-ID approach, using NameIDIndex."""
+	indexes = [NameIDIndex([]), NameIDIndex([]), NameIDIndex([])]
+	for fileTags in tags:
+		for i in range(3):
+			indexes[i].GetID(fileTags[i])
+
+def TimeFunc(func, *args):
+	startTime = time.time()
+	func(*args)
+	return time.time() - startTime
+
+def BenchmarkNameResolution(fileNums=(1000, 2000, 4000, 8000, 16000), bIncludeLinear=True):
+	"""Time name resolution for a series of library sizes. Returns a list of (fileNum, indexedSeconds, linearSeconds) tuples, where linearSeconds is None if 'bIncludeLinear' isn't set."""
+	results = []
+	for fileNum in fileNums:
+		tags = GetSyntheticTags(fileNum)
+		indexedSeconds = TimeFunc(ResolveNamesIndexed, tags)
+		linearSeconds = TimeFunc(ResolveNamesLinearly, tags) if bIncludeLinear else None
+		results.append((fileNum, indexedSeconds, linearSeconds))
+	return results
+
+def PrintNameResolutionResults(results):
+	print('Name resolution (microseconds per file):')
+	print('{:>10} {:>10} {:>10}'.format('files', 'indexed', 'linear'))
+	for fileNum, indexedSeconds, linearSeconds in results:
+		linearStr = '{:10.2f}'.format(linearSeconds * 1e6 / fileNum) if linearSeconds is not None else '{:>10}'.format('-')
+		print('{:10d} {:10.2f} {}'.format(fileNum, indexedSeconds * 1e6 / fileNum, linearStr))
+
+
+def CheckQueryPlans(queries=HOT_QUERIES):
+	"""Get a list of (query, planDetail) tuples for each step of the given queries' plans that scans a whole table or index. The list should be empty."""
+	fullScans = []
+	for query, args in queries:
+		for planDetail in db.GetQueryPlan(query, args):
+			if db.BFullScan(planDetail):
+				fullScans.append((query, planDetail))
+	return fullScans
+
+def PrintQueryPlanResults(fullScans):
+	if len(fullScans) == 0:
+		print('Query plans: OK')
+	else:
+		print('Query plans: {} full scan(s):'.format(len(fullScans)))
+		for query, planDetail in fullScans:
+			print('  {}\n    {}'.format(query, planDetail))
+
+
+
+#  -------------------------
+# --- Synthetic music files
+#  -------------------------
+
+# MPEG-1 layer III, 128 kbps, 44.1 kHz: 1152 samples of silence in 417 bytes.
+MP3_FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+MP3_FRAME_SAMPLES = 1152
+
+# The ID3v2.4, Vorbis comment, and RIFF INFO names of the tags the generated files have.
+ID3_FRAME_IDS = (('TIT2', 'title'), ('TPE1', 'artist'), ('TALB', 'album'), ('TRCK', 'tracknumber'), ('TCON', 'genre'), ('TDRC', 'date'))
+RIFF_INFO_IDS = (('INAM', 'title'), ('IART', 'artist'), ('IPRD', 'album'), ('ITRK', 'tracknumber'), ('IGNR', 'genre'), ('ICRD', 'date'))
+
+
+def _SyncsafeInt(n):
+	"""Pack an int into the 4-byte, 7-bits-per-byte format that ID3v2 uses for sizes."""
+	return struct.pack('>4B', (n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f)
+
+def MakeMP3File(path, tags, seconds=1):
+	"""Make an MP3 file of silence with an ID3v2.4 tag. 'tags' is a dict of Unicode strings, using the keys 'title', 'artist', 'album', 'tracknumber', 'genre', and 'date'; missing keys are left out of the tag."""
+	body = b''
+	for frameID, key in ID3_FRAME_IDS:
+		if key in tags:
+			data = b'\x03' + tags[key].encode('utf-8')   # Text encoding 3 is UTF-8.
+			body += frameID.encode('ascii') + _SyncsafeInt(len(data)) + b'\x00\x00' + data
+	with open(path, 'wb') as file:
+		file.write(b'ID3\x04\x00\x00' + _SyncsafeInt(len(body)) + body)
+		file.write(MP3_FRAME * (int(seconds * 44100 // MP3_FRAME_SAMPLES) + 1))
+
+def _VorbisComment(tags, bFramingBit):
+	"""Make a Vorbis comment block, as used in both Ogg Vorbis and FLAC files. See MakeMP3File() for the tags."""
+	vendor = b'kea benchmark'
+	comments = [u'{}={}'.format(key.upper(), tags[key]).encode('utf-8') for frameID, key in ID3_FRAME_IDS if key in tags]
+	data = struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', len(comments)) + b''.join(struct.pack('<I', len(comment)) + comment for comment in comments)
+	return data + b'\x01' if bFramingBit else data
+
+def _MakeOggCRCTable():
+	table = []
+	for i in range(256):
+		crc = i << 24
+		for j in range(8):
+			crc = (crc << 1) ^ 0x04c11db7 if crc & 0x80000000 else crc << 1
+		table.append(crc & 0xffffffff)
+	return table
+
+_OGG_CRC_TABLE = _MakeOggCRCTable()
+
+def _OggPage(packets, seqNum, granulePos, headerType):
+	"""Make an Ogg page holding some complete packets. 'headerType' is 2 for the first page of a stream and 4 for the last."""
+	lacing = []
+	for packet in packets:
+		lacing.extend([255] * (len(packet) // 255) + [len(packet) % 255])
+	page = b'OggS' + struct.pack('<BBqIII', 0, headerType, granulePos, 1, seqNum, 0) + struct.pack('<B', len(lacing)) + struct.pack('<{}B'.format(len(lacing)), *lacing) + b''.join(packets)
+	crc = 0
+	for byte in bytearray(page):
+		crc = ((crc << 8) & 0xffffffff) ^ _OGG_CRC_TABLE[(crc >> 24) ^ byte]
+	return page[:22] + struct.pack('<I', crc) + page[26:]
+
+def MakeOggFile(path, tags, seconds=1):
+	"""Make an Ogg Vorbis file with Vorbis comment tags. The identification and comment headers are real, and the length is given by the last page, but the setup header and audio are placeholders. See MakeMP3File() for the tags."""
+	rate = 44100
+	identHeader = b'\x01vorbis' + struct.pack('<IBIiiiBB', 0, 1, rate, 0, 128000, 0, 0xb8, 1)   # Vorbis version 0, mono, block sizes 256 and 2048.
+	commentHeader = b'\x03vorbis' + _VorbisComment(tags, True)
+	with open(path, 'wb') as file:
+		file.write(_OggPage([identHeader], 0, 0, 2))
+		file.write(_OggPage([commentHeader, b'\x05vorbis\x00'], 1, 0, 0))
+		file.write(_OggPage([b'\x00'], 2, int(seconds * rate), 4))
+
+def _FLACBlockHeader(blockType, length, bLast):
+	return struct.pack('>B', blockType | 0x80 if bLast else blockType) + struct.pack('>I', length)[1:]
+
+def MakeFLACFile(path, tags, seconds=1):
+	"""Make a FLAC file with a stream info block and Vorbis comment tags, but no audio frames. See MakeMP3File() for the tags."""
+	rate = 44100
+	# 20 bits of sample rate, 3 bits of channels - 1, 5 bits of bits per sample - 1, and 36 bits of sample count.
+	format = (rate << 44) | (0 << 41) | (15 << 36) | int(seconds * rate)
+	streamInfo = struct.pack('>HH', 4096, 4096) + b'\x00' * 6 + struct.pack('>Q', format) + b'\x00' * 16   # No frame sizes or MD5 signature.
+	comment = _VorbisComment(tags, False)
+	with open(path, 'wb') as file:
+		file.write(b'fLaC' + _FLACBlockHeader(0, len(streamInfo), False) + streamInfo + _FLACBlockHeader(4, len(comment), True) + comment)
+
+def _RIFFChunk(chunkID, data):
+	chunk = chunkID.encode('ascii') + struct.pack('<I', len(data)) + data
+	return chunk + b'\x00' if len(data) % 2 == 1 else chunk
+
+def MakeWAVFile(path, tags, seconds=1):
+	"""Make a WAV file of 8 kHz mono 8-bit silence, with the usual 44-byte header, and the tags in a LIST INFO chunk after the audio. See MakeMP3File() for the tags."""
+	rate = 8000
+	info = b'INFO' + b''.join(_RIFFChunk(infoID, tags[key].encode('utf-8') + b'\x00') for infoID, key in RIFF_INFO_IDS if key in tags)
+	chunks = _RIFFChunk('fmt ', struct.pack('<HHIIHH', 1, 1, rate, rate, 1, 8)) + _RIFFChunk('data', b'\x80' * int(seconds * rate)) + _RIFFChunk('LIST', info)
+	with open(path, 'wb') as file:
+		file.write(b'RIFF' + struct.pack('<I', 4 + len(chunks)) + b'WAVE' + chunks)
+
+FILE_MAKERS = {'mp3': MakeMP3File, 'ogg': MakeOggFile, 'flac': MakeFLACFile, 'wav': MakeWAVFile}
+
+
+def GenerateLibrary(root, fileNum=FILE_NUM, artistNum=ARTIST_NUM, albumNum=ALBUM_NUM, genreNum=GENRE_NUM, dirDepth=DIR_DEPTH, formats=FORMATS, seconds=1):
+	"""Generate a synthetic music library in a dir, and return the generated files' paths. The files are spread evenly over the albums, and the albums over the artists and genres, with the formats taking turns. 'dirDepth' is the number of dirs between the root and the files: 0 puts every file in the root, 1 gives each album a dir, 2 puts the album dirs in artist dirs, 3 puts those in genre dirs, and any more levels are disc dirs inside the album dirs."""
+	albumNum = max(1, min(albumNum, fileNum))
+	madeDirs = set()
+	paths = []
+	for i in range(fileNum):
+		albumIndex = i * albumNum // fileNum
+		trackNum = i - (albumIndex * fileNum + albumNum - 1) // albumNum + 1
+		genre, artist, album = u'Genre {}'.format(albumIndex % genreNum), u'Artist {}'.format(albumIndex % artistNum), u'Album {}'.format(albumIndex)
+		
+		dir = os.path.join(root, *([genre, artist, album][max(0, 3 - dirDepth):] + [u'Disc 1'] * max(0, dirDepth - 3)))
+		if dir not in madeDirs:
+			if not os.path.isdir(dir):
+				os.makedirs(dir)
+			madeDirs.add(dir)
+		
+		format = formats[i % len(formats)]
+		path = os.path.join(dir, u'{:02d} Track {}.{}'.format(trackNum, i, format))
+		tags = {'title': u'Track {}'.format(i), 'artist': artist, 'album': album, 'tracknumber': u'{}'.format(trackNum), 'genre': genre, 'date': u'{}'.format(1970 + albumIndex % 50)}
+		FILE_MAKERS[format](path, tags, seconds)
+		paths.append(path)
+	return paths
+
+
+#  ----------------------
+# --- Library benchmarks
+#  ----------------------
+
+def GetTrackTableQuery(interfaceConfigPath):
+	"""Get the track table query that the rectangular interface's MainTable.LoadConfigFile() builds from its config file's columns, with its default sort order."""
+	config = configparser.RawConfigParser()
+	config.read(interfaceConfigPath)
+	columns = []
+	i = 0
+	while config.has_option('Table', 'c' + str(i)):
+		columns.append(TRACK_FIELDS[config.get('Table', 'c' + str(i))])
+		i += 1
+	if TRACK_FIELDS['path'] not in columns:
+		columns.append('path')
+	return GetTrackQuery(columns + ["NULL AS ''"])
+
+def GetTrackTableQueries(interfaceConfigPath, sampleDir, sampleArtist, sampleText):
+	"""Get a list of (name, sql, args) tuples for the track table queries that are run as the user sorts the table and clicks around the library. The searches are added by the same query_builder functions the interfaces use."""
+	query = GetTrackTableQuery(interfaceConfigPath)
+	sortedQuery = query.Copy()
+	sortedQuery.SetOrder([('title', 'NOCASE', True)])
+	queries = [
+		('table_all', query),
+		('table_sorted_by_title', sortedQuery),
+		('table_dir', query_builder.InsertDirSearchIntoQuery(query, sampleDir)),
+		('table_artist', query_builder.InsertArtistSearchIntoQuery(query, sampleArtist)),
+		('table_text_search', query_builder.InsertTextSearchIntoQuery(query, sampleText)),
+	]
+	return [(name, query.GetSQL(), query.GetArgs()) for name, query in queries]
+
+def RunQuery(query, args):
+	return db.c.execute(query, args).fetchall()
+
+def LoadTable(query):
+	"""Load a query the way a track table does when it's reloaded: its column names, its row count, and its first page (see LazyQueryModel.SetQuery())."""
+	pager = QueryPager(query, 'File.fileid')
+	pager.GetRowCount()
+	pager.GetValue(0, 0)
+
+def LoadDirTree():
+	"""Run the dir table queries that DirSystemModel.Reload() runs, plus those for expanding each branch just below the library dirs."""
+	for rootDir in db.GetLibraryDirs():
+		db.GetDirInfo(rootDir)
+		for subdir, trackCount, bHasSubdirs in db.GetSubdirs(rootDir):
+			if bHasSubdirs:
+				db.GetSubdirs(subdir)
+
+def TimeDirModelReload():
+	"""Time DirSystemModel.Reload() (as run when the model is made) and the expansion of the library dirs. Returns None if there's no Qt library to make the model with."""
+	try:
+		from dir_system_model import DirSystemModel
+	except (ImportError, SepException):
+		return None
+	config = configparser.RawConfigParser()
+	config.add_section('Program')
+	config.set('Program', 'bRemoveSingleTreeRootNode', 'false')
+	
+	startTime = time.time()
+	model = DirSystemModel(None, config)
+	for row in range(model.rowCount()):
+		model.AllowExpandLayer(model.index(row, 0))
+	return time.time() - startTime
+
+def BenchmarkLibrary(libraryDir, repeatNum=REPEAT_NUM, interfaceConfigPath=None):
+	"""Time the library operations on a generated library, running through all of them 'repeatNum' times. The library dir must not be in the database beforehand, and it's removed again afterwards. Returns a dict of benchmark names and their fastest times, in seconds."""
+	if interfaceConfigPath is None:
+		interfaceConfigPath = os.path.join(gbl.interfacesDir, 'rectangular', 'rectangular' + gbl.configExt)
+	dir = walker.LibraryPathFormat(libraryDir)
+	times = {}
+	
+	def Record(name, seconds):
+		times[name] = min(seconds, times.get(name, seconds))
+	
+	for i in range(repeatNum):
+		startTime = time.time()
+		paths = walker.GetMusicFiles(dir)
+		Record('walk', time.time() - startTime)
+		
+		db.AddLibraryDirToList(dir)
+		Record('add', TimeFunc(walker._AddFilesToDatabase, paths, False))   # There can't be any clashes in a new library dir.
+		Record('rescan', TimeFunc(walker.RescanLibraryDirOrSubdir, dir, False))
+		Record('rescan_incremental', TimeFunc(walker.IncrementalRescanLibraryDirOrSubdir, dir))
+		
+		for name, query, args in GetTrackTableQueries(interfaceConfigPath, os.path.dirname(min(paths)), u'Artist 0', u'track 1'):
+			Record(name, TimeFunc(RunQuery, query, args))
+		Record('table_reload', TimeFunc(LoadTable, query_builder.InsertDirSearchIntoQuery(GetTrackTableQuery(interfaceConfigPath), os.path.dirname(max(paths)))))
+		Record('dir_tree', TimeFunc(LoadDirTree))
+		Record('totals_artists', TimeFunc(db.GetArtistTotals))
+		Record('totals_albums', TimeFunc(db.GetAlbumTotals))
+		Record('totals_genres', TimeFunc(db.GetGenreTotals))
+		seconds = TimeDirModelReload()
+		if seconds is not None:
+			Record('dir_model_reload', seconds)
+		
+		Record('rescan_tags', TimeFunc(walker.RescanLibraryDirOrSubdir, dir, True))
+		Record('remove', TimeFunc(walker.RemoveLibraryDirOrSubdirFromDatabase, dir))
+	return times
+
+def PrintLibraryResults(times):
+	print('Library benchmarks (milliseconds):')
+	for name in sorted(times):
+		print('  {:<24} {:10.2f}'.format(name, times[name] * 1000))
+
+def PrintStatementResults():
+	firstRuns, repeats = db.GetStatementStats()
+	print('Table statements: {} prepared, {} reused'.format(firstRuns, repeats))
+
+
+#  -----------------------
+# --- Saving and comparing
+#  -----------------------
+
+def MakeResults(settings, times):
+	"""Make a JSON-friendly dict of benchmark times, along with the settings they were run with and what they were run on."""
+	return {'version': RESULTS_VERSION, 'settings': settings, 'python': platform.python_version(), 'sqlite': db.sqlite3.sqlite_version, 'platform': platform.platform(), 'times': times}
+
+def SaveResults(path, results):
+	with open(path, 'w') as file:
+		json.dump(results, file, indent=1, sort_keys=True)
+
+def LoadResults(path):
+	with open(path) as file:
+		return json.load(file)
+
+def CompareResults(times, baselineTimes, tolerance=TOLERANCE):
+	"""Compare benchmark times against baseline times. Returns a list of (name, baselineSeconds, seconds, bRegression) tuples, sorted by name, where either time is None if that benchmark is missing from that set of times. A benchmark is a regression if it's more than 'tolerance' (a fraction) slower than its baseline."""
+	comparison = []
+	for name in sorted(set(times) | set(baselineTimes)):
+		seconds = times.get(name)
+		baselineSeconds = baselineTimes.get(name)
+		bRegression = seconds is not None and baselineSeconds is not None and seconds > baselineSeconds * (1 + tolerance)
+		comparison.append((name, baselineSeconds, seconds, bRegression))
+	return comparison
+
+def PrintComparison(comparison):
+	print('Compared to the baseline (milliseconds):')
+	print('  {:<24} {:>10} {:>10} {:>8}'.format('', 'baseline', 'current', 'change'))
+	for name, baselineSeconds, seconds, bRegression in comparison:
+		baselineStr = '{:10.2f}'.format(baselineSeconds * 1000) if baselineSeconds is not None else '{:>10}'.format('-')
+		currentStr = '{:10.2f}'.format(seconds * 1000) if seconds is not None else '{:>10}'.format('-')
+		changeStr = '{:+7.0f}%'.format((seconds / baselineSeconds - 1) * 100) if seconds is not None and baselineSeconds else '{:>8}'.format('-')
+		print('  {:<24} {} {} {}{}'.format(name, baselineStr, currentStr, changeStr, '  REGRESSION' if bRegression else ''))
+
+
+def GetArgParser():
+	parser = argparse.ArgumentParser(description='Time kea\'s hot paths on a synthetic music library.')
+	parser.add_argument('--files', dest='fileNum', type=int, default=FILE_NUM, help='the number of music files to generate (default: %(default)s)')
+	parser.add_argument('--artists', dest='artistNum', type=int, default=ARTIST_NUM, help='the number of distinct artists (default: %(default)s)')
+	parser.add_argument('--albums', dest='albumNum', type=int, default=ALBUM_NUM, help='the number of distinct albums (default: %(default)s)')
+	parser.add_argument('--genres', dest='genreNum', type=int, default=GENRE_NUM, help='the number of distinct genres (default: %(default)s)')
+	parser.add_argument('--depth', dest='dirDepth', type=int, default=DIR_DEPTH, help='the number of dirs between the library dir and the files (default: %(default)s)')
+	parser.add_argument('--formats', default=','.join(FORMATS), help='a comma-separated list of the file formats to generate (default: %(default)s)')
+	parser.add_argument('--repeat', dest='repeatNum', type=int, default=REPEAT_NUM, help='the number of times to run each library benchmark, keeping the fastest (default: %(default)s)')
+	parser.add_argument('--output', dest='outputPath', help='save the results to a JSON file')
+	parser.add_argument('--baseline', dest='baselinePath', help='compare the results to those saved in a JSON file, and fail if any are slower')
+	parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='how much slower than the baseline a benchmark can be, as a fraction (default: %(default)s)')
+	parser.add_argument('--skip-names', dest='bSkipNames', action='store_true', help='skip the name resolution benchmark')
+	parser.add_argument('--keep', dest='bKeep', action='store_true', help='keep the generated library and database')
+	return parser
+
+def main(workDir, argv=None):
+	"""Run the benchmarks, using a dir that holds the benchmark database and nothing else. Returns 1 if any query plans scan whole tables or any benchmarks regressed, and 0 otherwise."""
+	parser = GetArgParser()
+	args = parser.parse_args(argv)
+	formats = tuple(format.strip().lower() for format in args.formats.split(','))
+	for format in formats:
+		if format not in FILE_MAKERS:
+			parser.error('unknown format: {}'.format(format))
+	if min(args.fileNum, args.artistNum, args.albumNum, args.genreNum, args.repeatNum) < 1 or args.dirDepth < 0:
+		parser.error('the counts must be positive, and the depth can\'t be negative')
+	
+	try:
+		fullScans = CheckQueryPlans()
+		PrintQueryPlanResults(fullScans)
+		if not args.bSkipNames:
+			PrintNameResolutionResults(BenchmarkNameResolution())
+		
+		settings = {'files': args.fileNum, 'artists': args.artistNum, 'albums': args.albumNum, 'genres': args.genreNum, 'depth': args.dirDepth, 'formats': list(formats), 'repeat': args.repeatNum}
+		libraryDir = os.path.join(workDir, 'library')
+		print('Generating {} files in {}'.format(args.fileNum, libraryDir))
+		GenerateLibrary(libraryDir, args.fileNum, args.artistNum, args.albumNum, args.genreNum, args.dirDepth, formats)
+		db.ResetStatementStats()
+		times = BenchmarkLibrary(libraryDir, args.repeatNum)
+		PrintLibraryResults(times)
+		PrintStatementResults()
+		
+		results = MakeResults(settings, times)
+		if args.outputPath is not None:
+			SaveResults(args.outputPath, results)
+			print('Saved the results to {}'.format(args.outputPath))
+		
+		bRegressed = False
+		if args.baselinePath is not None:
+			baseline = LoadResults(args.baselinePath)
+			if baseline.get('settings') != settings:
+				print('Warning: The baseline was run with different settings: {}'.format(baseline.get('settings')))
+			comparison = CompareResults(times, baseline.get('times', {}), args.tolerance)
+			PrintComparison(comparison)
+			bRegressed = any(bRegression for name, baselineSeconds, seconds, bRegression in comparison)
+	finally:
+		db.CloseConnections()
+		if args.bKeep:
+			print('Kept the benchmark files in {}'.format(workDir))
+		else:
+			shutil.rmtree(workDir, ignore_errors=True)
+	
+	return 1 if len(fullScans) > 0 or bRegressed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(_workDir))
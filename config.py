@@ -22,10 +22,19 @@ try:
 except:
 	import ConfigParser as configparser
 
-from util import InterfaceSetupError, PathNotExistError, SQ
+from util import InterfaceSetupError, PathNotExistError, ConfigValueError, SQ
 import gbl
 
 
+# Notable default values for optional program config file settings.
+TAG_READER_WORKERS = 0   # 0 means one worker per CPU.
+TAG_READER_POOL = 'auto'   # Threads in the GUI, processes in command-line tools. See walker.GetTagReaderPool().
+SCAN_CHUNK_SIZE = 2000   # Files.
+B_FOLLOW_DIR_LINKS = False
+B_WATCH_LIBRARY = True
+WATCHER_POLL_INTERVAL = 30   # Seconds.
+
+
 def GetDefaultInterfaceName():
 	if not os.path.isfile(gbl.configPath):
 		raise PathNotExistError(gbl.configPath)
@@ -40,6 +49,69 @@ def SetDefaultInterfaceName(interfaceName):
 	with open(gbl.configPath, 'w') as outFile:
 		config.write(outFile)
 
+def GetTagReaderSetup():
+	"""Get the number of workers used to read music file tags ('Library->tagReaderWorkers', where 0 means one per CPU and 1 means no workers at all) and the kind of worker pool to use ('Library->tagReaderPool', either 'process', 'thread', or 'auto'). Defaults are used for missing options, and if the program config file doesn't exist."""
+	workers = TAG_READER_WORKERS
+	poolType = TAG_READER_POOL
+	config = configparser.ConfigParser(allow_no_value=True)
+	config.read(gbl.configPath)
+	try:
+		workers = int(config.get('Library', 'tagReaderWorkers'))
+	except (configparser.NoSectionError, configparser.NoOptionError):
+		pass
+	except ValueError:
+		raise ConfigValueError('Library->tagReaderWorkers')
+	try:
+		poolType = config.get('Library', 'tagReaderPool').lower()
+	except (configparser.NoSectionError, configparser.NoOptionError):
+		pass
+	if poolType not in ('process', 'thread', 'auto'):
+		raise ConfigValueError('Library->tagReaderPool')
+	return workers, poolType
+
+def GetScanChunkSize():
+	"""Get the number of files whose tags are stored and committed at a time while files are being added to the library ('Library->scanChunkSize'). The default is used if the option is missing, or if the program config file doesn't exist."""
+	config = configparser.ConfigParser(allow_no_value=True)
+	config.read(gbl.configPath)
+	try:
+		chunkSize = int(config.get('Library', 'scanChunkSize'))
+	except (configparser.NoSectionError, configparser.NoOptionError):
+		return SCAN_CHUNK_SIZE
+	except ValueError:
+		raise ConfigValueError('Library->scanChunkSize')
+	if chunkSize < 1:
+		raise ConfigValueError('Library->scanChunkSize')
+	return chunkSize
+
+def GetBFollowDirLinks():
+	"""Should linked dirs inside library dirs be walked? ('Library->bFollowDirLinks'.) The default is used if the option is missing, or if the program config file doesn't exist."""
+	config = configparser.ConfigParser(allow_no_value=True)
+	config.read(gbl.configPath)
+	try:
+		return config.get('Library', 'bFollowDirLinks').lower() == 'true'
+	except (configparser.NoSectionError, configparser.NoOptionError):
+		return B_FOLLOW_DIR_LINKS
+
+def GetWatcherSetup():
+	"""Get whether library dirs should be watched for changes while the program runs ('Library->bWatchLibrary'), and how many seconds to wait between checks when changes can't be watched directly and have to be polled for ('Library->watcherPollInterval'). Defaults are used for missing options, and if the program config file doesn't exist."""
+	bWatchLibrary = B_WATCH_LIBRARY
+	pollInterval = WATCHER_POLL_INTERVAL
+	config = configparser.ConfigParser(allow_no_value=True)
+	config.read(gbl.configPath)
+	try:
+		bWatchLibrary = config.get('Library', 'bWatchLibrary').lower() == 'true'
+	except (configparser.NoSectionError, configparser.NoOptionError):
+		pass
+	try:
+		pollInterval = float(config.get('Library', 'watcherPollInterval'))
+	except (configparser.NoSectionError, configparser.NoOptionError):
+		pass
+	except ValueError:
+		raise ConfigValueError('Library->watcherPollInterval')
+	if pollInterval <= 0:
+		raise ConfigValueError('Library->watcherPollInterval')
+	return bWatchLibrary, pollInterval
+
 def GetInterfaceList():
 	config = configparser.ConfigParser(allow_no_value=True)
 	
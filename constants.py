@@ -7,6 +7,8 @@ UNSORTED, SORTED_ASC, SORTED_DESC = 0, 1, 2
 
 # Tuple positions for tag data.
 DB_TITLE, DB_ARTIST_ID, DB_ALBUM_ID, DB_TRACK, DB_LENGTH, DB_YEAR, DB_GENRE_ID, DB_PATH = 0, 1, 2, 3, 4, 5, 6, 7
+# File fingerprint positions, when tag data is stored along with a file's fingerprint.
+DB_MTIME, DB_SIZE = 8, 9
 
 # These positions are the same regardless of whether we're dealing with the string or the ID.
 DB_ARTIST = DB_ARTIST_ID
@@ -15,6 +17,9 @@ DB_GENRE = DB_GENRE_ID
 
 FAILURE, SUCCESS, PARTIAL_SUCCESS = 0, 1, 2
 
+# Kinds of library scans, as stored in the scan journal.
+SCAN_ADD, SCAN_RESCAN, SCAN_RESCAN_TAGS = 'add', 'rescan', 'rescan tags'
+
 # Win32 constants
 VK_NUMPAD1, VK_NUMPAD2, VK_NUMPAD3, VK_NUMPAD4, VK_NUMPAD5, VK_NUMPAD6, VK_NUMPAD7, VK_NUMPAD8, VK_NUMPAD9 = range(97, 106)
 WM_HOTKEY = 786
\ No newline at end of file
@@ -12,13 +12,28 @@
 # the list and this dir is added instead. If neither of these is the case, the dir is added to the
 # list as normal. There's no great reason for all this behavior, it's simply a useful way of
 # keeping a concise visual list of the contents of the music library.
+#  The database is kept in write-ahead log (WAL) mode, so that reading it never waits for a write
+# in progress, and a write never waits for readers. The module's own connection (conn) is the
+# program's one writer, and everything that changes the database goes through it. Reads that
+# don't need to see uncommitted changes can use a reader connection instead (see
+# GetReaderConnection()), and other threads must use connections of their own anyway. In WAL mode,
+# with synchronous=NORMAL, commits don't wait for the disk; only checkpoints, which copy the log
+# back into the database file, do. A commit can be lost in a power failure, but the database can't
+# be corrupted.
+#  Each connection keeps the statements it has prepared (up to STATEMENT_CACHE_SIZE of them), keyed
+# by their SQL text, and reuses them when the same SQL is run again, so only the arguments have to
+# be bound. The table queries are built with their values as parameters (see query_builder), so
+# reloading a table, or loading another dir or artist into it, runs the same SQL with other
+# arguments. The table layer runs its queries through ExecuteCounted(), which counts how many of
+# them had to be prepared and how many could reuse a prepared statement (see GetStatementStats()).
 #
 # To do:
 #  Make it so that removing a library dir removes the tags within?
 
 
-import sys, os, sqlite3
-from util import SlashedDir
+import sys, os, re, time, sqlite3, threading
+from collections import OrderedDict
+from util import SlashedDir, GetDirPathRange, GetParentDir, BProcessRunning
 import gbl
 from constants import FAILURE, SUCCESS, PARTIAL_SUCCESS
 
@@ -28,20 +43,280 @@ from constants import FAILURE, SUCCESS, PARTIAL_SUCCESS
 #  -------------------
 
 
+# The columns of the full-text search table, which can be named in searches (as in 'artist:word').
+SEARCH_COLUMNS = ('title', 'artist', 'album', 'genre', 'path')
+
+# The version of the table layout created by CreateTables(). Increase this whenever the layout changes, and add a matching step to UpgradeTables().
+SCHEMA_VERSION = 7
+
+# The columns of the File table. Lengths are stored in milliseconds, and only turned into text for display.
+FILE_COLUMNS = 'fileid INTEGER PRIMARY KEY, title TEXT, artistid INT, albumid INT, track INT, length INT, year INT, genreid INT, path TEXT, mtime REAL, size INT, FOREIGN KEY(artistid) REFERENCES Artist(artistid), FOREIGN KEY(albumid) REFERENCES Album(albumid), FOREIGN KEY(genreid) REFERENCES Genre(genreid)'
+
+# Connection settings. See Connect().
+BUSY_TIMEOUT = 10.0   # How many seconds to wait for another connection's lock before giving up.
+CACHE_SIZE = 16384   # The page cache size of each connection, in kilobytes.
+MMAP_SIZE = 256 * 1024 * 1024   # How much of the database file can be memory-mapped, in bytes.
+STATEMENT_CACHE_SIZE = 128   # How many prepared statements each connection keeps.
+
+
+def Connect(path=None, bReadOnly=False):
+	"""Open a new connection to the database, or to another database file, with the program's settings: a busy timeout, a larger page cache and statement cache, memory-mapped reads, and temporary tables kept in memory. The writer connection also puts the database into WAL mode, which is stored in the database file, so only it needs to. A read-only connection can't change the database at all. Connections can only be used in the thread that opened them."""
+	connection = sqlite3.connect(path if path is not None else gbl.dbPath, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE)   # Note that this will create the database file if it doesn't exist.
+	if bReadOnly:
+		connection.execute("PRAGMA query_only = ON")
+	else:
+		connection.execute("PRAGMA journal_mode = WAL")   # This leaves the journal mode as it was if WAL isn't possible, as on some network filesystems.
+	connection.execute("PRAGMA synchronous = NORMAL")
+	connection.execute("PRAGMA cache_size = {}".format(-CACHE_SIZE))   # Negative sizes are in kilobytes rather than pages.
+	connection.execute("PRAGMA mmap_size = {}".format(MMAP_SIZE))
+	connection.execute("PRAGMA temp_store = MEMORY")
+	return connection
+
+_readers = threading.local()
+
+def GetReaderConnection():
+	"""Get the current thread's read-only connection to the database, opening it if this is the first time the thread has asked for it. Reads through it don't wait for the writer, but they don't see the writer's changes until they're committed."""
+	connection = getattr(_readers, 'conn', None)
+	if connection is None:
+		connection = _readers.conn = Connect(bReadOnly=True)
+	return connection
+
+_dataVersion = None
+
+def BChangedByOtherConnections():
+	"""Has another process, such as kea-index, committed changes to the database since the last call? The first call only takes note of the database's state, and returns False. Changes made through this process's writer connection aren't counted. Must be called from the thread that uses the writer connection."""
+	global _dataVersion
+	dataVersion = conn.execute("PRAGMA data_version").fetchone()[0]   # This only changes when other connections commit.
+	bChanged = _dataVersion is not None and dataVersion != _dataVersion
+	_dataVersion = dataVersion
+	return bChanged
+
+def CloseConnections():
+	"""Commit any changes and close the writer connection, along with the current thread's reader connection, if it has one. Call this when the program exits, after the other threads' connections have been closed. The last connection to close checkpoints the write-ahead log into the database file."""
+	connection = getattr(_readers, 'conn', None)
+	if connection is not None:
+		ForgetConnectionStatements(connection)
+		connection.close()
+		_readers.conn = None
+	ForgetConnectionStatements(conn)
+	conn.commit()
+	conn.close()
+
+_statementLock = threading.Lock()   # Guards the statement records and counts, since connections in several threads use them.
+_connectionStatements = {}   # Connection: OrderedDict of the SQL texts run on it through ExecuteCounted(), from least to most recently run.
+_statementFirstRuns = 0
+_statementRepeats = 0
+
+def ExecuteCounted(connection, sql, args=()):
+	"""Run a statement on a connection, as connection.execute() does, counting whether the connection ran the same SQL text recently enough to still have it prepared, or has to prepare it. sqlite3 doesn't report on its statement cache, so this keeps the same record it does: the last STATEMENT_CACHE_SIZE SQL texts run on each connection. Returns the cursor."""
+	global _statementFirstRuns, _statementRepeats
+	with _statementLock:
+		sqlTexts = _connectionStatements.setdefault(connection, OrderedDict())
+		if sql in sqlTexts:
+			del sqlTexts[sql]
+			_statementRepeats += 1
+		else:
+			_statementFirstRuns += 1
+			if len(sqlTexts) >= STATEMENT_CACHE_SIZE:
+				sqlTexts.popitem(last=False)
+		sqlTexts[sql] = None   # Mark it as the most recently run.
+	return connection.execute(sql, args)
+
+def ForgetConnectionStatements(connection):
+	"""Stop keeping a record of the statements run on a connection through ExecuteCounted(). Call this before closing the connection."""
+	with _statementLock:
+		_connectionStatements.pop(connection, None)
+
+def GetStatementStats():
+	"""A programmer's maintenance function. Returns the (firstRuns, repeats) of the statements run through ExecuteCounted() since the program started, or since ResetStatementStats() was called: how many times a connection had to prepare a statement, and how many times it reused one it had already prepared."""
+	with _statementLock:
+		return _statementFirstRuns, _statementRepeats
+
+def ResetStatementStats():
+	"""Set the statement counts back to zero. The records of which statements each connection has prepared are kept."""
+	global _statementFirstRuns, _statementRepeats
+	with _statementLock:
+		_statementFirstRuns = _statementRepeats = 0
+
+
 def BTableExists(tableName):
 	return c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (tableName,)).fetchone() is not None
 
+def GetSchemaVersion():
+	"""Get the version of the table layout used by the database, as stored in the database itself. Databases from before versioning was introduced are version 0."""
+	return c.execute("PRAGMA user_version").fetchone()[0]
+
+def SetSchemaVersion(version):
+	c.execute("PRAGMA user_version = {}".format(int(version)))
+
 def CreateTables():
 	"""Create the tables for the database, with the unchecked assumption that they're currently nonexistent. No error will be raised if the list of music library dirs already exists. Doesn't commit changes to the database."""
 	# Note: For a CREATE TABLE statement, you MUST use INTEGER PRIMARY KEY, not INT PRIMARY KEY, or the rowid will show up as NULL. Note that this only seems to affect tables that have more than one non-rowid field.
-	c.execute("CREATE TABLE File (fileid INTEGER PRIMARY KEY, title TEXT, artistid INT, albumid INT, track INT, length TEXT, year INT, genreid INT, path TEXT, FOREIGN KEY(artistid) REFERENCES Artist(artistid), FOREIGN KEY(albumid) REFERENCES Album(albumid), FOREIGN KEY(genreid) REFERENCES Genre(genreid))")
+	# Note: The mtime and size of each file are stored so that rescans can tell which files have changed since their tags were read.
+	c.execute("CREATE TABLE File ({})".format(FILE_COLUMNS))
 	c.execute("CREATE TABLE Artist (artistid INTEGER PRIMARY KEY, artist TEXT)")
 	c.execute("CREATE TABLE Album (albumid INTEGER PRIMARY KEY, album TEXT)")
 	c.execute("CREATE TABLE AlbumContainsArtist (albumid INT, artistid INT, PRIMARY KEY(albumid, artistid))")
 	c.execute("CREATE TABLE Genre (genreid INTEGER PRIMARY KEY, genre TEXT)")
 	
+	CreateIndexes()
+	CreateDirTable()
+	if bFullTextSearch:
+		CreateSearchTable()
+	
 	if not BTableExists('LibraryDirs'):
 		c.execute("CREATE TABLE LibraryDirs (dirid INTEGER PRIMARY KEY, dir TEXT)")
+	if not BTableExists('WatchedDirs'):
+		CreateWatchedDirsTable()
+	if not BTableExists('ScanJournal'):
+		CreateScanJournalTable()
+	
+	SetSchemaVersion(SCHEMA_VERSION)
+
+def CreateIndexes():
+	"""Create the indexes for the tag tables. Paths and artist, album, and genre names are unique, which lets lookups by them be index searches, as well as lookups of the files that use a particular artist, album, or genre. The artist, album, and genre indexes also hold each file's length, so the totals of each artist, album, or genre (see GetArtistTotals()) can be added up from the index alone. Doesn't commit changes to the database."""
+	c.execute("CREATE UNIQUE INDEX IF NOT EXISTS FilePathIndex ON File (path)")
+	c.execute("CREATE INDEX IF NOT EXISTS FileArtistIndex ON File (artistid, length)")
+	c.execute("CREATE INDEX IF NOT EXISTS FileAlbumIndex ON File (albumid, length)")
+	c.execute("CREATE INDEX IF NOT EXISTS FileGenreIndex ON File (genreid, length)")
+	c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ArtistNameIndex ON Artist (artist)")
+	c.execute("CREATE UNIQUE INDEX IF NOT EXISTS AlbumNameIndex ON Album (album)")
+	c.execute("CREATE UNIQUE INDEX IF NOT EXISTS GenreNameIndex ON Genre (genre)")
+	c.execute("CREATE INDEX IF NOT EXISTS AlbumContainsArtistArtistIndex ON AlbumContainsArtist (artistid)")   # The primary key already covers lookups by album.
+
+def CreateWatchedDirsTable():
+	"""Create the table of dirs watched by the library watcher, along with their mtimes as of the last time the watcher checked them. Like the list of library dirs, this isn't reset along with the tags. Doesn't commit changes to the database."""
+	c.execute("CREATE TABLE WatchedDirs (dir TEXT PRIMARY KEY, mtime REAL)")
+
+def CreateScanJournalTable():
+	"""Create the table of library scans that are in progress, which lets scans that were interrupted be found and finished later. Each scan is stored under its dir, with the kind of scan (SCAN_ADD, say), the ID of the process running it, the number of files stored so far, the last file stored, and the times the scan started and last stored files. Like the list of library dirs, this isn't reset along with the tags. Doesn't commit changes to the database."""
+	c.execute("CREATE TABLE ScanJournal (dir TEXT PRIMARY KEY, operation TEXT, pid INT, fileCount INT, lastPath TEXT, startTime REAL, updateTime REAL)")
+
+def CreateDirTable():
+	"""Create the table of dirs that hold music files, which the library tree is built from. Each dir is stored with its parent dir, the number of tracks in it and its subdirs, the path of its album art (see SetDirArtPaths()), and the total length of its tracks and its subdirs' tracks, in milliseconds. Every dir above a stored dir is stored as well, up to the root of the filesystem. The table is kept up to date by UpdateDirTotals(). Doesn't commit changes to the database."""
+	c.execute("CREATE TABLE Dir (dir TEXT PRIMARY KEY, parent TEXT, trackCount INT, artPath TEXT, length INT)")
+	c.execute("CREATE INDEX DirParentIndex ON Dir (parent)")
+
+def UpdateDirTotals(addedFiles=(), removedFiles=()):
+	"""Bring the Dir table up to date with files that were just added to or removed from the File table, given as (path, length) pairs, changing the track counts and total lengths of their dirs and of the dirs above them. Dirs are added when they get their first track, and removed when they lose their last one. Doesn't commit changes to the database."""
+	# Total up the changes for each dir that directly holds files, then pass them up, so that each dir above them is only visited once per subdir.
+	fileChanges = {}
+	for files, sign in ((addedFiles, 1), (removedFiles, -1)):
+		for path, length in files:
+			dir = GetParentDir(path)
+			trackCount, totalLength = fileChanges.get(dir, (0, 0))
+			fileChanges[dir] = (trackCount + sign, totalLength + sign * (length or 0))   # Files whose length couldn't be read count as empty.
+	
+	changes = {}
+	for dir, (trackCount, length) in fileChanges.items():
+		while dir is not None:
+			oldTrackCount, oldLength = changes.get(dir, (0, 0))
+			changes[dir] = (oldTrackCount + trackCount, oldLength + length)
+			dir = GetParentDir(dir)
+	changes = [(trackCount, length, dir) for dir, (trackCount, length) in changes.items() if trackCount != 0 or length != 0]
+	
+	c.executemany("INSERT OR IGNORE INTO Dir (dir, parent, trackCount, length) VALUES (?, ?, 0, 0)", ((dir, GetParentDir(dir)) for trackCount, length, dir in changes))
+	c.executemany("UPDATE Dir SET trackCount = trackCount + ?, length = length + ? WHERE dir=?", changes)
+	c.executemany("DELETE FROM Dir WHERE dir=? AND trackCount <= 0", ((dir,) for trackCount, length, dir in changes if trackCount < 0))
+
+def RebuildDirTable():
+	"""Refill the Dir table from the paths and lengths in the File table. Doesn't commit changes to the database."""
+	c.execute("DELETE FROM Dir")
+	UpdateDirTotals(c.execute("SELECT path, length FROM File").fetchall())
+
+def BFullTextSearchAvailable():
+	"""Was SQLite built with the FTS5 full-text search extension? If not, there's no search table, and searches have to fall back to matching paths with LIKE."""
+	return any(option == 'ENABLE_FTS5' for (option,) in c.execute("PRAGMA compile_options"))
+
+def CreateSearchTable():
+	"""Create the full-text search table, which holds the title, artist, album, genre, and path of each file under the file's ID. Files are added to it by IndexFilesForSearch(), and a trigger removes them whenever they're deleted from the File table. Doesn't commit changes to the database."""
+	# The prefix indexes make searches for the first two or three letters of a word as fast as searches for whole words.
+	c.execute("CREATE VIRTUAL TABLE FileSearch USING fts5({}, prefix='2 3')".format(', '.join(SEARCH_COLUMNS)))
+	CreateSearchTrigger()
+
+def CreateSearchTrigger():
+	"""Create the trigger that removes files from the full-text search table when they're deleted from the File table. Doesn't commit changes to the database."""
+	c.execute("CREATE TRIGGER FileSearchDelete AFTER DELETE ON File BEGIN DELETE FROM FileSearch WHERE rowid = old.fileid; END")
+
+def IndexFilesForSearch(firstFileID=0):
+	"""Add files to the full-text search table, along with their artist, album, and genre names. Only files with IDs from 'firstFileID' on are added, so that newly inserted files can be added without touching the rest. The names must already be in their tables. Doesn't commit changes to the database."""
+	if not bFullTextSearch:
+		return
+	c.execute("INSERT INTO FileSearch (rowid, {}) SELECT fileid, {} FROM File LEFT JOIN Artist ON File.artistid = Artist.artistid LEFT JOIN Album ON File.albumid = Album.albumid LEFT JOIN Genre ON File.genreid = Genre.genreid WHERE fileid >= ?".format(', '.join(SEARCH_COLUMNS), ', '.join(SEARCH_COLUMNS)), (firstFileID,))
+
+def _MergeDuplicateNames(tableName, idColumn, nameColumn):
+	"""Make the names in an Artist, Album, or Genre table unique, by pointing any files that use a duplicate name at the first row with that name, then deleting the duplicates. Doesn't commit changes to the database."""
+	keptIDs = {}
+	duplicateIDs = []
+	for id, name in c.execute("SELECT {}, {} FROM {} ORDER BY {}".format(idColumn, nameColumn, tableName, idColumn)).fetchall():
+		if name is None:   # NULLs don't clash in a unique index.
+			continue
+		if name in keptIDs:
+			duplicateIDs.append((keptIDs[name], id))
+		else:
+			keptIDs[name] = id
+	for keptID, duplicateID in duplicateIDs:
+		c.execute("UPDATE File SET {0}=? WHERE {0}=?".format(idColumn), (keptID, duplicateID))
+		if tableName != 'Genre':
+			c.execute("UPDATE OR IGNORE AlbumContainsArtist SET {0}=? WHERE {0}=?".format(idColumn), (keptID, duplicateID))
+			c.execute("DELETE FROM AlbumContainsArtist WHERE {}=?".format(idColumn), (duplicateID,))   # Whatever the update skipped was already covered.
+		c.execute("DELETE FROM {} WHERE {}=?".format(tableName, idColumn), (duplicateID,))
+
+def _ConvertFileLengths():
+	"""Turn the lengths of the files in a database from before version 7, which were stored as 'm:ss' text, into milliseconds. SQLite can't change the type of a column, so the File table is copied into a new one with the same file IDs, and its indexes and search trigger are made again. Lengths that can't be read become NULL. Doesn't commit changes to the database."""
+	# The seconds were rounded off when the lengths were stored, so there's no more precision to be had than this.
+	c.execute("CREATE TABLE NewFile ({})".format(FILE_COLUMNS))
+	c.execute("INSERT INTO NewFile SELECT fileid, title, artistid, albumid, track, CASE WHEN instr(length, ':') > 0 THEN (CAST(substr(length, 1, instr(length, ':') - 1) AS INT) * 60 + CAST(substr(length, instr(length, ':') + 1) AS INT)) * 1000 END, year, genreid, path, mtime, size FROM File")
+	c.execute("DROP TABLE File")   # This drops its indexes and trigger along with it.
+	c.execute("ALTER TABLE NewFile RENAME TO File")
+	CreateIndexes()
+	if BTableExists('FileSearch'):
+		CreateSearchTrigger()
+
+def _FillDirLengths():
+	"""Add up the total length of each dir in the Dir table from the File table, for a Dir table that's up to date apart from its lengths. Doesn't commit changes to the database."""
+	for (dir,) in c.execute("SELECT dir FROM Dir").fetchall():
+		c.execute("UPDATE Dir SET length = (SELECT IFNULL(SUM(length), 0) FROM File WHERE path >= ? AND path < ?) WHERE dir=?", GetDirPathRange(dir) + (dir,))
+
+def UpgradeTables():
+	"""Bring the tables of a database created by an older version of the program up to date, step by step, without losing any data. Doesn't commit changes to the database."""
+	version = GetSchemaVersion()
+	if version >= SCHEMA_VERSION:
+		return
+	
+	if version < 1:
+		# Files stored before this version have no mtime or size, so the next incremental rescan will treat them as changed.
+		c.execute("ALTER TABLE File ADD COLUMN mtime REAL")
+		c.execute("ALTER TABLE File ADD COLUMN size INT")
+	
+	if version < 2:
+		# Older versions didn't enforce unique paths and names, so clear out any duplicates before creating the indexes.
+		c.execute("DELETE FROM File WHERE fileid NOT IN (SELECT MIN(fileid) FROM File GROUP BY path)")
+		_MergeDuplicateNames('Artist', 'artistid', 'artist')
+		_MergeDuplicateNames('Album', 'albumid', 'album')
+		_MergeDuplicateNames('Genre', 'genreid', 'genre')
+		CreateIndexes()
+	
+	if version < 3:
+		CreateWatchedDirsTable()
+	
+	if version < 4:
+		CreateDirTable()   # This already has the album art and length columns. It's filled once the file lengths are numbers (see below).
+	elif version < 5:
+		c.execute("ALTER TABLE Dir ADD COLUMN artPath TEXT")   # The album art of existing dirs is looked up when it's first needed.
+	
+	if version < 6:
+		CreateScanJournalTable()
+	
+	if version < 7:
+		_ConvertFileLengths()
+		if version < 4:
+			RebuildDirTable()
+		else:
+			c.execute("ALTER TABLE Dir ADD COLUMN length INT")
+			_FillDirLengths()
+	
+	SetSchemaVersion(SCHEMA_VERSION)
 
 def DeleteTable(tableName):
 	"""Delete a table, not raising any error on failure. Doesn't commit changes to the database."""
@@ -64,13 +339,24 @@ def EmptyTable(tableName):
 
 _bCreateTable = not os.path.isfile(gbl.dbPath)
 
-# Store the database connection and cursor.
-conn = sqlite3.connect(gbl.dbPath)   # Note that this will create the database file if it doesn't exist.
+# Store the writer connection and its cursor.
+conn = Connect()
 c = conn.cursor()
 
+bFullTextSearch = BFullTextSearchAvailable()
+
 if _bCreateTable:
 	CreateTables()
-	conn.commit()
+else:
+	UpgradeTables()
+	if bFullTextSearch:
+		if c.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name='FileSearchDelete'").fetchone() is None:   # The search table is missing, or it was left out of date by a version of SQLite without full-text search.
+			DeleteTable('FileSearch')
+			CreateSearchTable()
+			IndexFilesForSearch()
+	else:
+		c.execute("DROP TRIGGER IF EXISTS FileSearchDelete")   # Otherwise, deleting files would fail.
+conn.commit()
 
 
 #  ---------------------
@@ -85,8 +371,49 @@ def ResetDatabaseTags():
 	DeleteTable('Album')
 	DeleteTable('AlbumContainsArtist')
 	DeleteTable('Genre')
+	DeleteTable('FileSearch')
+	DeleteTable('Dir')
 	CreateTables()
 	conn.commit()
+	gbl.SetLibraryChanged()
+
+def GetFullTextSearchQuery(text):
+	"""Turn search box text into an FTS5 query for the full-text search table. Each word must match the start of a word in one of a file's fields, or, if given as 'field:word' (as in 'artist:foo'), in that field alone. Words in double quotes are matched as a phrase. Returns None if the text contains nothing to search for."""
+	terms = []
+	for field, phrase, word in re.findall(r'(?:(\w+):)?(?:"([^"]*)"?|(\S+))', text, re.UNICODE):
+		word = phrase or word
+		if field.lower() in SEARCH_COLUMNS:
+			field = field.lower() + ' : '
+		elif field:   # Not a field name, so it's part of the word.
+			word = field + ':' + word
+			field = ''
+		if re.search(r'\w', word, re.UNICODE) is None:   # Punctuation isn't indexed.
+			continue
+		terms.append(u'{}"{}"*'.format(field, word.replace('"', '""')))
+	if len(terms) == 0:
+		return None
+	return u' '.join(terms)
+
+def PruneOrphanedTags():
+	"""Delete the Artists, Albums, and Genres that are no longer used by any file, along with any album-artist relationships that no file backs up anymore. Call this after deleting files. Doesn't commit changes to the database."""
+	# Each of these is a single pass over the (small) name table, with an index search into File for each row.
+	c.execute("DELETE FROM Artist WHERE NOT EXISTS (SELECT 1 FROM File WHERE File.artistid = Artist.artistid)")
+	c.execute("DELETE FROM Album WHERE NOT EXISTS (SELECT 1 FROM File WHERE File.albumid = Album.albumid)")
+	c.execute("DELETE FROM Genre WHERE NOT EXISTS (SELECT 1 FROM File WHERE File.genreid = Genre.genreid)")
+	c.execute("DELETE FROM AlbumContainsArtist WHERE NOT EXISTS (SELECT 1 FROM File WHERE File.albumid = AlbumContainsArtist.albumid AND File.artistid = AlbumContainsArtist.artistid)")
+
+def GetStoredFileTags(path):
+	"""Get the tags of a file as they're stored in the database, in the same form as GetFileTags() returns them: [title, artist, album, track, length, year, genre, path]. Returns None if the file isn't stored."""
+	row = c.execute("SELECT title, artist, album, track, length, year, genre, path FROM File LEFT JOIN Artist ON File.artistid = Artist.artistid LEFT JOIN Album ON File.albumid = Album.albumid LEFT JOIN Genre ON File.genreid = Genre.genreid WHERE path=?", (path,)).fetchone()
+	return list(row) if row is not None else None
+
+def GetQueryPlan(query, args=()):
+	"""A programmer's maintenance function. Returns the details of each step of SQLite's plan for a query, as given by EXPLAIN QUERY PLAN."""
+	return [row[-1] for row in c.execute("EXPLAIN QUERY PLAN " + query, args).fetchall()]
+
+def BFullScan(planDetail):
+	"""Does a step of a query plan (see GetQueryPlan()) scan a whole table (or a whole index), rather than searching one?"""
+	return planDetail.startswith('SCAN')
 
 def GetEntry(entries, id):
 	"""Utility function. Given a list of entries which have the primary key as the first item of each entry, return the entry which has a matching primary key (ID) or return None."""
@@ -108,6 +435,7 @@ def ResetLibraryDirs():
 	"""Resets the list of stored music library dirs. Doesn't affect tag data."""
 	DeleteTable('LibraryDirs')
 	c.execute("CREATE TABLE LibraryDirs (dirid INTEGER PRIMARY KEY, dir TEXT)")
+	c.execute("DELETE FROM ScanJournal")   # There's nothing left to scan.
 	conn.commit()
 
 def RemoveLibraryDirFromList(dir):
@@ -157,3 +485,108 @@ def BLibraryDirCovered(dir):
 		if slashedDir.startswith(SlashedDir(libDir)):
 			return True
 	return False
+
+
+#  ----------------
+# --- Watched Dirs
+#  ----------------
+
+def GetWatchedDirs():
+	"""Get a dict of the dirs watched by the library watcher, and their mtimes as of the last time the watcher checked them."""
+	return dict(c.execute("SELECT dir, mtime FROM WatchedDirs").fetchall())
+
+def UpdateWatchedDirs(dirMtimes, removedDirs=()):
+	"""Stop storing the 'removedDirs' of the library watcher, along with their subdirs, then store the mtimes of watched dirs, given as a dict, adding any dirs that aren't stored yet."""
+	for dir in removedDirs:
+		c.execute("DELETE FROM WatchedDirs WHERE dir=? OR (dir >= ? AND dir < ?)", (dir,) + GetDirPathRange(dir))
+	c.executemany("INSERT OR REPLACE INTO WatchedDirs VALUES (?, ?)", dirMtimes.items())
+	conn.commit()
+
+
+#  ----------------
+# --- Scan Journal
+#  ----------------
+
+def BeginScanJournal(dir, operation):
+	"""Record that a scan of a library dir or subdir is starting, replacing any earlier record of a scan of the same dir. 'operation' is the kind of scan, such as SCAN_ADD. The scan must be ended with EndScanJournal() once it's finished, or it will be seen as interrupted. Doesn't commit changes to the database."""
+	now = time.time()
+	c.execute("INSERT OR REPLACE INTO ScanJournal VALUES (?, ?, ?, 0, NULL, ?, ?)", (dir, operation, os.getpid(), now, now))
+
+def UpdateScanJournal(dir, lastPath, fileCount):
+	"""Record that a chunk of files has been stored by a scan, giving the last file in the chunk and the number of files in it. Call this just before the chunk is committed, so that the record is committed along with it. Doesn't commit changes to the database."""
+	c.execute("UPDATE ScanJournal SET fileCount = fileCount + ?, lastPath=?, updateTime=? WHERE dir=?", (fileCount, lastPath, time.time(), dir))
+
+def EndScanJournal(dir):
+	"""Record that a scan has finished, or that it should be forgotten. Doesn't commit changes to the database."""
+	c.execute("DELETE FROM ScanJournal WHERE dir=?", (dir,))
+
+def RemoveScanJournals(dir):
+	"""Forget the scans of a dir and of its subdirs, say, because the dir is being removed from the library. Doesn't commit changes to the database."""
+	c.execute("DELETE FROM ScanJournal WHERE dir=? OR (dir >= ? AND dir < ?)", (dir,) + GetDirPathRange(dir))
+
+def GetInterruptedScans():
+	"""Get a list of the scans that were started but never finished, as (dir, operation, fileCount, lastPath, startTime, updateTime) tuples (see CreateScanJournalTable()), oldest first. Scans that another process (such as kea-index) is still running are left out. This process's own scans run one at a time, in the thread that stores files, so any of its scans that are stored when no scan is running were left behind by an earlier process with the same ID."""
+	scans = []
+	for row in c.execute("SELECT dir, operation, pid, fileCount, lastPath, startTime, updateTime FROM ScanJournal ORDER BY startTime").fetchall():
+		if row[2] == os.getpid() or not BProcessRunning(row[2]):
+			scans.append(row[:2] + row[3:])
+	return scans
+
+
+#  --------
+# --- Dirs
+#  --------
+
+def GetSubdirs(dir):
+	"""Get a list of the subdirs of a dir which hold music files, sorted by name, as (dir, trackCount, bHasSubdirs) tuples. 'trackCount' includes the tracks in the subdir's own subdirs, and 'bHasSubdirs' is whether it has any subdirs which hold music files."""
+	return [(subdir, trackCount, bool(bHasSubdirs)) for subdir, trackCount, bHasSubdirs in c.execute("SELECT dir, trackCount, EXISTS (SELECT 1 FROM Dir AS Subdir WHERE Subdir.parent = Dir.dir) FROM Dir WHERE parent=? ORDER BY dir COLLATE NOCASE", (dir,))]
+
+def GetDirInfo(dir):
+	"""Get the (trackCount, bHasSubdirs) of a dir, as in GetSubdirs(). A dir which holds no music files gives (0, False)."""
+	row = c.execute("SELECT trackCount, EXISTS (SELECT 1 FROM Dir AS Subdir WHERE Subdir.parent = Dir.dir) FROM Dir WHERE dir=?", (dir,)).fetchone()
+	if row is None:
+		return 0, False
+	return row[0], bool(row[1])
+
+def GetDirArtPath(dir):
+	"""Get the stored path of a dir's album art. Returns an empty string if the dir has no album art, or None if it hasn't been looked for (or the dir isn't stored)."""
+	row = c.execute("SELECT artPath FROM Dir WHERE dir=?", (dir,)).fetchone()
+	return row[0] if row is not None else None
+
+def SetDirArtPaths(dirArtPaths):
+	"""Store the album art paths of dirs, given as a dict. Use an empty string for a dir with no album art. Dirs that aren't stored are skipped. Doesn't commit changes to the database."""
+	c.executemany("UPDATE Dir SET artPath=? WHERE dir=?", ((artPath, dir) for dir, artPath in dirArtPaths.items()))
+
+def GetDirTotals(dir):
+	"""Get the (trackCount, length) of a dir, counting the tracks in its subdirs, with the length in milliseconds. A dir which holds no music files gives (0, 0)."""
+	row = c.execute("SELECT trackCount, length FROM Dir WHERE dir=?", (dir,)).fetchone()
+	if row is None:
+		return 0, 0
+	return row[0], row[1] or 0
+
+
+#  ----------
+# --- Totals
+#  ----------
+
+def GetLibraryTotals():
+	"""Get the (trackCount, length) of the whole library, with the length in milliseconds."""
+	return tuple(c.execute("SELECT COUNT(*), IFNULL(SUM(length), 0) FROM File").fetchone())
+
+def _GetTagTotals(tableName, idColumn, nameColumn, id):
+	"""Get the track counts and total lengths of the artists, albums, or genres in a tag table. If an ID is given, returns the (trackCount, length) of that one, or (0, 0) if no files use it. Otherwise, returns a list of (name, trackCount, length) tuples, sorted by name. Files are grouped using the artist, album, or genre index, which holds the lengths as well, so the File table itself is never read."""
+	if id is not None:
+		return tuple(c.execute("SELECT COUNT(*), IFNULL(SUM(length), 0) FROM File WHERE {}=?".format(idColumn), (id,)).fetchone())
+	return c.execute("SELECT {1}, trackCount, length FROM {0} JOIN (SELECT {2}, COUNT(*) AS trackCount, IFNULL(SUM(length), 0) AS length FROM File GROUP BY {2}) AS Totals ON {0}.{2} = Totals.{2} ORDER BY {1} COLLATE NOCASE".format(tableName, nameColumn, idColumn)).fetchall()
+
+def GetArtistTotals(artistID=None):
+	"""Get the track count and total length, in milliseconds, of each artist, as a list of (artist, trackCount, length) tuples sorted by name, or the (trackCount, length) of one artist."""
+	return _GetTagTotals('Artist', 'artistid', 'artist', artistID)
+
+def GetAlbumTotals(albumID=None):
+	"""Get the track count and total length, in milliseconds, of each album, as a list of (album, trackCount, length) tuples sorted by name, or the (trackCount, length) of one album."""
+	return _GetTagTotals('Album', 'albumid', 'album', albumID)
+
+def GetGenreTotals(genreID=None):
+	"""Get the track count and total length, in milliseconds, of each genre, as a list of (genre, trackCount, length) tuples sorted by name, or the (trackCount, length) of one genre."""
+	return _GetTagTotals('Genre', 'genreid', 'genre', genreID)
@@ -2,6 +2,9 @@
 #
 # Notes:
 #  An item model which can be used with a customized QTreeView to navigate the music library.
+#  The tree is built from the database's table of dirs, which is kept up to date whenever files
+# are added or removed, rather than from the filesystem. Only dirs which hold music files (directly
+# or in their subdirs) are shown.
 #
 # Config file usage:
 #   Program->bRemoveSingleTreeRootNode: Stores whether the tree node will display a solo root
@@ -16,12 +19,18 @@ except ImportError:
 	import ConfigParser as configparser
 
 from qt import *
-from db import GetLibraryDirs
+from db import GetLibraryDirs, GetSubdirs, GetDirInfo
 
 
 # Notable default values for optional config file settings.
 B_REMOVE_SINGLE_TREE_ROOT_NODE = False
 
+# Item data roles.
+DIR_ROLE = Qt.UserRole
+TRACK_COUNT_ROLE = Qt.UserRole + 1
+HAS_SUBDIRS_ROLE = Qt.UserRole + 2
+LOADED_ROLE = Qt.UserRole + 3   # Whether the item's children have been added.
+
 
 def GetBRemoveSingleTreeRootNode(config):
 	"""Is the 'Program->bRemoveSingleTreeRootNode' setting True?"""
@@ -34,97 +43,124 @@ def GetBRemoveSingleTreeRootNode(config):
 class DirSystemModel(QStandardItemModel):
 	"""
 	An item model that can be used with a customized QTreeView to navigate the music library.
-	This is a 2-layer model which always retrieves two layers of data when a branch of it is expanded. This means that branch symbols will appear even for branches the user hasn't yet navigated.
+	The children of a branch are only added when it's expanded, with one database query. Branch symbols still appear for branches the user hasn't yet navigated, since the database knows which dirs have subdirs.
 	Quick guide:
-	Call Reload() to reload the model from the music library.
+	Call Reload() to rebuild the model from the music library, or Refresh() to apply library changes to it without disturbing the tree.
 	Call AllowExpandLayer() on the QTreeView's current index when a tree branch is expanded.
 	Call dir() to get the dir at an index.
 	"""
 	
 	def __init__(self, parent, configFile):   # A parent is basically optional, but PyQt complains if you don't give one.
 		super(DirSystemModel, self).__init__(parent)
-		self.bUseRootBaseName = None
-		self.processedLayers = None
+		self.libraryDirs = None
+		self.bRootsRemoved = None   # Whether the contents of the library dir are shown instead of the library dir itself.
 		self.configFile = configFile
 		self.Reload()
 	
 	def Reload(self):
 		"""Reload the contents of the model."""
 		self.clear()
-		self.bUseRootBaseName = None
-		self.processedLayers = []
-		libraryDirs = GetLibraryDirs()
+		self.libraryDirs = GetLibraryDirs()
+		self.bRootsRemoved = GetBRemoveSingleTreeRootNode(self.configFile) and len(self.libraryDirs) < 2
 		
-		if GetBRemoveSingleTreeRootNode(self.configFile) and len(libraryDirs) < 2:
+		if self.bRootsRemoved:
 			# Don't add the roots themselves as nodes.
-			for rootDir in libraryDirs:
-				self.bUseRootBaseName = True
-				if os.path.isdir(rootDir):
-					for name in os.listdir(rootDir):
-						if os.path.isdir(os.path.join(rootDir, name)):
-							item = QStandardItem(name)
-							setattr(item, 'rootDir', rootDir)
-							self.appendRow(item)
-							self.AddLayer(os.path.join(rootDir, name), item, bSettingUp=True)
+			for rootDir in self.libraryDirs:
+				self.invisibleRootItem().appendRows([self._MakeItem(subdir, trackCount, bHasSubdirs) for subdir, trackCount, bHasSubdirs in GetSubdirs(rootDir)])
 		else:
 			# Add the roots themselves as nodes.
-			bFirst = True
-			for rootDir in GetLibraryDirs():
-				self.bUseRootBaseName = False
-				if os.path.isdir(rootDir):
-					rootItem = QStandardItem(os.path.basename(rootDir))
-					setattr(rootItem, 'rootDir', rootDir)
-					self.appendRow(rootItem)
-					self.AddLayer(rootDir, rootItem, bSettingUp=True)
+			for rootDir in self.libraryDirs:
+				trackCount, bHasSubdirs = GetDirInfo(rootDir)
+				self.appendRow(self._MakeItem(rootDir, trackCount, bHasSubdirs, os.path.basename(rootDir) or rootDir))
+	
+	def Refresh(self):
+		"""Bring the model up to date with the library after a change. Only the items that need it are added, removed, or updated, and only branches whose children have been added are checked, so expanded branches and the current index are kept."""
+		if GetLibraryDirs() != self.libraryDirs:
+			self.Reload()
+			return
+		
+		if self.bRootsRemoved:
+			for rootDir in self.libraryDirs:
+				self._RefreshChildren(self.invisibleRootItem(), rootDir)
+		else:
+			for row in range(self.rowCount()):
+				item = self.item(row)
+				self._UpdateItem(item, *GetDirInfo(item.data(DIR_ROLE)))
+				if item.data(LOADED_ROLE):
+					self._RefreshChildren(item, item.data(DIR_ROLE))
+	
+	def _MakeItem(self, dir, trackCount, bHasSubdirs, name=None):
+		item = QStandardItem(name if name is not None else dir[dir.rfind('/') + 1:])
+		item.setData(dir, DIR_ROLE)
+		item.setData(False, LOADED_ROLE)
+		self._UpdateItem(item, trackCount, bHasSubdirs)
+		return item
+	
+	def _UpdateItem(self, item, trackCount, bHasSubdirs):
+		"""Set the track count and subdir flag of an item, if they've changed."""
+		if item.data(TRACK_COUNT_ROLE) != trackCount:
+			item.setData(trackCount, TRACK_COUNT_ROLE)
+			item.setToolTip('1 track' if trackCount == 1 else '{} tracks'.format(trackCount))
+		if item.data(HAS_SUBDIRS_ROLE) != bHasSubdirs:
+			item.setData(bHasSubdirs, HAS_SUBDIRS_ROLE)
+	
+	def _RefreshChildren(self, parentItem, dir):
+		"""Bring the children of a loaded item up to date with the library, and those of its loaded children. Both the children and the subdirs are sorted the same way, so they can be merged in one pass."""
+		subdirs = GetSubdirs(dir)
+		subdirSet = set(subdir for subdir, trackCount, bHasSubdirs in subdirs)
+		row = 0
+		for subdir, trackCount, bHasSubdirs in subdirs:
+			# Remove any children that are no longer in the library.
+			while row < parentItem.rowCount() and parentItem.child(row).data(DIR_ROLE) not in subdirSet:
+				parentItem.removeRow(row)
+			
+			item = parentItem.child(row) if row < parentItem.rowCount() else None
+			if item is not None and item.data(DIR_ROLE) == subdir:
+				self._UpdateItem(item, trackCount, bHasSubdirs)
+				if item.data(LOADED_ROLE):
+					self._RefreshChildren(item, subdir)
+			else:
+				parentItem.insertRow(row, self._MakeItem(subdir, trackCount, bHasSubdirs))
+			row += 1
+		
+		if row < parentItem.rowCount():
+			parentItem.removeRows(row, parentItem.rowCount() - row)
+	
+	def hasChildren(self, parent=QModelIndex()):
+		item = self.itemFromIndex(parent) if parent.isValid() else None
+		if item is not None and not item.data(LOADED_ROLE):
+			return bool(item.data(HAS_SUBDIRS_ROLE))
+		return super(DirSystemModel, self).hasChildren(parent)
+	
+	def canFetchMore(self, parent):
+		item = self.itemFromIndex(parent) if parent.isValid() else None
+		return item is not None and not item.data(LOADED_ROLE)
 	
-	def AddLayer(self, dir, parentItem, layerNum=2, bSettingUp=False):
-		"""Add a layer to the filesystem, if it doesn't exist already. Works in pairs of two layers, to create branch symbols even for branches the user hasn't traversed yet."""
-		if bSettingUp or parentItem not in self.processedLayers:
-			if layerNum == 2:
-				#print('PROCESS', dir)   # TODO: Remove.
-				self.processedLayers.append(parentItem)
-				if not bSettingUp:
-					# We know that wherever we are, we already made a layer of children; populate that layer, now.
-					for i in range(parentItem.rowCount()):
-						item = parentItem.child(i, 0)
-						self.AddLayer(os.path.join(dir, item.text()), item, layerNum - 1, bSettingUp)
-			if bSettingUp or layerNum == 1:
-				for name in os.listdir(dir):
-					if os.path.isdir(os.path.join(dir, name)):
-						item = QStandardItem(name)
-						parentItem.appendRow(item)
-						if layerNum > 1:
-							self.AddLayer(os.path.join(dir, name), item, layerNum - 1, bSettingUp)
+	def fetchMore(self, parent):
+		"""Add the children of an item, if they haven't been added yet."""
+		item = self.itemFromIndex(parent) if parent.isValid() else None
+		if item is not None and not item.data(LOADED_ROLE):
+			item.setData(True, LOADED_ROLE)
+			subdirs = GetSubdirs(item.data(DIR_ROLE))
+			if len(subdirs) > 0:
+				item.appendRows([self._MakeItem(subdir, trackCount, bHasSubdirs) for subdir, trackCount, bHasSubdirs in subdirs])
 	
 	def AllowExpandLayer(self, index):
-		"""Call this with an appropriate index whenever a branch of the tree is expanded. It creates the necessary items for the filesystem model, layer by layer (to prevent slowdown by scanning the whole library structure at once)."""
-		dir, parentItem = self.dir(index, bReturnItem=True)
-		self.AddLayer(dir, parentItem)
+		"""Call this with an appropriate index whenever a branch of the tree is expanded. It adds the branch's children, if they haven't been added yet (to prevent slowdown by loading the whole library structure at once)."""
+		if self.canFetchMore(index):
+			self.fetchMore(index)
 	
 	def dir(self, index, bReturnItem=False):
 		"""Get the dir (and, optionally, the item) at a particular clicked index point."""
-		item = origItem = self.itemFromIndex(index)
+		item = self.itemFromIndex(index)
 		if item is None:   # Say the user just clicked on some spot in the tree view which didn't have an item located there.
 			return None
-		dir = item.text()
-		if hasattr(item, 'rootDir'):
-			if self.bUseRootBaseName:
-				dir = os.path.join(getattr(item, 'rootDir'), dir)
-			else:
-				dir = getattr(item, 'rootDir')
-		else:
-			while item.parent() is not None:   # Unless we failed to set a root dir, we should break before the end condition, anyway.
-				item = item.parent()
-				if hasattr(item, 'rootDir'):
-					if self.bUseRootBaseName:
-						dir = os.path.join(os.path.join(getattr(item, 'rootDir'), item.text()), dir)
-					else:
-						dir = os.path.join(getattr(item, 'rootDir'), dir)
-					break
-				else:
-					dir = os.path.join(item.text(), dir)
-			if not hasattr(item, 'rootDir'):   # We never found a root dir.
-				raise LogicError('Failed to get a full path for tree item dir.')
+		dir = item.data(DIR_ROLE)
 		if bReturnItem:
-			return dir, origItem
-		return dir
\ No newline at end of file
+			return dir, item
+		return dir
+	
+	def GetTrackCount(self, index):
+		"""Get the number of tracks in the dir at an index, including those in its subdirs."""
+		item = self.itemFromIndex(index)
+		return item.data(TRACK_COUNT_ROLE) if item is not None else 0
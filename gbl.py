@@ -5,12 +5,13 @@ import sys, os
 import gbl_helper
 
 
-if gbl_helper.programDir is not None:   # The program dir is not our starting dir.
-	os.chdir(gbl_helper.programDir)
-else:
-	programDir = os.path.dirname(sys.argv[0])
-	if len(programDir) > 0:
-		os.chdir(programDir)
+if gbl_helper.bChangeDir:
+	if gbl_helper.programDir is not None:   # The program dir is not our starting dir.
+		os.chdir(gbl_helper.programDir)
+	else:
+		programDir = os.path.dirname(sys.argv[0])
+		if len(programDir) > 0:
+			os.chdir(programDir)
 
 
 programName = 'kea'
@@ -21,8 +22,9 @@ programDir = os.path.dirname(sys.argv[0]) if gbl_helper.programDir is None else
 configExt = '.ini'
 # We could use relative paths for these various paths; it's arbitrary.
 configPath = os.path.join(programDir, 'kea' + configExt)
-dbPath = os.path.join(programDir, 'data.db')
+dbPath = os.path.join(programDir, 'data.db') if gbl_helper.dbPath is None else gbl_helper.dbPath
 imgDir = os.path.join(programDir, 'img')
+thumbnailDir = os.path.join(programDir, 'thumbnails')
 interfacesDir = os.path.join(programDir, 'interfaces')
 interfacesDirImport = 'interfaces'   # Must match location defined by interfacesDir. TODO maybe auto-generate.
 errorPath = os.path.join(programDir, 'err.log')
@@ -43,9 +45,9 @@ restartProgramMessage = 'Restart program to see changes.'
 
 bAppCreated = False
 
-bLibraryChanged = False
+libraryGeneration = 0   # Goes up by one each time the contents of the library change. See GetLibraryGeneration().
+acceptedLibraryGeneration = 0   # The generation as of the last call to AcceptCurrentLibrary().
 
-bMonitorRemovedDirs = True   # This is an application setting that determines whether the removal and renaming of directories should be monitored. Left as a setting here for the time being in case of unforeseen performance issues.
 
 interfaceName = '' if gbl_helper.interfaceName is None else gbl_helper.interfaceName
 interfacePathNoExt = gbl_helper.interfacePathNoExt
@@ -66,19 +68,23 @@ def ResetCurrentTrackRow():
 	currentTrackRow = None
 
 
+def GetLibraryGeneration():
+	"""Get the library generation, a number which goes up each time the contents of the library change. Anything worked out from the library, such as a cached query result (see result_cache), is out of date if it was worked out in an earlier generation."""
+	return libraryGeneration
+
 def BLibraryChanged():
-	"""Have the contents of the library changed?"""
-	return bLibraryChanged
+	"""Have the contents of the library changed since the last call to AcceptCurrentLibrary()?"""
+	return libraryGeneration != acceptedLibraryGeneration
 
 def SetLibraryChanged():
-	"""Mark the library as changed. This can help widgets that might not otherwise check for changes (for example, a treeview that normally only updates a playlist table when a tree branch is clicked if the query has changed) to be on the alert. Make sure you call AcceptCurrentLibrary() at some point after dealing with the library change. (Look in the 'walker' module for a specific callback function approach.)"""
-	global bLibraryChanged
-	bLibraryChanged = True
+	"""Mark the library as changed, by moving on to the next library generation. This can help widgets that might not otherwise check for changes (for example, a treeview that normally only updates a playlist table when a tree branch is clicked if the query has changed) to be on the alert. Make sure you call AcceptCurrentLibrary() at some point after dealing with the library change. (Look in the 'walker' module for a specific callback function approach.) Call this after committing any change to the library's tags, so that cached query results from before the change aren't used."""
+	global libraryGeneration
+	libraryGeneration += 1
 
 def AcceptCurrentLibrary():
-	"""Clear the record of any changes made to the library."""
-	global bLibraryChanged
-	bLibraryChanged = False
+	"""Clear the record of any changes made to the library. The library generation is unaffected."""
+	global acceptedLibraryGeneration
+	acceptedLibraryGeneration = libraryGeneration
 
 
 bFixGarbageCollection = True
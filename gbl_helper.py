@@ -6,4 +6,6 @@
 
 programDir = None
 interfaceName = None
-interfacePathNoExt = None
\ No newline at end of file
+interfacePathNoExt = None
+bChangeDir = True   # Whether importing gbl changes the working dir to the program dir. Command-line tools turn this off, so that relative paths given to them still work.
+dbPath = None   # The database to use, if not the one in the program dir.
\ No newline at end of file
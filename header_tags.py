@@ -0,0 +1,495 @@
+# Header tag reader
+#
+# Notes:
+#  A fast way to read the tags of a music file, for scanning big libraries. mutagen parses every
+# frame of a file's tags into objects, including embedded album art that can be megabytes, just for
+# us to look at six fields and the length. This reads only what we need: the text frames of an
+# ID3v2 tag (seeking past the rest), the comment header of an Ogg Vorbis file, and the STREAMINFO
+# and VORBIS_COMMENT blocks of a FLAC file. Files are read with a single read of their start, plus
+# a seek now and then past a big frame or block.
+#  The results have to be exactly what mutagen would give, so this follows mutagen's rules wherever
+# they make a difference: ID3v1 tags merged into ID3v2 ones, ID3v2.3 year frames, numeric genres,
+# duplicate frames, undecodable text, and so on. Anything out of the ordinary (unsynchronised or
+# compressed ID3 tags, ID3v2.2, multiplexed Ogg streams, FLAC cue sheets...) is left to mutagen:
+# ReadHeaderTags() returns None, and the caller should use mutagen instead.
+#  MP3 lengths still come from mutagen's MPEG frame parser, started just past the ID3 tag, since
+# that's a handful of small reads anyway.
+#  mutagen isn't used for WAV files, so they're read here too, by walking their RIFF chunks. The
+# length comes from the fmt and data chunks, wherever they are (there may be LIST, fact, JUNK, etc.
+# chunks before them), and the tags from LIST INFO and 'id3 ' chunks. RF64 files, which can be
+# bigger than 4 GB, are handled through their ds64 chunk. Nothing has to match mutagen here, so
+# None is only returned for files that can't be made sense of as RIFF WAVE files.
+
+
+import os, re, struct
+from io import BytesIO
+from mutagen.mp3 import MPEGInfo
+from mutagen.id3 import Frames as ID3_FRAMES
+from mutagen.easyid3 import EasyID3
+
+
+# Bytes read from the start of a file in one go. The tag text is almost always within this.
+HEAD_SIZE = 16384
+
+# Bytes read from the end of an Ogg file to find its last page. (mutagen reads the same.)
+OGG_TAIL_SIZE = 256 * 256
+
+# ID3 frame: the 'easy' tag name mutagen gives it.
+ID3_TEXT_FRAMES = {'TIT2': 'title', 'TPE1': 'artist', 'TALB': 'album', 'TRCK': 'tracknumber', 'TCON': 'genre', 'TDRC': 'date'}
+ID3_OLD_DATE_FRAMES = ('TYER', 'TDAT', 'TIME')   # ID3v2.3 frames, which mutagen turns into TDRC if there isn't one.
+ID3_ENCODINGS = ('latin1', 'utf16', 'utf_16_be', 'utf8')
+
+# Frame flags which change how a frame's data has to be read (compression, encryption, grouping, etc.).
+ID3V23_DATA_FLAGS = 0x00e0
+ID3V24_DATA_FLAGS = 0x004f
+
+VORBIS_KEYS = (b'title', b'artist', b'album', b'tracknumber', b'date', b'genre')
+
+# RIFF INFO subchunk: the 'easy' tag name to give it.
+RIFF_INFO_KEYS = {b'INAM': 'title', b'IART': 'artist', b'IPRD': 'album', b'ITRK': 'tracknumber', b'IPRT': 'tracknumber', b'ICRD': 'date', b'IGNR': 'genre'}
+
+# WAV formats whose data is made of fixed-size sample frames (PCM, IEEE float, A-law, and mu-law), so the length can be worked out from the data size.
+WAVE_FRAME_FORMATS = (0x0001, 0x0003, 0x0006, 0x0007)
+WAVE_FORMAT_EXTENSIBLE = 0xfffe
+
+OLD_YEAR_RE = re.compile(r'([0-9]{4})(-[0-9]{2}-[0-9]{2})?\Z')   # As mutagen checks TYER frames.
+TIMESTAMP_SPLIT_RE = re.compile(r'[-T:/.]|\s+')   # As mutagen splits ID3 timestamps.
+
+
+class _Unsupported(Exception):
+	"""Raised when a file has something in it that the header reader doesn't handle."""
+
+
+class _HeadFile:
+	"""The start of a file, read in one go, with seeks for anything beyond it. Can also be used on bytes alone."""
+	
+	def __init__(self, file=None, head=None):
+		self.file = file
+		self.head = head if head is not None else file.read(HEAD_SIZE)
+		self.size = os.fstat(file.fileno()).st_size if file is not None else len(self.head)
+	
+	def Read(self, offset, size):
+		"""Read the given number of bytes at an offset. Raises _Unsupported if there aren't that many."""
+		if offset + size <= len(self.head):
+			return self.head[offset:offset + size]
+		if self.file is None or offset + size > self.size:
+			raise _Unsupported
+		self.file.seek(offset)
+		data = self.file.read(size)
+		if len(data) != size:
+			raise _Unsupported
+		return data
+
+
+def ReadHeaderTags(path):
+	"""Read a music file's tags and length from its headers. Returns (tags, length), where tags is a dict from mutagen's 'easy' tag names (title, artist, album, tracknumber, date, genre) to lists of values, and the length is in seconds. Returns None if the file should be left to mutagen, which includes files that don't exist or can't be read."""
+	reader = _READERS.get(os.path.splitext(path)[1].lower())
+	if reader is None:
+		return None
+	try:
+		with open(path, 'rb') as file:
+			return reader(_HeadFile(file))
+	except Exception:   # Whatever it is, mutagen can deal with it (or raise the proper error).
+		return None
+
+
+#  ----
+# --- MP3
+#  ----
+
+def _Unsynchsafe(value):
+	"""Convert an ID3 'synchsafe' int (7 bits to a byte) to a regular one. The top bit of each byte is ignored, as mutagen does."""
+	return ((value & 0x7f000000) >> 3) | ((value & 0x7f0000) >> 2) | ((value & 0x7f00) >> 1) | (value & 0x7f)
+
+def _BSynchsafeFrameSizes(head, bodyStart, bodySize):
+	"""Work out whether the frame sizes of an ID3v2.4 tag are synchsafe, as they should be, or regular ints, as some old iTunes versions wrote them. Uses mutagen's test: whichever way finds more known frames."""
+	def Walk(bSynchsafe):
+		offset = 0
+		count = 0
+		while offset < bodySize - 10:
+			header = head.Read(bodyStart + offset, 10)
+			if header == b'\x00' * 10:
+				return count, -((bodySize - offset) % 10)
+			name, size, flags = struct.unpack('>4sLH', header)
+			offset += 10 + (_Unsynchsafe(size) if bSynchsafe else size)
+			try:
+				if name.decode('ascii') in ID3_FRAMES:
+					count += 1
+			except UnicodeDecodeError:
+				pass
+		return count, offset - bodySize
+	
+	synchsafeCount, synchsafeOverrun = Walk(True)
+	intCount, intOverrun = Walk(False)
+	return not (intCount > synchsafeCount or (intCount == synchsafeCount and synchsafeOverrun >= 1 and intOverrun <= 1))
+
+def _DecodeID3Text(data, version):
+	"""Decode the values in the data of an ID3 text frame, as mutagen does. Raises _Unsupported for anything mutagen would have to fix up or throw away."""
+	if len(data) < 2:
+		raise _Unsupported
+	encoding = struct.unpack('>B', data[:1])[0]
+	if encoding >= len(ID3_ENCODINGS):
+		raise _Unsupported
+	codec = ID3_ENCODINGS[encoding]
+	data = data[1:]
+	
+	values = []
+	while len(data) > 0:
+		if encoding in (0, 3):
+			end = data.find(b'\x00')
+			termLength = 1
+		else:
+			end = data.find(b'\x00\x00')
+			while end != -1 and end % 2 == 1:   # The terminator has to be a whole character.
+				end = data.find(b'\x00\x00', end + 1)
+			termLength = 2
+		if end == -1:
+			value, data = data, b''
+		else:
+			value, data = data[:end], data[end + termLength:]
+		if encoding in (1, 2) and len(value) % 2 == 1:
+			raise _Unsupported
+		if encoding == 1 and len(value) > 0 and value[:2] not in (b'\xff\xfe', b'\xfe\xff'):   # mutagen guesses at UTF-16 without a byte order mark.
+			raise _Unsupported
+		try:
+			values.append(value.decode(codec))
+		except UnicodeError:
+			raise _Unsupported
+		
+		# Older tags pad values with zeros, which mustn't be read as empty values.
+		if version < 4 and len(data.strip(b'\x00')) == 0:
+			data = b''
+	return values
+
+def _GetID3TimeStampText(text):
+	"""Get the text of an ID3 timestamp as mutagen gives it, which is rebuilt from the numbers in it."""
+	parts = TIMESTAMP_SPLIT_RE.split(text + ':::::')[:6]
+	pieces = []
+	for i, part in enumerate(parts):
+		try:
+			number = int(part)
+		except ValueError:
+			break
+		pieces.append(('%04d' if i == 0 else '%02d') % number + '-- ::x'[i])
+	return ''.join(pieces)[:-1]
+
+def _ReadID3Tags(head, tagStart):
+	"""Read the tags we want from an ID3v2 tag starting at an offset. Returns the tags and the offset of the end of the tag."""
+	magic, version, revision, flags, tagSize = struct.unpack('>3sBBB4s', head.Read(tagStart, 10))
+	if magic != b'ID3' or version not in (3, 4):
+		raise _Unsupported
+	if flags & 0xc0 or flags & (0x0f if version == 4 else 0x1f):   # Unsynchronisation, an extended header, or bad flags.
+		raise _Unsupported
+	tagSize = struct.unpack('>L', tagSize)[0]
+	if tagSize & 0x80808080:
+		raise _Unsupported
+	bodySize = _Unsynchsafe(tagSize)
+	bodyEnd = tagStart + 10 + bodySize
+	if bodyEnd > head.size:
+		raise _Unsupported
+	
+	bSynchsafe = version == 4 and _BSynchsafeFrameSizes(head, tagStart + 10, bodySize)
+	frames = {}   # Frame ID: values, merged from all frames with that ID.
+	pos = tagStart + 10
+	while bodyEnd - pos >= 10:
+		name, size, frameFlags = struct.unpack('>4sLH', head.Read(pos, 10))
+		if len(name.strip(b'\x00')) == 0:   # Padding.
+			break
+		if bSynchsafe:
+			size = _Unsynchsafe(size)
+		start = pos
+		pos += 10 + size
+		if size == 0:
+			continue
+		if name[3:] == b'\x00':   # An ID3v2.2 frame name, which mutagen would translate.
+			raise _Unsupported
+		try:
+			name = name.decode('ascii')
+		except UnicodeDecodeError:
+			continue
+		
+		if name in ID3_TEXT_FRAMES or name in ID3_OLD_DATE_FRAMES:
+			if frameFlags & (ID3V24_DATA_FLAGS if version == 4 else ID3V23_DATA_FLAGS):
+				raise _Unsupported
+			values = _DecodeID3Text(head.Read(start + 10, min(size, bodyEnd - start - 10)), version)
+			if len(values) == 0:
+				raise _Unsupported
+			merged = frames.setdefault(name, [])
+			merged.extend(value for value in values if value not in merged)
+	
+	tags = {}
+	for name in ('TIT2', 'TPE1', 'TALB', 'TRCK'):
+		if name in frames:
+			tags[ID3_TEXT_FRAMES[name]] = frames[name]
+	
+	if 'TCON' in frames:
+		genre = frames['TCON'][0]
+		if len(genre) == 0 or genre.isdecimal() or genre in ('CR', 'RX') or genre.startswith('(') or '\n' in genre:   # Numeric genres and the like, which mutagen translates.
+			raise _Unsupported
+		tags['genre'] = [genre]
+	
+	if 'TDRC' in frames:
+		tags['date'] = [_GetID3TimeStampText(frames['TDRC'][0])]
+	elif 'TDAT' in frames or 'TIME' in frames:
+		raise _Unsupported
+	else:
+		years = [year for year in frames.get('TYER', []) if OLD_YEAR_RE.match(year)]
+		if len(years) > 0:
+			tags['date'] = [_GetID3TimeStampText(years[0])]
+	return tags, bodyEnd
+
+def _ReadMP3(head):
+	# mutagen merges in any ID3v1 tag at the end of the file.
+	if b'TAG' in head.Read(max(0, head.size - 131), min(head.size, 131)):
+		raise _Unsupported
+	
+	tags, tagEnd = _ReadID3Tags(head, 0)
+	return tags, MPEGInfo(head.file, tagEnd).length
+
+
+#  ----
+# --- Vorbis comments
+#  ----
+
+def _ReadVorbisComment(data, bFraming):
+	"""Get the tags we want from a Vorbis comment, as mutagen reads them. Returns the tags and the length of the comment."""
+	def ReadLength(offset):
+		if offset + 4 > len(data):
+			raise _Unsupported
+		return struct.unpack('<L', data[offset:offset + 4])[0]
+	
+	offset = 4 + ReadLength(0)   # Skip the vendor string.
+	count = ReadLength(offset)
+	offset += 4
+	tags = {}
+	for i in range(count):
+		length = ReadLength(offset)
+		offset += 4
+		if offset + length > len(data):
+			raise _Unsupported
+		comment = data[offset:offset + length]
+		offset += length
+		
+		# Keys are compared case-insensitively, and must be ASCII. Splitting before decoding gives the same result, since '=' can't be part of a UTF-8 sequence.
+		split = comment.find(b'=')
+		if split != -1 and comment[:split].lower() in VORBIS_KEYS:
+			tags.setdefault(comment[:split].lower().decode('ascii'), []).append(comment[split + 1:].decode('utf-8', 'replace'))
+	
+	if bFraming:
+		if offset >= len(data) or not struct.unpack('>B', data[offset:offset + 1])[0] & 0x01:
+			raise _Unsupported
+		offset += 1
+	return tags, offset
+
+
+#  ----
+# --- Ogg Vorbis
+#  ----
+
+def _ReadOggPage(head, pos):
+	"""Read an Ogg page. Returns (flags, granule position, serial, packets, bComplete, next page's offset). The last packet is only part of one if the page isn't complete."""
+	magic, version, flags, position, serial, sequence, crc, segmentCount = struct.unpack('<4sBBqLLlB', head.Read(pos, 27))
+	if magic != b'OggS' or version != 0:
+		raise _Unsupported
+	
+	lengths = []
+	total = 0
+	for segment in struct.unpack('>{}B'.format(segmentCount), head.Read(pos + 27, segmentCount)):
+		total += segment
+		if segment < 255:
+			lengths.append(total)
+			total = 0
+	bComplete = total == 0
+	if not bComplete:
+		lengths.append(total)
+	
+	pos += 27 + segmentCount
+	packets = []
+	for length in lengths:
+		packets.append(head.Read(pos, length))
+		pos += length
+	return flags, position, serial, packets, bComplete, pos
+
+def _ReadOgg(head):
+	flags, position, serial, packets, bComplete, pos = _ReadOggPage(head, 0)
+	if len(packets) != 1 or not bComplete or not flags & 0x02 or not packets[0].startswith(b'\x01vorbis') or len(packets[0]) < 28:
+		raise _Unsupported
+	sampleRate = struct.unpack('<L', packets[0][12:16])[0]
+	if sampleRate == 0:
+		raise _Unsupported
+	
+	# The comment packet can be spread over several pages.
+	pages = 0
+	comment = b''
+	while True:
+		flags, position, pageSerial, packets, bComplete, pos = _ReadOggPage(head, pos)
+		if pageSerial != serial or len(packets) == 0 or bool(flags & 0x01) != (pages > 0):   # Multiplexed streams, or pages out of order.
+			raise _Unsupported
+		comment += packets[0]
+		pages += 1
+		if bComplete or len(packets) > 1:
+			break
+	if not comment.startswith(b'\x03vorbis'):
+		raise _Unsupported
+	tags, length = _ReadVorbisComment(comment[7:], True)
+	
+	# The length comes from the granule position of the last page.
+	tailStart = max(0, head.size - OGG_TAIL_SIZE)
+	tail = head.Read(tailStart, head.size - tailStart)
+	index = tail.rfind(b'OggS')
+	if index == -1:
+		raise _Unsupported
+	flags, position, pageSerial, packets, bComplete, pos = _ReadOggPage(_HeadFile(head=tail[index:]), 0)
+	if pageSerial != serial or position == -1 or not flags & 0x04:   # Otherwise mutagen reads the whole stream to find it.
+		raise _Unsupported
+	return tags, position / float(sampleRate)
+
+
+#  ----
+# --- FLAC
+#  ----
+
+def _ReadFLAC(head):
+	if head.Read(0, 4) != b'fLaC':
+		raise _Unsupported
+	
+	length = None
+	tags = None
+	pos = 4
+	bLastBlock = False
+	while not bLastBlock:
+		blockType, sizeHigh, sizeLow = struct.unpack('>BBH', head.Read(pos, 4))
+		bLastBlock = bool(blockType & 0x80)
+		blockType &= 0x7f
+		size = (sizeHigh << 16) | sizeLow
+		pos += 4
+		if pos + size > head.size:
+			raise _Unsupported
+		
+		if blockType == 0:   # STREAMINFO
+			if size != 34:
+				raise _Unsupported
+			if length is None:
+				data = head.Read(pos, size)
+				sampleRate = (struct.unpack('>H', data[10:12])[0] << 4) | (struct.unpack('>B', data[12:13])[0] >> 4)
+				if sampleRate == 0:
+					raise _Unsupported
+				totalSamples = struct.unpack('>Q', b'\x00\x00\x00' + data[13:18])[0] & 0xfffffffff
+				length = totalSamples / float(sampleRate)
+		elif blockType == 4:   # VORBIS_COMMENT
+			blockTags, commentLength = _ReadVorbisComment(head.Read(pos, size), False)
+			if commentLength != size:   # mutagen would go by the comment's length, not the block's.
+				raise _Unsupported
+			if tags is None:
+				tags = blockTags
+		elif blockType == 6:   # PICTURE. Only the lengths are read, to check that they add up to the block's size, as mutagen would go by them.
+			mimeLength = struct.unpack('>L', head.Read(pos + 4, 4))[0]
+			descLength = struct.unpack('>L', head.Read(pos + 8 + mimeLength, 4))[0]
+			dataLength = struct.unpack('>L', head.Read(pos + 28 + mimeLength + descLength, 4))[0]
+			if 32 + mimeLength + descLength + dataLength != size:
+				raise _Unsupported
+		elif blockType == 5:   # CUESHEET
+			raise _Unsupported
+		pos += size
+	
+	if length is None:
+		raise _Unsupported
+	return tags if tags is not None else {}, length
+
+
+#  ----
+# --- WAV
+#  ----
+
+def _BChunkID(chunkID):
+	"""Is this a plausible RIFF chunk ID (four printable ASCII characters)?"""
+	return all(32 <= c < 127 for c in bytearray(chunkID))
+
+def _ReadRIFFInfo(head, pos, end):
+	"""Get the tags we want from the subchunks of a LIST INFO chunk, between two offsets. Other subchunks are skipped without being read."""
+	tags = {}
+	while pos + 8 <= end:
+		chunkID, size = struct.unpack('<4sL', head.Read(pos, 8))
+		pos += 8
+		key = RIFF_INFO_KEYS.get(chunkID)
+		if key is not None and key not in tags and size <= end - pos:
+			value = head.Read(pos, size).split(b'\x00', 1)[0]
+			try:
+				value = value.decode('utf-8')
+			except UnicodeDecodeError:
+				value = value.decode('latin1')   # Older files are in whatever code page their writer used, which is usually this.
+			value = value.strip()
+			if len(value) > 0:
+				tags[key] = [value]
+		pos += size + (size & 1)
+	return tags
+
+def _ReadID3Chunk(head, pos, size):
+	"""Get the tags we want from the ID3v2 tag in an 'id3 ' chunk. If the header reader can't handle it, mutagen reads it instead. Returns no tags if it can't be read at all."""
+	try:
+		return _ReadID3Tags(head, pos)[0]
+	except Exception:
+		pass
+	try:
+		id3 = EasyID3(BytesIO(head.Read(pos, size)))
+	except Exception:
+		return {}
+	return dict((key, id3[key]) for key in ('title', 'artist', 'album', 'tracknumber', 'date', 'genre') if key in id3 and len(id3[key]) > 0)
+
+def _ReadWAV(head):
+	"""Walk the chunks of a RIFF (or RF64) WAVE file, reading only their headers, apart from the fmt chunk and any tag chunks. The sample data is never read."""
+	magic, riffSize, form = struct.unpack('<4sL4s', head.Read(0, 12))
+	if magic not in (b'RIFF', b'RF64', b'BW64') or form != b'WAVE':
+		raise _Unsupported
+	
+	fmt = None   # (format tag, channels, sample rate, byte rate, block align)
+	dataSize = None
+	sampleCount = None
+	ds64 = None   # (RIFF size, data size, sample count) for RF64 files, which don't fit in the usual 32-bit sizes.
+	info = {}
+	id3 = {}
+	pos = 12
+	while pos + 8 <= head.size:
+		chunkID, size = struct.unpack('<4sL', head.Read(pos, 8))
+		if not _BChunkID(chunkID):   # Junk after the last chunk.
+			break
+		pos += 8
+		if chunkID == b'ds64':
+			ds64 = struct.unpack('<QQQ', head.Read(pos, 24))
+		elif chunkID == b'fmt ':
+			fmt = struct.unpack('<HHLLH', head.Read(pos, 14))
+			if fmt[0] == WAVE_FORMAT_EXTENSIBLE and size >= 40:   # The real format tag starts the subformat GUID.
+				fmt = struct.unpack('<H', head.Read(pos + 24, 2)) + fmt[1:]
+		elif chunkID == b'fact':
+			sampleCount = struct.unpack('<L', head.Read(pos, 4))[0]
+			if sampleCount == 0xffffffff and ds64 is not None:
+				sampleCount = ds64[2]
+		elif chunkID == b'data':
+			dataSize = ds64[1] if size == 0xffffffff and ds64 is not None else size
+			if dataSize > head.size - pos:   # The file was cut short, or its size was never filled in.
+				dataSize = head.size - pos
+				break
+			size = dataSize
+		elif chunkID == b'LIST' and size >= 4 and head.Read(pos, 4) == b'INFO':
+			info = _ReadRIFFInfo(head, pos + 4, min(pos + size, head.size))
+		elif chunkID in (b'id3 ', b'ID3 '):
+			id3 = _ReadID3Chunk(head, pos, min(size, head.size - pos))
+		pos += size + (size & 1)   # Chunks are padded to an even size.
+	
+	if fmt is None or dataSize is None:
+		raise _Unsupported
+	formatTag, channels, sampleRate, byteRate, blockAlign = fmt
+	if formatTag in WAVE_FRAME_FORMATS and blockAlign > 0 and sampleRate > 0:
+		length = (dataSize // blockAlign) / float(sampleRate)
+	elif sampleCount is not None and sampleRate > 0:   # Compressed data, which should have a fact chunk.
+		length = sampleCount / float(sampleRate)
+	elif byteRate > 0:
+		length = dataSize / float(byteRate)
+	else:   # This is probably an error on the part of the file, but we'll accept it.
+		length = 0.0
+	
+	info.update(id3)   # ID3 tags take precedence, since they're what most tag editors write.
+	return info, length
+
+
+_READERS = {'.mp3': _ReadMP3, '.ogg': _ReadOgg, '.flac': _ReadFLAC, '.wav': _ReadWAV}
@@ -54,6 +54,9 @@ VOLUME_BAR_HEIGHT = 59
 PROGRESS_BAR_LEFT = 300
 PROGRESS_BAR_RIGHT = 20
 
+# Table columns that hold numbers, which are sorted as they are rather than as case-insensitive text.
+NUMERIC_COLUMNS = ('track', 'length', 'year')
+
 
 class CustomSplitter(QSplitter):
 	"""A custom QSplitter designed to work with my main widget."""
@@ -127,6 +130,7 @@ class MainWidget(QWidget):
 			if not GetBRemoveSingleTreeRootNode(config):
 				# Expand the first node of the tree.
 				firstIndex = self.tree.model().index(0, 0, QModelIndex())
+				self.dirSystemModel.AllowExpandLayer(firstIndex)
 				self.tree.setExpanded(firstIndex, True)
 		
 		self.tree.setStyleSheet('QTreeView { border: 0px; }')
@@ -245,7 +249,7 @@ class MainWidget(QWidget):
 	
 	def LibraryChangedCallback(self, bRedrawTree=True):
 		if bRedrawTree:
-			self.tree.model().Reload()
+			self.tree.model().Refresh()
 		self.table.ReloadQuery()
 		AcceptCurrentLibrary()
 	
@@ -265,7 +269,7 @@ class MainWidget(QWidget):
 	def LaunchSearch(self):
 		word = self.searchBox.text()
 		if len(word) > 0:
-			self.table.ModifyQuery(InsertWordSearchIntoQuery, word)
+			self.table.ModifyQuery(InsertTextSearchIntoQuery, word)
 	
 	def resizeEvent(self, event):
 		self.searchDecorationLeft.move(0, self.height() - SEARCH_AREA_HEIGHT)
@@ -398,38 +402,36 @@ class MainTable(SimpleTrackQueryTable):
 	
 	def LoadConfigFile(self):
 		columnSizes = {}
-		fieldLookup = {'title':'title AS Title', 'artist':'artist AS Artist', 'album':'album AS Album', 'track':"track AS '#'", 'length':'length AS Length', 'year':'year AS Year', 'genre':'genre AS Genre', 'path':'path AS Path'}
-		self.query = 'SELECT '
+		columns = []
 		
 		i = 0
 		while True:
 			if config.has_option('Table', 'c' + str(i)):
 				value = config.get('Table', 'c' + str(i))
-				if value not in fieldLookup:
+				if value not in TRACK_FIELDS:
 					raise ConfigValueError(value)
 				
 				self.columnHeaders[i] = value
 				self.columnVisualIndexes[i] = i
 				columnSizes[i] = int(config.get('Table', 'c' + str(i) + 'width'))
-				self.query += fieldLookup[value] + ', '
+				columns.append(TRACK_FIELDS[value])
 				
 				if value == 'path':
 					self.dataColumn = i   # Set the path column.
+				elif value == 'length':
+					self.model.SetColumnFormatter(i, PrintableAudioLength)   # Lengths are stored in milliseconds.
 			else:
 				break
 			i += 1
 		
 		# The path needs to be in our results somewhere, so generate and hide it if necessary.
 		if self.dataColumn is None:
-			self.query += 'path, '
+			columns.append('path')
 			self.dataColumn = i
 			self.bHidePathColumn = True
 		
-		# The initial query behavior. Note that we create an extra column as padding.
-		self.query += "NULL AS '' FROM File, Artist, Album, Genre WHERE File.artistid == Artist.artistid AND File.albumid == Album.albumid AND File.genreid == Genre.genreid ORDER BY "
-		
-		# The initial sorting behavior.
-		self.query += 'artist COLLATE NOCASE ASC, album COLLATE NOCASE ASC'
+		# The initial query behavior, with the initial sorting behavior. Note that we create an extra column as padding.
+		self.query = GetTrackQuery(columns + ["NULL AS ''"])
 		self.sortedHeader = 'artist'
 		self.sorted = SORTED_ASC
 		
@@ -448,18 +450,18 @@ class MainTable(SimpleTrackQueryTable):
 			return
 		#print('CLICKED', index, self.columnHeaders[index])   # TODO remove
 		header = self.columnHeaders[index]
+		collation = None if header in NUMERIC_COLUMNS else 'NOCASE'
 		if self.sortedHeader == header and self.sorted == SORTED_ASC:
-			if header == 'artist':
-				self.query = StripOrderBy(self.query) + ' ORDER BY artist COLLATE NOCASE DESC, album COLLATE NOCASE ASC'
-			else:
-				self.query = StripOrderBy(self.query) + ' ORDER BY ' + header + ' COLLATE NOCASE DESC'
 			self.sorted = SORTED_DESC
 		else:
-			if header == 'artist':
-				self.query = StripOrderBy(self.query) + ' ORDER BY artist COLLATE NOCASE ASC, album COLLATE NOCASE ASC'
-			else:
-				self.query = StripOrderBy(self.query) + ' ORDER BY ' + header + ' COLLATE NOCASE ASC'
 			self.sorted = SORTED_ASC
+		bDescending = self.sorted == SORTED_DESC
+		
+		self.query = self.query.Copy()
+		if header == 'artist':
+			self.query.SetOrder([('artist', 'NOCASE', bDescending), ('album', 'NOCASE', False)])
+		else:
+			self.query.SetOrder([(header, collation, bDescending)])
 		self.sortedHeader = header
 		self._LoadQuery(self.query, bLoadEvenIfSameQuery=True)
 		
@@ -616,6 +618,7 @@ class TrackFrame(QFrame):
 		super(TrackFrame, self).resizeEvent(event)
 	
 	def PlayFile(self, path):
+		oldDir = os.path.dirname(gbl.currentTrackPath) if gbl.currentTrackPath is not None else None
 		self.playerManager.PlayFile(path)
 		
 		# Set values for each field.
@@ -625,17 +628,14 @@ class TrackFrame(QFrame):
 		fontSize = int(config.get('General', 'paneFontSize'))
 		font = QFont(fontName, fontSize)
 		
-		oldDir = os.path.dirname(gbl.currentTrackPath) if gbl.currentTrackPath is not None else None
 		dir = os.path.dirname(tags[DB_PATH])
 		if dir != oldDir:
 			albumArtPath = GetAlbumArtFromDir(dir)
 			if albumArtPath is None:
+				GetAlbumArtCache().Cancel(self)   # Don't let the art of an earlier track show up later.
 				self.albumArt.hide()
 			else:
-				albumArtPixmap = QPixmap(albumArtPath)
-				self.albumArt.setPixmap(albumArtPixmap.scaled(ALBUM_ART_SIZE, ALBUM_ART_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation))
-				self.albumArt.resize(ALBUM_ART_SIZE, ALBUM_ART_SIZE)   # Note: This is only necessary when setting the album art later instead of at the start.
-				self.albumArt.show()
+				GetAlbumArtCache().Request(albumArtPath, ALBUM_ART_SIZE, self.SetAlbumArt, group=self)
 		
 		if tags[DB_ARTIST] is None:
 			self.artistText.setText('')
@@ -659,6 +659,14 @@ class TrackFrame(QFrame):
 		else:
 			self.genreText.setText(tags[DB_GENRE])
 	
+	def SetAlbumArt(self, pixmap):
+		if pixmap is None:
+			self.albumArt.hide()
+		else:
+			self.albumArt.setPixmap(pixmap)
+			self.albumArt.resize(ALBUM_ART_SIZE, ALBUM_ART_SIZE)   # Note: This is only necessary when setting the album art later instead of at the start.
+			self.albumArt.show()
+	
 	def DecreaseVolume(self):
 		self.playerManager.player.DecreaseVolume()
 		self.volumeBar.SetPercent(self.playerManager.player.GetVolume())
@@ -48,8 +48,6 @@ class MainWidget(QWidget):
 		super(MainWidget, self).__init__(parent)
 		self.parent = parent
 		
-		self.db = GetTableDB()
-		
 		scrollbarStyle = '''
 		QScrollBar::handle { background-color: #323232; border: 1px solid #2d2d2d; min-height: 14px; min-width: 14px; }
 		/*QScrollBar::handle { background-color: #8f8a5d; border: 1px solid #5e5c4f; min-height: 14px; min-width: 14px; }*/
@@ -63,13 +61,13 @@ class MainWidget(QWidget):
 		'''
 		
 		commonTableArgs = (self, 25, 52, 378, 150)
-		commonTableKwArgs = {'db':self.db, 'bgColor':'#141313', 'fontName':'Georgia', 'fontColor':'#8f8a5d', 'highlightColor':'#2f3026', 'scrollbarStyle':scrollbarStyle, 'bUseSingleClickedAsDouble':True}
+		commonTableKwArgs = {'bgColor':'#141313', 'fontName':'Georgia', 'fontColor':'#8f8a5d', 'highlightColor':'#2f3026', 'scrollbarStyle':scrollbarStyle, 'bUseSingleClickedAsDouble':True}
 		
 		self.trackTable = SimpleTrackQueryTable(*commonTableArgs, selectQueryPart='track, title', orderBy='track', columnSizes=(40,), **commonTableKwArgs)
 		self.trackTable.SetItemCallback(self.ChooseTrack)
 		self.trackTable.hide()
 		
-		self.artistTable = SimpleQueryTable(*commonTableArgs, query="SELECT artist from Artist WHERE artist <> '' ORDER BY artist COLLATE NOCASE ASC", **commonTableKwArgs)
+		self.artistTable = SimpleQueryTable(*commonTableArgs, query=Query(['artist'], 'Artist', ["artist <> ''"], [('artist', 'NOCASE', False)]), **commonTableKwArgs)
 		self.artistTable.SetItemCallback(self.ChooseArtist)
 		self.artistTable.hide()
 		
@@ -199,15 +197,15 @@ class MainWidget(QWidget):
 		self.playerManager.PlayFile(path)
 	
 	def ChooseArtist(self, artist, row):
-		artistAlbumQuery = "SELECT album FROM AlbumContainsArtist, Album, Artist WHERE AlbumContainsArtist.artistid=Artist.artistid AND AlbumContainsArtist.albumid=Album.albumid ORDER BY album COLLATE NOCASE ASC"
+		artistAlbumQuery = Query(['album'], 'AlbumContainsArtist, Album, Artist', ['AlbumContainsArtist.artistid=Artist.artistid AND AlbumContainsArtist.albumid=Album.albumid'], [('album', 'NOCASE', False)])
 		self.albumTable.LoadQuery(InsertArtistSearchIntoQuery(artistAlbumQuery, artist))
 		self.albumTable.show()
 		self.artistTable.hide()
 		self.tableStack.append(self.albumTable)
 		self.albumTable.setFocus()
 		self.albumTable.clearSelection()
-		self.albumTable.selectRow(0)
-		self.albumTable.scrollToTop()
+		self.albumTable.RunWhenLoaded(self.albumTable.selectRow, 0)
+		self.albumTable.RunWhenLoaded(self.albumTable.scrollToTop)
 	
 	def ChooseAlbum(self, album, row):
 		self.trackTable.ModifyQuery(InsertAlbumSearchIntoQuery, album)
@@ -217,8 +215,8 @@ class MainWidget(QWidget):
 		self.trackTable.setFocus()
 		if gbl.currentTrackRow is None:
 			self.trackTable.clearSelection()
-			self.trackTable.selectRow(0)
-			self.trackTable.scrollToTop()
+			self.trackTable.RunWhenLoaded(self.trackTable.selectRow, 0)
+			self.trackTable.RunWhenLoaded(self.trackTable.scrollToTop)
 	
 	def IncreaseVolume(self):
 		self.playerManager.player.IncreaseVolume()
@@ -319,12 +317,12 @@ class MainFrame(QFrame):
 		self.parent.tableStack.append(self.parent.artistTable)
 		self.parent.artistTable.setFocus()
 		self.parent.artistTable.clearSelection()
-		self.parent.artistTable.selectRow(0)
-		self.parent.artistTable.scrollToTop()
+		self.parent.artistTable.RunWhenLoaded(self.parent.artistTable.selectRow, 0)
+		self.parent.artistTable.RunWhenLoaded(self.parent.artistTable.scrollToTop)
 	
 	def AlbumsButton(self):
 		# Clear any previous search criteria.
-		self.parent.albumTable.LoadQuery("SELECT album from Album WHERE album <> '' ORDER BY album COLLATE NOCASE ASC")
+		self.parent.albumTable.LoadQuery(Query(['album'], 'Album', ["album <> ''"], [('album', 'NOCASE', False)]))
 		self.parent.trackTable.CreateQuery('track, title', '', orderBy='track')
 		
 		self.parent.albumTable.show()
@@ -333,8 +331,8 @@ class MainFrame(QFrame):
 		self.parent.tableStack.append(self.parent.albumTable)
 		self.parent.albumTable.setFocus()
 		self.parent.albumTable.clearSelection()
-		self.parent.albumTable.selectRow(0)
-		self.parent.albumTable.scrollToTop()
+		self.parent.albumTable.RunWhenLoaded(self.parent.albumTable.selectRow, 0)
+		self.parent.albumTable.RunWhenLoaded(self.parent.albumTable.scrollToTop)
 	
 	def SetFocusable(self):
 		self.artistsButton.setFocusPolicy(Qt.TabFocus)
@@ -0,0 +1,183 @@
+# kea-index
+#
+# Notes:
+#  A command-line tool for building and maintaining the music library database without the GUI,
+# say, to build data.db on a server from cron. Doesn't import Qt.
+#  Usage: kea_index.py [--db PATH] {add,rescan,incremental,resume,remove,stats} [dir ...]
+#  If a scan is interrupted (by Ctrl+C, say), the files stored so far are kept, and 'resume'
+# finishes it, reading only the files that are still missing. The same goes for scans interrupted
+# in the GUI.
+#  The database path and the no-chdir setting have to be given to gbl (through gbl_helper) before
+# gbl is imported, so the rest of kea is only imported once the arguments have been parsed. Dirs
+# are made absolute before then, too.
+#  Exits with 0 on success, 1 if anything failed, and 2 for bad arguments.
+
+
+from __future__ import print_function
+import sys, os, time, argparse, multiprocessing
+
+
+# Seconds between progress reports.
+PROGRESS_INTERVAL = 1.0
+
+# Exit codes.
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+
+
+class ScanProgress:
+	"""Counts the files read during a scan, and prints the progress and throughput now and then."""
+	
+	def __init__(self, out=sys.stderr):
+		self.out = out
+		self.files = 0
+		self.bytes = 0
+		self.startTime = time.time()
+		self.lastReportTime = self.startTime
+	
+	def FileRead(self, path, size):
+		self.files += 1
+		self.bytes += size if size is not None else 0
+		now = time.time()
+		if now - self.lastReportTime >= PROGRESS_INTERVAL:
+			self.lastReportTime = now
+			print('  ' + self.GetSummary(), file=self.out)
+			self.out.flush()
+	
+	def GetSummary(self):
+		elapsed = max(time.time() - self.startTime, 1e-9)
+		megabytes = self.bytes / (1024.0 * 1024.0)
+		return '{} files, {:.1f} MB read in {:.1f} s ({:.1f} files/s, {:.2f} MB/s)'.format(self.files, megabytes, elapsed, self.files / elapsed, megabytes / elapsed)
+
+
+def _GetDirs(args, db):
+	"""Get the dirs given on the command line, or all of the library dirs if there aren't any."""
+	return args.dirs if len(args.dirs) > 0 else db.GetLibraryDirs()
+
+def RunAdd(args, walker, db):
+	bFailed = False
+	for dir in args.dirs:
+		if not os.path.isdir(dir):
+			print('Not a dir: {}'.format(dir), file=sys.stderr)
+			bFailed = True
+			continue
+		print('Adding {}'.format(dir))
+		failed = walker.AddLibraryDirToDatabase(dir)
+		if failed is False:
+			print('  Already covered by a library dir.', file=sys.stderr)
+			bFailed = True
+		elif len(failed) > 0:
+			print('  {} files were already in the database.'.format(len(failed)), file=sys.stderr)
+	return bFailed
+
+def RunRescan(args, walker, db):
+	bFailed = False
+	for dir in _GetDirs(args, db):
+		print('Rescanning {}'.format(dir))
+		failed = walker.RescanLibraryDirOrSubdir(dir, args.bRescanTags)
+		if len(failed) > 0:
+			print('  {} files couldn\'t be added.'.format(len(failed)), file=sys.stderr)
+			bFailed = True
+	return bFailed
+
+def RunIncremental(args, walker, db):
+	bFailed = False
+	for dir in _GetDirs(args, db):
+		print('Rescanning {} (changed files only)'.format(dir))
+		report = walker.IncrementalRescanLibraryDirOrSubdir(dir)
+		print('  ' + str(report))
+		if len(report.failed) > 0:
+			print('  {} files couldn\'t be added.'.format(len(report.failed)), file=sys.stderr)
+			bFailed = True
+	return bFailed
+
+def RunResume(args, walker, db):
+	scans = db.GetInterruptedScans()
+	if len(args.dirs) > 0:
+		dirs = set(db.LibraryDirFormat(dir) for dir in args.dirs)
+		scans = [scan for scan in scans if scan[0] in dirs]
+	if len(scans) == 0:
+		print('There are no interrupted scans to resume.')
+	for dir, operation, fileCount, lastPath, startTime, updateTime in scans:
+		print('Resuming {} ({}, {} files stored)'.format(dir, operation, fileCount))
+		print('  {} files added.'.format(walker.ResumeInterruptedScan(dir)))
+	return False
+
+def RunRemove(args, walker, db):
+	for dir in args.dirs:
+		print('Removing {}'.format(dir))
+		walker.RemoveLibraryDirOrSubdirFromDatabase(dir)
+	return False
+
+def RunStats(args, walker, db):
+	from tags import PrintableAudioLength
+	for label, query in (('Library dirs', "SELECT COUNT(*) FROM LibraryDirs"), ('Files', "SELECT COUNT(*) FROM File"), ('Artists', "SELECT COUNT(*) FROM Artist"), ('Albums', "SELECT COUNT(*) FROM Album"), ('Genres', "SELECT COUNT(*) FROM Genre"), ('Dirs', "SELECT COUNT(*) FROM Dir WHERE EXISTS (SELECT 1 FROM LibraryDirs WHERE Dir.dir = LibraryDirs.dir OR (Dir.dir >= LibraryDirs.dir || '/' AND Dir.dir < LibraryDirs.dir || '0'))")):
+		print('{}: {}'.format(label, db.c.execute(query).fetchone()[0]))
+	totalSize = db.c.execute("SELECT IFNULL(SUM(size), 0) FROM File").fetchone()[0]
+	print('Total size: {:.1f} MB'.format(totalSize / (1024.0 * 1024.0)))
+	print('Total length: {}'.format(PrintableAudioLength(db.GetLibraryTotals()[1])))
+	print('Database: {} ({:.1f} MB)'.format(db.gbl.dbPath, os.path.getsize(db.gbl.dbPath) / (1024.0 * 1024.0)))
+	for dir in db.GetLibraryDirs():
+		print('  {}'.format(dir))
+	return False
+
+COMMANDS = {'add': RunAdd, 'rescan': RunRescan, 'incremental': RunIncremental, 'resume': RunResume, 'remove': RunRemove, 'stats': RunStats}
+
+
+def GetArgParser():
+	parser = argparse.ArgumentParser(prog='kea-index', description='Build and maintain the kea music library database without the GUI.')
+	parser.add_argument('--db', dest='dbPath', help='the database file to use (default: data.db in the program dir); it\'s created if it doesn\'t exist')
+	subparsers = parser.add_subparsers(dest='command', metavar='command')
+	subparsers.required = True
+	
+	subparser = subparsers.add_parser('add', help='add new library dirs and scan them')
+	subparser.add_argument('dirs', nargs='+', metavar='dir')
+	subparser = subparsers.add_parser('rescan', help='rescan library dirs or subdirs, adding new files (default: all library dirs)')
+	subparser.add_argument('--tags', dest='bRescanTags', action='store_true', help='reread the tags of every file, not just new ones')
+	subparser.add_argument('dirs', nargs='*', metavar='dir')
+	subparser = subparsers.add_parser('incremental', help='rescan library dirs or subdirs, only reading files that changed (default: all library dirs)')
+	subparser.add_argument('dirs', nargs='*', metavar='dir')
+	subparser = subparsers.add_parser('resume', help='finish interrupted scans, only reading the files they didn\'t get to (default: all interrupted scans)')
+	subparser.add_argument('dirs', nargs='*', metavar='dir')
+	subparser = subparsers.add_parser('remove', help='remove library dirs or subdirs from the library')
+	subparser.add_argument('dirs', nargs='+', metavar='dir')
+	subparsers.add_parser('stats', help='print library statistics')
+	return parser
+
+def main(argv=None):
+	args = GetArgParser().parse_args(argv)
+	args.dirs = [os.path.abspath(dir) for dir in getattr(args, 'dirs', [])]
+	
+	# This has to come before anything that imports gbl.
+	import gbl_helper
+	gbl_helper.programDir = os.path.dirname(os.path.abspath(__file__))
+	gbl_helper.bChangeDir = False
+	if args.dbPath is not None:
+		gbl_helper.dbPath = os.path.abspath(args.dbPath)
+	
+	from util import SepException
+	import db, walker
+	
+	walker.SetAutoTagReaderPoolType('process')   # Unlike the GUI, we have no threads or open connections to worry about copying into the workers.
+	progress = ScanProgress()
+	walker.SetScanProgressCallback(progress.FileRead)
+	try:
+		bFailed = COMMANDS[args.command](args, walker, db)
+	except (SepException, EnvironmentError) as e:
+		print('Error: {}'.format(e), file=sys.stderr)
+		bFailed = True
+	finally:
+		walker.SetScanProgressCallback(None)
+	
+	for dir, operation, fileCount, lastPath, startTime, updateTime in db.GetInterruptedScans():
+		print('The scan of {} was interrupted, with {} files stored. Use the resume command to finish it.'.format(dir, fileCount), file=sys.stderr)
+	db.CloseConnections()
+	
+	if progress.files > 0:
+		print(progress.GetSummary())
+	return EXIT_FAILURE if bFailed else EXIT_SUCCESS
+
+
+if __name__ == '__main__':
+	multiprocessing.freeze_support()   # The tag reader can use worker processes.
+	sys.exit(main())
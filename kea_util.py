@@ -15,12 +15,16 @@ except:
 	import ConfigParser as configparser
 
 from qt import *
-from util import LogicError, RequiredImportError
+from util import LogicError, RequiredImportError, FindAlbumArtInDir
 import gbl
 #from gbl import EnsureProgramDir
 import db
 from config import GetConfigFile, GetStandardWindowSetup, WriteConfigFile
-from walker import LibraryPathFormat
+from walker import ResumeInterruptedScan
+from query_executor import StopQueryExecutor
+from query_builder import GetTrackQuery, InsertDirSearchIntoQuery, InsertWordSearchIntoQuery, InsertTextSearchIntoQuery, InsertArtistSearchIntoQuery, InsertAlbumSearchIntoQuery
+from album_art_cache import GetAlbumArtCache, StopAlbumArtCache
+from watcher import StartWatchDirs, EndWatchDirs
 from hotkeys import GlobalWin32HotkeysApplication, DeleteGlobalHotkeys, DeleteGlobalWin32Hotkeys
 
 
@@ -48,10 +52,35 @@ def MakeKeaWindow(mainWindowClass, *mainWindowClassInitArgs, **kw_args):
 	#window.show()   # TODO remove.
 	
 	if bRun:
+		OfferToResumeInterruptedScans(window)
+		StartWatchDirs()
 		app.exec_()
 		
+		EndWatchDirs()
+		StopQueryExecutor()
+		StopAlbumArtCache()
+		db.CloseConnections()
+
+
+def OfferToResumeInterruptedScans(parent=None):
+	"""If any library scans were interrupted (say, because the program was closed or crashed partway through adding a library dir), ask the user whether to finish them now. They can also be discarded, leaving the files that were stored as they are, or left for next time."""
+	scans = db.GetInterruptedScans()
+	if len(scans) == 0:
+		return
+	
+	scanList = '\n'.join('{} ({}, {} files stored)'.format(dir, operation, fileCount) for dir, operation, fileCount, lastPath, startTime, updateTime in scans)
+	reply = QMessageBox.question(parent, 'Resume Library Scans', 'These library scans were interrupted, so some of their files are missing from the library:\n\n' + scanList + '\n\nFinish them now? Only the missing files will be read. (To finish them later, choose No. To leave the library as it is, choose Discard.)', QMessageBox.Yes | QMessageBox.No | QMessageBox.Discard, QMessageBox.Yes)
+	if reply == QMessageBox.Yes:
+		QApplication.setOverrideCursor(Qt.WaitCursor)
+		try:
+			for scan in scans:
+				ResumeInterruptedScan(scan[0])
+		finally:
+			QApplication.restoreOverrideCursor()
+	elif reply == QMessageBox.Discard:
+		for scan in scans:
+			db.EndScanJournal(scan[0])
 		db.conn.commit()
-		db.conn.close()
 
 
 def MakeStdArgsKeaWindow(mainWindowClass, mainWidgetClass, configFileOrFileAttribute, **kw_args):
@@ -104,24 +133,20 @@ def MakeStdArgsKeaWindow(mainWindowClass, mainWidgetClass, configFileOrFileAttri
 def RunStdInterface(parentClass, mainWidgetClass, configFile, bWindowUsesConfigFile=True):
 	"""The standard code used to run a non-shaped interface. Pass in the main window class, main widget class, and the interface's config file object. Set 'bWindowUsesConfigFile' to False if using a window base class."""
 	try:
-		#StartWatchDirs()   # TODO
 		MakeStdArgsKeaWindow(parentClass, mainWidgetClass, configFile, bWindowUsesConfigFile=bWindowUsesConfigFile)
 		if gbl.saveInterfaceChanges:   # In case the user is trying to reset the interface config file to the backup file, we don't want to overwrite the config file.
 			WriteConfigFile(configFile)
 	finally:
-		pass #EndWatchDirs()   # TODO
 		DeleteGlobalHotkeys()
 		DeleteGlobalWin32Hotkeys()
 
 def RunShapedInterface(parentClass, shapedImgPath, mainWidgetClass, configFile, bWindowUsesConfigFile=True):
 	"""The standard code used to run a shaped interface. Pass in the main window class, main widget class, and the interface's config file object. Set 'bWindowUsesConfigFile' to False if using a window base class."""
 	try:
-		#StartWatchDirs()   # TODO
 		MakeStdArgsKeaWindow(parentClass, mainWidgetClass, configFile, bWindowUsesConfigFile=bWindowUsesConfigFile, shapedImgPath=shapedImgPath)
 		if gbl.saveInterfaceChanges:   # In case the user is trying to reset the interface config file to the backup file, we don't want to overwrite the config file.
 			WriteConfigFile(configFile)
 	finally:
-		pass #EndWatchDirs()   # TODO
 		DeleteGlobalHotkeys()
 		DeleteGlobalWin32Hotkeys()
 
@@ -289,80 +314,12 @@ def CreateStdHotkeys(widget, playerManager, configFile=None, bUseGlobalHotkeys=N
 	QShortcut(QKeySequence('Space'), widget, playerManager.TogglePaused)
 
 
-#  -------------
-# --- Databases
-#  -------------
-
-def GetTableDB():
-	db = QSqlDatabase.addDatabase('QSQLITE')
-	db.setDatabaseName(gbl.dbPath)
-	db.open()
-	return db
-
-
 #  -----------
 # --- Queries
 #  -----------
 
 def GetStandardTrackQuery():
-	return 'SELECT track, title, path FROM File, Artist, Album, Genre WHERE File.artistid == Artist.artistid AND File.albumid == Album.albumid AND File.genreid == Genre.genreid ORDER BY artist COLLATE NOCASE ASC, album COLLATE NOCASE ASC'
-
-def StripOrderBy(query):
-	"""Strips the query string of the 'ORDER BY' string and everything after it. Leaves any whitespace before 'ORDER BY'. Only works if the string uses the fully capitalized version of 'ORDER BY.'"""
-	pos = query.find('ORDER BY')
-	if pos != -1:
-		return query[:pos]
-	return query
-
-
-# TODO maybe make more flexible
-def InsertSearchIntoQuery(query, clause, word, clauseSuffix=u"{}'"):
-	"""Insert a case-insensitive search into a query.
-	Note that the query must have an ORDER BY clause and a WHERE clause, and that an existing query, if it queries some column, 'column', will always use the "AND column='...'" format (using = or LIKE), indicating the existence of previous WHERE checks as well).
-	You must pass in AND at the start of 'clause', and a single quote at the end, as in "AND column='".
-	'clauseSuffix' must be a Unicode string for Python 2 compatibility. It is used for string formatting. Note the SQL wildcard character, %.
-	The point is, the query and arguments must be formatted very specially.
-	"""
-	
-	if not query.find('WHERE'):
-		raise LogicError('Invalid query (no WHERE clause)')
-	orderByPos = query.find('ORDER BY')
-	if orderByPos == -1:
-		raise LogicError('Invalid query (no ORDER BY clause)')
-	
-	word = word.replace("'", "''")   # Escape the quote character.
-	
-	clausePos = query.find(clause)
-	if clausePos != -1:
-		endClausePos = query.find("'", clausePos + len(clause))
-		while endClausePos != -1:
-			if len(query) > endClausePos + 1 and query[endClausePos + 1] == "'":   # We found an escaped quote, ignore it.
-				endClausePos = query.find("'", endClausePos + 2)
-			else:
-				break
-		if endClausePos == -1:
-			raise LogicError('Invalid query (unmatched quote in clause.)')
-		
-		query = query[:clausePos] + clause + clauseSuffix.format(word) + query[endClausePos + 1:]
-	else:
-		query = query[:orderByPos] + clause + clauseSuffix.format(word) + u' ' + query[orderByPos:]
-	
-	return query
-
-def InsertDirSearchIntoQuery(query, dir):
-	dir = LibraryPathFormat(dir)
-	if not dir.endswith('/'):   # It might be a drive, in which case it'll have a slash at the end.
-		dir += '/'
-	return InsertSearchIntoQuery(query, "AND path LIKE '", dir, u"{}%'")
-
-def InsertWordSearchIntoQuery(query, word):
-	return InsertSearchIntoQuery(query, "AND path LIKE '", word, u"%{}%'")
-
-def InsertArtistSearchIntoQuery(query, artist):
-	return InsertSearchIntoQuery(query, "AND artist='", artist)
-
-def InsertAlbumSearchIntoQuery(query, album):
-	return InsertSearchIntoQuery(query, "AND album='", album)
+	return GetTrackQuery(['track', 'title', 'path'])
 
 
 
@@ -382,12 +339,28 @@ class DrawPixmap:
 		self.y = y
 
 
+_artlessDirMtimes = {}   # Dir: its mtime when it was last found to have no album art.
+
 def GetAlbumArtFromDir(dir):
-	for filename in gbl.albumArtFilenames:
-		path = os.path.join(dir, filename)
-		if os.path.isfile(path):
-			return path
-	return None
+	"""Get the path of the album art in a dir, or None if there isn't any. The path is normally stored in the database when the dir is scanned, so the dir doesn't have to be checked. A stored path that no longer exists is looked up again, and so is a dir stored without album art, if its mtime has changed since it was last looked at (an image added to the dir changes it). Pass in a dir with forwards slashes only."""
+	artPath = db.GetDirArtPath(dir)   # None if the dir was scanned before album art was stored, or isn't in the library.
+	if artPath and os.path.isfile(artPath):
+		return artPath
+	
+	try:
+		mtime = os.path.getmtime(dir)
+	except OSError:
+		mtime = None
+	if artPath == '' and (mtime is None or _artlessDirMtimes.get(dir) == mtime):
+		return None
+	
+	newArtPath = FindAlbumArtInDir(dir) or ''
+	if len(newArtPath) == 0:
+		_artlessDirMtimes[dir] = mtime
+	if newArtPath != artPath:
+		db.SetDirArtPaths({dir: newArtPath})
+		db.conn.commit()
+	return newArtPath if len(newArtPath) > 0 else None
 
 
 def GetHoverButton(parent, imgPath, hoverImgPath, bFocusable=False):
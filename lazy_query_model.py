@@ -0,0 +1,179 @@
+# Lazy query model
+#
+# Notes:
+#  A read-only table model for the results of a query, which only reads the rows that are
+# actually looked at. It's a stand-in for QSqlQueryModel, which has to fetch every row of a query
+# before the last rows can be used. See query_pager.py for the details of how rows are read.
+#  The slow parts of loading a query (counting its rows and sorting them to get the first page)
+# are done by the query executor's worker thread, as are reads of the pages that the view scrolls
+# to. Until a query is loaded, the model is empty and BLoading() is True. Meanwhile, data() shows
+# rows that haven't been read yet as blank, and fills them in when they arrive. Code that needs a
+# value right away, such as the player's Next button, should use GetRowCount() and GetValue()
+# instead, which read whatever they need in the GUI thread.
+#  Values are shown as they're stored, unless their column has a formatter. Lengths, say, are
+# stored in milliseconds, so that they sort and add up as numbers, and are only turned into text
+# here. GetValue() always gives the stored values.
+#  Once all of a query's rows have been read, they're kept in the result cache (see result_cache),
+# so that loading the same query again, as going back to a view does, shows its rows right away
+# without running it. Cached rows are only used until the library changes (see
+# gbl.SetLibraryChanged()), including changes made by other processes, such as kea-index.
+
+
+from qt import *
+import gbl
+import db
+from query_pager import QueryPager
+from query_executor import GetQueryExecutor
+from result_cache import GetResultCache, EstimateResultSize
+
+
+class LazyQueryModel(QAbstractTableModel):
+	"""
+	A read-only table model that reads the results of a query a page at a time, as rows are shown or asked for. The number of rows is found with a COUNT query. Queries are loaded in the background.
+	Quick guide:
+	Call SetQuery() to load a query. The loadingChanged signal is emitted when loading starts and stops. Queries whose results are cached are loaded right away.
+	Use data() as with any other model, or call GetRowCount() and GetValue() to get results without waiting for the background loading.
+	Call SetColumnFormatter() to change how a column's values are shown.
+	"""
+	
+	loadingChanged = Signal(bool)
+	
+	def __init__(self, parent=None, keyColumn=None):
+		"""Set up the model. If the results of its queries will always include a unique column, such as File.fileid, pass it in as 'keyColumn' so that pages can be read using keyset pagination."""
+		super(LazyQueryModel, self).__init__(parent)
+		self.keyColumn = keyColumn
+		self.pager = None
+		self.resultKey = None   # (Cache key, library generation) of the pager's results, until they're cached.
+		self.bLoading = False
+		self.requestedPages = set()   # Pages that have been asked for in the background, but haven't arrived yet.
+		self.columnFormatters = {}   # Column: function that turns the column's values into display text.
+	
+	def SetColumnFormatter(self, column, formatter):
+		"""Show the values of a column as formatter(value), rather than as they're stored. NULLs are still shown as blanks. Pass None to show the stored values again. This lasts across queries, and doesn't affect GetValue()."""
+		if formatter is None:
+			self.columnFormatters.pop(column, None)
+		else:
+			self.columnFormatters[column] = formatter
+	
+	def SetQuery(self, query):
+		"""Load a query (a query_builder Query), dropping the results of the previous one. If the query's results are cached, they're used right away. Otherwise, only the column names are read right away, so that columns can be set up, and the rows are loaded in the background. If another query is loaded before this one is finished, this one is canceled."""
+		self._CacheResult()   # All of the previous query's rows may have been read by now.
+		if db.BChangedByOtherConnections():
+			gbl.SetLibraryChanged()
+		resultKey = ((query.GetKey(), self.keyColumn), gbl.GetLibraryGeneration())
+		result = GetResultCache().Get(*resultKey)
+		if result is not None:
+			columnNames, rows = result
+			pager = QueryPager(query, self.keyColumn, columnNames=columnNames)
+			pager.StoreRows(rows)
+		else:
+			pager = QueryPager(query, self.keyColumn)
+		
+		self.beginResetModel()
+		self.pager = pager
+		self.resultKey = resultKey if result is None else None
+		self.requestedPages = set()
+		self.bLoading = result is None   # Keep the view from asking for the row count in the meantime.
+		self.endResetModel()
+		
+		if result is not None:
+			GetQueryExecutor().Cancel(self)   # Any query that's still loading has been superseded.
+			self._SetLoading(False)
+			return
+		GetQueryExecutor().Submit(lambda conn: (pager.ReadRowCount(conn), pager.ReadPage(0, conn)), lambda result: self._OnQueryLoaded(pager, result), group=self, errorCallback=lambda error: self._OnQueryFailed(pager))
+		self._SetLoading(True)
+	
+	def BLoading(self):
+		return self.bLoading
+	
+	def _SetLoading(self, bLoading):
+		self.bLoading = bLoading
+		self.loadingChanged.emit(bLoading)
+	
+	def _OnQueryLoaded(self, pager, result):
+		if pager is not self.pager:   # Superseded by a newer query.
+			return
+		rowCount, rows = result
+		pager.SetRowCount(rowCount)
+		pager.StorePage(0, rows)
+		
+		# Add the rows, rather than resetting the model, so that the view keeps its column setup.
+		if rowCount > 0:
+			self.beginInsertRows(QModelIndex(), 0, rowCount - 1)
+		self.bLoading = False
+		if rowCount > 0:
+			self.endInsertRows()
+		self._SetLoading(False)
+		self._CacheResult()
+	
+	def _OnQueryFailed(self, pager):
+		"""Show a query that couldn't be loaded as empty. The error has already been logged by the query executor."""
+		if pager is not self.pager:
+			return
+		self.resultKey = None   # There's nothing worth caching.
+		self._OnQueryLoaded(pager, (0, []))
+	
+	def _OnPageRead(self, pager, page, rows):
+		if pager is not self.pager:
+			return
+		self.requestedPages.discard(page)
+		pager.StorePage(page, rows)
+		firstRow = page * pager.pageSize
+		lastRow = min(firstRow + pager.pageSize, pager.GetRowCount()) - 1
+		self.dataChanged.emit(self.index(firstRow, 0), self.index(lastRow, pager.GetColumnCount() - 1))
+		self._CacheResult()
+	
+	def _CacheResult(self):
+		"""Put the current query's results into the result cache, if all of its rows have been read and they haven't been cached already."""
+		if self.resultKey is None or self.bLoading:
+			return
+		rows = self.pager.GetStoredRows()
+		if rows is not None:
+			GetResultCache().Put(self.resultKey[0], self.resultKey[1], (self.pager.GetColumnNames(), rows), EstimateResultSize(rows))
+			self.resultKey = None
+	
+	def GetRowCount(self):
+		"""Get the number of rows in the results. If the query is still loading, they're counted in the GUI thread."""
+		if self.pager is None:
+			return 0
+		return self.pager.GetRowCount()
+	
+	def GetValue(self, row, column):
+		"""Get the value at a row and column, or None if there is no such row or column. If the value hasn't been read yet, it's read in the GUI thread."""
+		if self.pager is None:
+			return None
+		return self.pager.GetValue(row, column)
+	
+	def rowCount(self, parent=QModelIndex()):
+		if self.pager is None or self.bLoading or parent.isValid():
+			return 0
+		return self.pager.GetRowCount()
+	
+	def columnCount(self, parent=QModelIndex()):
+		if self.pager is None or parent.isValid():
+			return 0
+		return self.pager.GetColumnCount()
+	
+	def data(self, index, role=Qt.DisplayRole):
+		if not index.isValid() or role != Qt.DisplayRole or self.pager is None:
+			return None
+		
+		pager = self.pager
+		page = pager.GetPageNum(index.row())
+		if pager.BPageStored(page):
+			value = pager.GetValue(index.row(), index.column())
+			formatter = self.columnFormatters.get(index.column())
+			if formatter is not None and value is not None:
+				return formatter(value)
+			return value
+		
+		# Read the page in the background, and leave the row blank until it arrives.
+		if page not in self.requestedPages:
+			self.requestedPages.add(page)
+			GetQueryExecutor().Submit(lambda conn: pager.ReadPage(page, conn), lambda rows: self._OnPageRead(pager, page, rows), group=self, bReplaceGroup=False)   # It's canceled along with its query.
+		return None
+	
+	def headerData(self, section, orientation, role=Qt.DisplayRole):
+		if orientation == Qt.Horizontal and role == Qt.DisplayRole and self.pager is not None and section < self.pager.GetColumnCount():
+			return self.pager.GetColumnNames()[section]   # Column names, including any AS names given in the query.
+		return super(LazyQueryModel, self).headerData(section, orientation, role)
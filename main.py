@@ -8,7 +8,7 @@
 
 #!/usr/bin/env python
 from __future__ import absolute_import
-import sys, os, importlib
+import sys, os, importlib, multiprocessing
 
 try:
 	import configparser
@@ -23,6 +23,7 @@ import db
 from config import GetDefaultInterfaceName
 
 if __name__ == '__main__':
+	multiprocessing.freeze_support()   # The tag reader can use worker processes, which need this in a cx_Freeze-built executable on Windows.
 	try:
 		if BOnLinux():
 			#  PyQt4 seems to have a bug that leads to this message appearing: "(python:xxxx): Gtk-CRITICAL **: IA__gtk_widget_style_get: assertion 'GTK_IS_WIDGET (widget)' failed"
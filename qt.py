@@ -31,5 +31,6 @@ elif _qtLib == PYQT4:
 	from PyQt4.QtCore import *
 	from PyQt4.QtSql import *
 	from PyQt4.phonon import Phonon
+	Signal = pyqtSignal   # Use PySide's name for signals.
 else:
 	raise RequiredImportError('No Qt library found.')
\ No newline at end of file
@@ -0,0 +1,160 @@
+# Query builder
+#
+# Notes:
+#  The tables' queries are kept in pieces (the columns, the tables, the filters, and the sort
+# order) rather than as SQL text, and only compiled into SQL when they're run. Values are never put
+# into the SQL text itself; they're bound as parameters. So they don't need escaping, and queries
+# which only differ in their values (two dirs clicked in the tree, say) compile to the same SQL,
+# which SQLite only has to prepare once.
+#  Filters are named, so one kind of filter can be replaced without touching the others. All of
+# the path searches (dir, word, and full-text searches) use the same name, since only one of them
+# is used at a time.
+#  Doesn't use Qt, so it can be used outside of the GUI thread.
+
+
+import re
+from collections import OrderedDict
+
+from util import GetDirPathRange
+import db
+
+
+# The track table columns that can be chosen in an interface's config file, and the SQL that selects each of them.
+TRACK_FIELDS = {'title':'title AS Title', 'artist':'artist AS Artist', 'album':'album AS Album', 'track':"track AS '#'", 'length':'length AS Length', 'year':'year AS Year', 'genre':'genre AS Genre', 'path':'path AS Path'}
+
+# The tables that track queries select from, and the condition that joins them.
+TRACK_TABLES = 'File, Artist, Album, Genre'
+TRACK_JOIN = 'File.artistid == Artist.artistid AND File.albumid == Album.albumid AND File.genreid == Genre.genreid'
+
+# The default sort order of track queries, as (expression, collation, bDescending) terms.
+TRACK_ORDER = [('artist', 'NOCASE', False), ('album', 'NOCASE', False)]
+
+# Filter names.
+PATH_FILTER = 'path'
+ARTIST_FILTER = 'artist'
+ALBUM_FILTER = 'album'
+
+
+def ParseOrderBy(orderBy):
+	"""Split the contents of an ORDER BY clause, such as 'artist COLLATE NOCASE ASC, track', into a list of (expression, collation, bDescending) terms. 'collation' is None if the term doesn't have one."""
+	terms = []
+	for term in orderBy.split(','):
+		match = re.match(r'\s*(.+?)(?:\s+COLLATE\s+(\w+))?(?:\s+(ASC|DESC))?\s*$', term, re.IGNORECASE)
+		terms.append((match.group(1), match.group(2), match.group(3) is not None and match.group(3).upper() == 'DESC'))
+	return terms
+
+def FormatSortTerm(term):
+	"""Turn an (expression, collation, bDescending) term back into ORDER BY text."""
+	expression, collation, bDescending = term
+	if collation is not None:
+		expression += ' COLLATE ' + collation
+	return expression + (' DESC' if bDescending else ' ASC')
+
+
+class Query:
+	"""
+	A SELECT query, kept in pieces, which compiles to SQL with its values bound as parameters. Queries compare equal if they compile to the same SQL and arguments.
+	Quick guide:
+	Call SetFilter() to add or replace a named condition, with its arguments, and RemoveFilter() to remove one. Call SetOrder() to change the sort order.
+	Call GetSQL() and GetArgs() to get the compiled query, ready for execute().
+	Call Copy() before changing a query that may be in use elsewhere, such as a table's current query.
+	"""
+	
+	def __init__(self, columns, tables, conditions=(), order=()):
+		"""Set up the query. 'columns' is a list of column expressions, 'tables' is the text of the FROM clause, 'conditions' are WHERE conditions that are always used, and 'order' is a list of (expression, collation, bDescending) terms (see ParseOrderBy())."""
+		self.columns = list(columns)
+		self.tables = tables
+		self.conditions = list(conditions)
+		self.filters = OrderedDict()   # Name: (condition, args).
+		self.order = list(order)
+	
+	def Copy(self):
+		query = Query(self.columns, self.tables, self.conditions, self.order)
+		query.filters = OrderedDict(self.filters)
+		return query
+	
+	def SetFilter(self, name, condition, *args):
+		"""Add a condition to the query's WHERE clause under a name, replacing any condition with the same name. Use a '?' in the condition for each argument."""
+		self.filters[name] = (condition, args)
+	
+	def RemoveFilter(self, name):
+		self.filters.pop(name, None)
+	
+	def BHasFilter(self, name):
+		return name in self.filters
+	
+	def SetOrder(self, order):
+		"""Replace the sort order with a list of (expression, collation, bDescending) terms. An empty list leaves the results unsorted."""
+		self.order = list(order)
+	
+	def GetSQL(self, bOrdered=True):
+		"""Compile the query into SQL, leaving out its ORDER BY clause if 'bOrdered' is False."""
+		sql = 'SELECT ' + ', '.join(self.columns) + ' FROM ' + self.tables
+		conditions = self.conditions + [condition for condition, args in self.filters.values()]
+		if len(conditions) > 0:
+			sql += ' WHERE ' + ' AND '.join('(' + condition + ')' for condition in conditions)
+		if bOrdered and len(self.order) > 0:
+			sql += ' ORDER BY ' + ', '.join(FormatSortTerm(term) for term in self.order)
+		return sql
+	
+	def GetArgs(self):
+		"""Get the arguments of the compiled query, in the order their parameters appear in GetSQL()."""
+		args = []
+		for condition, filterArgs in self.filters.values():
+			args.extend(filterArgs)
+		return args
+	
+	def GetKey(self):
+		"""Get a hashable value that identifies the compiled query, arguments and all."""
+		return self.GetSQL(), tuple(self.GetArgs())
+	
+	def __eq__(self, other):
+		return isinstance(other, Query) and self.GetKey() == other.GetKey()
+	
+	def __ne__(self, other):
+		return not self == other
+	
+	def __repr__(self):
+		return 'Query({!r}, {!r})'.format(self.GetSQL(), self.GetArgs())
+
+
+#  -----------------
+# --- Track queries
+#  -----------------
+
+def GetTrackQuery(columns, order=TRACK_ORDER):
+	"""Get a query for the tracks in the library, selecting the given column expressions (see TRACK_FIELDS), along with the names of their artists, albums, and genres."""
+	return Query(columns, TRACK_TABLES, [TRACK_JOIN], order)
+
+def InsertDirSearchIntoQuery(query, dir):
+	"""Get a copy of a track query, limited to the files within a dir, replacing any other path search. The dir is searched as a range of paths, so that SQLite can use the File table's path index."""
+	query = query.Copy()
+	query.SetFilter(PATH_FILTER, 'path >= ? AND path < ?', *GetDirPathRange(db.LibraryDirFormat(dir)))
+	return query
+
+def InsertWordSearchIntoQuery(query, word):
+	"""Get a copy of a track query, limited to the files whose paths contain a word, replacing any other path search."""
+	query = query.Copy()
+	query.SetFilter(PATH_FILTER, 'path LIKE ?', u'%{}%'.format(word))
+	return query
+
+def InsertTextSearchIntoQuery(query, text):
+	"""Get a copy of a track query, limited to the files whose tags or paths match the text typed into a search box, replacing any other path search. See db.GetFullTextSearchQuery() for the search syntax. If SQLite has no full-text search, or the text has no words in it, this falls back to InsertWordSearchIntoQuery()."""
+	matchQuery = db.GetFullTextSearchQuery(text) if db.bFullTextSearch else None
+	if matchQuery is None:
+		return InsertWordSearchIntoQuery(query, text)
+	query = query.Copy()
+	query.SetFilter(PATH_FILTER, 'File.fileid IN (SELECT rowid FROM FileSearch WHERE FileSearch MATCH ?)', matchQuery)
+	return query
+
+def InsertArtistSearchIntoQuery(query, artist):
+	"""Get a copy of a query that names the Artist table, limited to one artist."""
+	query = query.Copy()
+	query.SetFilter(ARTIST_FILTER, 'artist=?', artist)
+	return query
+
+def InsertAlbumSearchIntoQuery(query, album):
+	"""Get a copy of a query that names the Album table, limited to one album."""
+	query = query.Copy()
+	query.SetFilter(ALBUM_FILTER, 'album=?', album)
+	return query
@@ -0,0 +1,164 @@
+# Query executor
+#
+# Notes:
+#  Runs database reads in a worker thread, so that slow queries don't freeze the GUI. The worker
+# thread has a read-only sqlite connection of its own, since connections can't be shared between
+# threads. Since the database is in WAL mode, its reads don't wait for library scans.
+# Results are passed back to the GUI thread through a signal, and handled there by callbacks.
+#  Tasks can be put into groups (one per table, say), in which case only the latest task in the
+# group matters. Submitting a task cancels any earlier task in its group: if the earlier task is
+# still waiting, it's skipped, and if it's running, its query is interrupted. Either way, its
+# callback is never run. This means that when the user clicks through several tree nodes
+# quickly, only the last of them gets queried in full, and the results of an older query can
+# never replace those of a newer one. Tasks that shouldn't cancel the rest of their group, such as
+# reads of further pages of a table's query, can be added to it without replacing it, so that they
+# are canceled along with it.
+#  If a task raises an exception, the error is logged (see gbl.errorPath) and passed to the task's
+# error callback, if it has one, in the GUI thread. It's never raised there, where it would escape
+# into the event loop.
+
+
+import sys, threading, traceback, time, datetime
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+from qt import *
+import gbl
+import db
+
+
+class _Task:
+	def __init__(self, func, callback, group, errorCallback):
+		self.func = func
+		self.callback = callback
+		self.group = group
+		self.errorCallback = errorCallback
+		self.bCanceled = False
+		self.result = None
+		self.error = None
+		self.errorTraceback = None
+
+
+class QueryExecutor(QThread):
+	"""
+	A worker thread that runs database reads for the GUI thread.
+	Quick guide:
+	Call Submit() to run a function in the worker thread and pass its result to a callback in the GUI thread.
+	Call Cancel() to cancel the tasks in a group.
+	Call Stop() before the program exits.
+	"""
+	
+	taskDone = Signal(object)
+	
+	def __init__(self, dbPath=None):
+		super(QueryExecutor, self).__init__()
+		self.dbPath = dbPath if dbPath is not None else gbl.dbPath
+		self.tasks = queue.Queue()
+		self.lock = threading.Lock()   # Guards the running task, the group tasks, and the connection.
+		self.runningTask = None
+		self.groupTasks = {}   # Group: list of the tasks in that group that haven't finished yet.
+		self.conn = None
+		self.taskDone.connect(self._OnTaskDone)   # The executor object itself belongs to the GUI thread, so this is a queued connection.
+	
+	def Submit(self, func, callback, group=None, errorCallback=None, bReplaceGroup=True):
+		"""Run func(conn) in the worker thread, where 'conn' is the worker's sqlite3 connection, then run callback(result) in the GUI thread. If func raises an exception, the error is logged and errorCallback(error), if given, is run in the GUI thread instead. If a group is given (any hashable value), earlier tasks in the same group are canceled, unless 'bReplaceGroup' is False, in which case the task just joins the group. Returns the task."""
+		task = _Task(func, callback, group, errorCallback)
+		if group is not None:
+			if bReplaceGroup:
+				self.Cancel(group)
+			with self.lock:
+				self.groupTasks.setdefault(group, []).append(task)
+		self.tasks.put(task)
+		return task
+	
+	def Cancel(self, group):
+		"""Cancel the tasks in a group. A running query is interrupted."""
+		with self.lock:
+			for task in self.groupTasks.pop(group, ()):
+				task.bCanceled = True
+				if task is self.runningTask and self.conn is not None:
+					self.conn.interrupt()   # Unlike other connection methods, this one can be called from any thread.
+	
+	def Stop(self):
+		"""Stop the worker thread after its current task, and wait for it to finish."""
+		self.tasks.put(None)
+		self.wait()
+	
+	def run(self):
+		conn = db.Connect(self.dbPath, bReadOnly=True)
+		with self.lock:
+			self.conn = conn
+		try:
+			while True:
+				task = self.tasks.get()
+				if task is None:
+					break
+				with self.lock:
+					if task.bCanceled:
+						continue
+					self.runningTask = task
+				
+				try:
+					task.result = task.func(conn)
+				except Exception as e:
+					task.error = e   # Interruptions show up as errors, too, but canceled tasks are dropped anyway.
+					task.errorTraceback = traceback.format_exc()
+				finally:
+					with self.lock:
+						self.runningTask = None
+				
+				if not task.bCanceled:
+					self.taskDone.emit(task)
+		finally:
+			with self.lock:
+				self.conn = None
+			db.ForgetConnectionStatements(conn)
+			conn.close()
+	
+	def _OnTaskDone(self, task):
+		if task.bCanceled:   # It may have been canceled after it finished.
+			return
+		with self.lock:
+			groupTasks = self.groupTasks.get(task.group)
+			if groupTasks is not None and task in groupTasks:
+				groupTasks.remove(task)
+				if len(groupTasks) == 0:
+					del self.groupTasks[task.group]
+		if task.error is not None:
+			_LogTaskError(task)
+			if task.errorCallback is not None:
+				task.errorCallback(task.error)
+			return
+		task.callback(task.result)
+
+
+def _LogTaskError(task):
+	"""Log the traceback of a task that failed to the error log, the same way kea_util.LogTraceback() logs errors in the GUI thread."""
+	sys.stdout.write(task.errorTraceback + '\n')
+	timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%m/%d/%Y %I:%M:%S %p')
+	with open(gbl.errorPath, 'a') as errorFile:
+		errorFile.write(timestamp)
+		errorFile.write(':\n\n')
+		errorFile.write(task.errorTraceback)
+		errorFile.write('\n')
+
+
+_executor = None
+
+def GetQueryExecutor():
+	"""Get the program's query executor, starting its thread if this is the first time it's been asked for."""
+	global _executor
+	if _executor is None:
+		_executor = QueryExecutor()
+		_executor.start()
+	return _executor
+
+def StopQueryExecutor():
+	"""Stop the program's query executor, if it was ever started."""
+	global _executor
+	if _executor is not None:
+		_executor.Stop()
+		_executor = None
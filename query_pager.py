@@ -0,0 +1,189 @@
+# Query pager
+#
+# Notes:
+#  Reads the results of a query a page at a time, so that a table can show part of a large result
+# set without loading all of it. Doesn't use Qt, so it can be used outside of the GUI thread.
+#  Pages are found by keyset pagination when possible. Rather than making SQLite count its way
+# through an OFFSET, each page starts where the previous one left off, by searching for the rows
+# that sort after the last row of the previous page. To make this work, the query's sort order is
+# made unique by adding a key column (such as File.fileid) to the end of its sort terms, and the
+# values it sorts by are selected along with its own columns. Queries are given as query_builder
+# Query objects, so the keyset condition is simply added as another filter, with its values bound
+# as parameters. A page that's jumped to directly
+# (say, by dragging a scrollbar) starts from the nearest page boundary that's already known, using
+# an OFFSET only for the distance from there.
+#  Only a limited number of pages are kept in memory. The least recently used page is dropped
+# first. The boundaries between pages are kept, since they're small.
+#  A pager can also be filled from another thread, which reads the row count and pages using a
+# connection of its own (see ReadRowCount() and ReadPage()) and hands them back to be stored.
+#  Once every page of a query has been read, its rows can be taken out with GetStoredRows() and
+# cached (see result_cache), then put into a new pager for the same query with StoreRows(), which
+# doesn't have to read anything.
+#  Every query is run through db.ExecuteCounted(), so that how often a table's statements are
+# reused, rather than prepared again, can be profiled (see db.GetStatementStats()).
+
+
+from collections import OrderedDict
+
+import db
+
+
+# Default paging values.
+PAGE_SIZE = 512
+MAX_CACHED_PAGES = 32
+
+# The name of the filter that pages are started with.
+KEYSET_FILTER = 'keyset'
+
+
+class QueryPager:
+	"""
+	Reads the results of a query (a query_builder Query) on demand, a page at a time. Keyset pagination is used if a 'keyColumn' is given and the query is sorted. The key column must be unique within the results (such as File.fileid, for track queries). Otherwise, pages are read with LIMIT and OFFSET.
+	Quick guide:
+	Call GetRowCount() and GetColumnCount() to get the size of the results.
+	Call GetValue() to get a value, which loads its page if necessary.
+	To read rows in another thread, call ReadRowCount() and ReadPage() there with that thread's connection, then pass the results to SetRowCount() and StorePage().
+	Call GetStoredRows() to get every row of the results, once they've all been read, and StoreRows() to fill a new pager with them.
+	"""
+	
+	def __init__(self, query, keyColumn=None, conn=None, pageSize=PAGE_SIZE, maxCachedPages=MAX_CACHED_PAGES, columnNames=None):
+		"""Set up the pager. No rows are read yet. If no sqlite3 connection is given, the current thread's reader connection is used (see db.GetReaderConnection()). If the column names are already known (from a cached result, say), pass them in so that they don't have to be read."""
+		self.query = query
+		self.conn = conn if conn is not None else db.GetReaderConnection()
+		self.pageSize = pageSize
+		self.maxCachedPages = maxCachedPages
+		
+		self.pages = OrderedDict()   # Page number: list of rows. Ordered from least to most recently used.
+		self.pageBoundaries = {}   # Page number: sort key values of the last row before the page.
+		self.rowCount = None
+		
+		self.pageQuery = query.Copy()
+		if keyColumn is not None and len(query.order) > 0:
+			# Select the sort key values after the query's own columns.
+			self.sortTerms = query.order + [(keyColumn, None, False)]
+			self.pageQuery.columns += [term[0] for term in self.sortTerms]
+			self.pageQuery.SetOrder(self.sortTerms)
+		else:
+			self.sortTerms = None
+		
+		if columnNames is not None:
+			self.columnNames = list(columnNames)
+		else:
+			# Get the column names without reading any rows.
+			cursor = db.ExecuteCounted(self.conn, self.pageQuery.GetSQL() + ' LIMIT ? OFFSET ?', self.pageQuery.GetArgs() + [0, 0])
+			self.columnNames = [description[0] for description in cursor.description]
+			if self.sortTerms is not None:
+				self.columnNames = self.columnNames[:-len(self.sortTerms)]
+	
+	def GetRowCount(self):
+		if self.rowCount is None:
+			self.rowCount = self.ReadRowCount()
+		return self.rowCount
+	
+	def ReadRowCount(self, conn=None):
+		"""Count the rows of the results, using the given connection or the pager's own. The count isn't stored."""
+		return db.ExecuteCounted(conn if conn is not None else self.conn, "SELECT COUNT(*) FROM (" + self.query.GetSQL(bOrdered=False) + ")", self.query.GetArgs()).fetchone()[0]
+	
+	def SetRowCount(self, rowCount):
+		self.rowCount = rowCount
+	
+	def GetColumnCount(self):
+		return len(self.columnNames)
+	
+	def GetColumnNames(self):
+		return self.columnNames
+	
+	def GetValue(self, row, column):
+		"""Get the value at a row and column of the results, or None if there is no such row or column."""
+		if row < 0 or row >= self.GetRowCount() or column < 0 or column >= len(self.columnNames):
+			return None
+		rows = self._GetPage(self.GetPageNum(row))
+		pageRow = row % self.pageSize
+		if pageRow >= len(rows):   # The results must have changed since they were counted.
+			return None
+		return rows[pageRow][column]
+	
+	def GetPageNum(self, row):
+		return row // self.pageSize
+	
+	def BPageStored(self, page):
+		return page in self.pages
+	
+	def _GetPage(self, page):
+		"""Get the rows of a page, reading them if they aren't already stored."""
+		rows = self.pages.pop(page, None)
+		if rows is None:
+			rows = self.ReadPage(page)
+		self.StorePage(page, rows)   # This also marks it as the most recently used page.
+		return rows
+	
+	def StorePage(self, page, rows):
+		"""Store the rows of a page, as read by ReadPage(), dropping the least recently used page if there are too many."""
+		self.pages.pop(page, None)
+		if len(self.pages) >= self.maxCachedPages:
+			self.pages.popitem(last=False)
+		self.pages[page] = rows
+		if self.sortTerms is not None and len(rows) == self.pageSize:
+			self.pageBoundaries[page + 1] = rows[-1][len(self.columnNames):]
+	
+	def GetStoredRows(self):
+		"""Get every row of the results, as stored by StorePage(), or None if the rows haven't been counted or some of their pages aren't stored. The rows include any sort key values after the query's own columns, and are only meant to be passed to StoreRows()."""
+		if self.rowCount is None:
+			return None
+		pageCount = (self.rowCount + self.pageSize - 1) // self.pageSize
+		if any(page not in self.pages for page in range(pageCount)):
+			return None
+		rows = []
+		for page in range(pageCount):
+			rows += self.pages[page]
+		if len(rows) != self.rowCount:   # The results must have changed between reading pages.
+			return None
+		return rows
+	
+	def StoreRows(self, rows):
+		"""Store every row of the results at once, as given by GetStoredRows() for the same query and key column, and set the row count to match."""
+		self.SetRowCount(len(rows))
+		for page in range(0, (len(rows) + self.pageSize - 1) // self.pageSize):
+			self.StorePage(page, rows[page * self.pageSize:(page + 1) * self.pageSize])
+	
+	def ReadPage(self, page, conn=None):
+		"""Read the rows of a page, using the given connection or the pager's own. The rows aren't stored."""
+		# Start from the nearest known boundary at or before the page.
+		startPage = page
+		while startPage > 0 and startPage not in self.pageBoundaries:
+			startPage -= 1
+		
+		query = self.pageQuery
+		if startPage > 0:
+			query = query.Copy()
+			condition, args = self._GetKeysetCondition(self.pageBoundaries[startPage])
+			query.SetFilter(KEYSET_FILTER, condition, *args)
+		return db.ExecuteCounted(conn if conn is not None else self.conn, query.GetSQL() + ' LIMIT ? OFFSET ?', query.GetArgs() + [self.pageSize, (page - startPage) * self.pageSize]).fetchall()
+	
+	def _GetKeysetCondition(self, keys):
+		"""Get a WHERE condition, and a list of its arguments, that matches the rows that sort after a row with the given sort key values. SQLite sorts NULLs before all other values, so they have to be handled separately."""
+		branches = []
+		args = []
+		equalTerms = []
+		equalArgs = []
+		for (expression, collation, bDescending), value in zip(self.sortTerms, keys):
+			if collation is not None:
+				expression += ' COLLATE ' + collation
+			
+			if value is None:
+				if not bDescending:   # Nothing sorts after a NULL in descending order.
+					branches.append(' AND '.join(equalTerms + [expression + ' IS NOT NULL']))
+					args += equalArgs
+			elif bDescending:
+				branches.append(' AND '.join(equalTerms + ['({0} < ? OR {0} IS NULL)'.format(expression)]))
+				args += equalArgs + [value]
+			else:
+				branches.append(' AND '.join(equalTerms + [expression + ' > ?']))
+				args += equalArgs + [value]
+			
+			equalTerms.append(expression + ' IS ?')
+			equalArgs.append(value)
+		
+		if len(branches) == 0:
+			return '0', args
+		return ' OR '.join('(' + branch + ')' for branch in branches), args
@@ -0,0 +1,102 @@
+# Result cache
+#
+# Notes:
+#  Keeps the results of recently loaded queries in memory, so that going back to a view (an
+# artist's albums, say, or a dir that was clicked a moment ago) shows it right away instead of
+# running its query again. Only complete results are kept: every row of a query, not just the
+# pages that happened to be read.
+#  Results are stored under their query's key (see query_builder.Query.GetKey()) along with the
+# library generation they were read in (see gbl.GetLibraryGeneration()). Once the library changes,
+# results from earlier generations can never be given out again, so they're dropped straight away,
+# and the results that are still current are kept.
+#  The cache is bounded by the (estimated) memory its results take up, rather than by how many
+# there are. The least recently used results are dropped first. Results that would take up too
+# much of the cache on their own aren't stored at all.
+#  Doesn't use Qt, but isn't thread-safe either; the GUI thread is the only one that uses it.
+
+
+import sys
+from collections import OrderedDict
+
+
+# Default cache limits, in bytes.
+MAX_CACHE_SIZE = 32 * 1024 * 1024
+MAX_RESULT_SIZE = 8 * 1024 * 1024
+
+
+def EstimateResultSize(rows):
+	"""Estimate the memory taken up by a list of result rows, in bytes. Values that are shared between rows, such as small ints and None, are counted every time, so this errs on the high side."""
+	size = sys.getsizeof(rows)
+	for row in rows:
+		size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+	return size
+
+
+class ResultCache:
+	"""
+	A least recently used cache of query results, bounded by the memory they take up. Results are stored with the library generation they were read in, and only given out during the same generation.
+	Quick guide:
+	Call Get() to get a stored result, or None if there isn't one. Call Put() to store a result.
+	Call GetStats() to see how well the cache is doing.
+	"""
+	
+	def __init__(self, maxSize=MAX_CACHE_SIZE, maxResultSize=MAX_RESULT_SIZE):
+		self.maxSize = maxSize
+		self.maxResultSize = maxResultSize
+		self.entries = OrderedDict()   # (Query key, generation): (result, size). Ordered from least to most recently used.
+		self.size = 0
+		self.generation = None   # The newest library generation seen so far.
+		self.hits = 0
+		self.misses = 0
+	
+	def Get(self, key, generation):
+		"""Get the result stored for a query key in the given library generation, or None if there isn't one."""
+		self._SetGeneration(generation)
+		entry = self.entries.pop((key, generation), None)
+		if entry is None:
+			self.misses += 1
+			return None
+		self.entries[(key, generation)] = entry   # Mark it as the most recently used result.
+		self.hits += 1
+		return entry[0]
+	
+	def Put(self, key, generation, result, size):
+		"""Store the result of a query, read in the given library generation, along with its estimated size in bytes (see EstimateResultSize()). Results from an earlier generation than one already seen, or which are too large, aren't stored. Least recently used results are dropped to make room."""
+		self._SetGeneration(generation)
+		if generation != self.generation or size > self.maxResultSize:
+			return
+		self._Remove((key, generation))
+		while len(self.entries) > 0 and self.size + size > self.maxSize:
+			self._Remove(next(iter(self.entries)))
+		self.entries[(key, generation)] = (result, size)
+		self.size += size
+	
+	def Clear(self):
+		self.entries.clear()
+		self.size = 0
+	
+	def GetStats(self):
+		"""Get the (hits, misses, resultCount, size) of the cache, with the size in bytes."""
+		return self.hits, self.misses, len(self.entries), self.size
+	
+	def _SetGeneration(self, generation):
+		"""Move on to a newer library generation, dropping the results from earlier ones."""
+		if self.generation is None or generation > self.generation:
+			self.generation = generation
+			for entryKey in [entryKey for entryKey in self.entries if entryKey[1] != generation]:
+				self._Remove(entryKey)
+	
+	def _Remove(self, entryKey):
+		entry = self.entries.pop(entryKey, None)
+		if entry is not None:
+			self.size -= entry[1]
+
+
+_resultCache = None
+
+def GetResultCache():
+	"""Get the program's result cache, creating it if necessary."""
+	global _resultCache
+	if _resultCache is None:
+		_resultCache = ResultCache()
+	return _resultCache
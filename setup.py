@@ -32,7 +32,7 @@ else:
 	excludeQtPackage = 'PySide'
 
 # Include extra modules that should be available to the interfaces.
-includes = ['std_interface_imports', 'std_main_window', 'shaped_main_window', 'std_player_manager', 'std_player', 'std_progress_bar', 'img_volume_bar', 'simple_query_table', 'simple_track_query_table', 'dir_system_model']
+includes = ['std_interface_imports', 'std_main_window', 'shaped_main_window', 'std_player_manager', 'std_player', 'std_progress_bar', 'img_volume_bar', 'simple_query_table', 'simple_track_query_table', 'lazy_query_model', 'query_executor', 'dir_system_model']
 
 build_exe = {'includes': includes, 'excludes': [excludeQtPackage], 'packages': [qtPackage]}
 
@@ -41,9 +41,12 @@ if BOnWindows():
 else:
 	exe = Executable('main.py', targetName='kea')
 
+# The headless indexer doesn't use Qt, so it's a console program everywhere.
+indexExe = Executable('kea_index.py', targetName='kea-index.exe' if BOnWindows() else 'kea-index')
+
 
 setup(name='kea',
       version = '0.0',
       description='',
 	  options = {'build_exe': build_exe},
-	  executables=[exe])
\ No newline at end of file
+	  executables=[exe, indexExe])
\ No newline at end of file
@@ -5,14 +5,14 @@
 
 
 from qt import *
-from kea_util import GetTableDB
+from lazy_query_model import LazyQueryModel
 
 
 class SimpleQueryTable(QTableView):
 	"""A basic table which loads the result of a query. Doesn't include column headers."""
 	
-	def __init__(self, parent, x=None, y=None, width=None, height=None, query=None, dataColumn=0, columnSizes=None, db=None, bgColor='#ffffff', borderStyle=None, fontName='Arial', fontSize=8, fontColor='#000000', highlightColor='#cfc7d6', bAlternatingRowColors=False, scrollbarStyle=None, bUseSingleClickedAsDouble=False):
-		"""Set up the table."""
+	def __init__(self, parent, x=None, y=None, width=None, height=None, query=None, dataColumn=0, columnSizes=None, bgColor='#ffffff', borderStyle=None, fontName='Arial', fontSize=8, fontColor='#000000', highlightColor='#cfc7d6', bAlternatingRowColors=False, scrollbarStyle=None, bUseSingleClickedAsDouble=False, keyColumn=None):
+		"""Set up the table. If the table's queries will always include a unique column, such as File.fileid, pass it in as 'keyColumn' so that rows can be read faster (see LazyQueryModel)."""
 		super(SimpleQueryTable, self).__init__(parent)
 		self.parent = parent
 		
@@ -21,13 +21,10 @@ class SimpleQueryTable(QTableView):
 		if x is not None and y is not None:
 			self.move(x, y)
 		
-		if db is None:
-			self.db = GetTableDB()
-		else:
-			self.db = db
-		
-		self.model = QSqlQueryModel()
+		self.model = LazyQueryModel(self, keyColumn)   # Rows are read as they're shown, rather than all at once.
 		self.setModel(self.model)
+		self.model.loadingChanged.connect(self.OnLoadingChanged)
+		self.whenLoadedCallbacks = []
 		
 		self.query = query
 		self.dataColumn = dataColumn
@@ -141,9 +138,7 @@ class SimpleQueryTable(QTableView):
 		# TODO remove?
 		#AcceptCurrentLibrary()
 		
-		self.model.setQuery(query, self.db)
-		while self.model.canFetchMore():
-			self.model.fetchMore()
+		self.model.SetQuery(query)
 		self.query = query
 		#print(self.query, '\n', sep='')
 		return True
@@ -157,17 +152,42 @@ class SimpleQueryTable(QTableView):
 		# TODO if function behavior changes and we end up being allowed to call ModifyQuery() on queries that have different ORDER BY or column results, we'll need to change this function to set the values of sortedHeader, etc.
 		self._LoadQuery(queryModifyFunc(self.query, *queryModifyFuncArgs))
 	
+	def OnLoadingChanged(self, bLoading):
+		"""Show that a query is loading, and run any callbacks that were waiting for it to finish."""
+		if bLoading:
+			self.viewport().setCursor(Qt.BusyCursor)
+		else:
+			self.viewport().unsetCursor()
+			callbacks = self.whenLoadedCallbacks
+			self.whenLoadedCallbacks = []
+			for func, args in callbacks:
+				func(*args)
+	
+	def BLoading(self):
+		"""Is the table's query still being loaded in the background?"""
+		return self.model.BLoading()
+	
+	def RunWhenLoaded(self, func, *args):
+		"""Run a function once the table's current query has finished loading, or right away if it already has. Use this for anything that depends on the table's rows being shown, such as selecting a row after loading a query."""
+		if self.model.BLoading():
+			self.whenLoadedCallbacks.append((func, args))
+		else:
+			func(*args)
+	
 	def CellDoubleClicked(self, index):
 		row = index.row()
-		data = self.model.data(self.model.index(row, self.dataColumn))
+		data = self.model.GetValue(row, self.dataColumn)
 		if self.onChooseCallback is not None:
 			self.onChooseCallback(data, row)
 	
 	def GetRowCount(self):
-		return self.model.rowCount()
+		return self.model.GetRowCount()   # Unlike rowCount(), this doesn't wait for the query to load.
 	
 	def SelectRow(self, row):
-		"""Selects a row. Doesn't clear current selection."""
+		"""Selects a row. Doesn't clear current selection. If the table's query is still loading, the row is selected once it's loaded."""
+		self.RunWhenLoaded(self._SelectRow, row)
+	
+	def _SelectRow(self, row):
 		nextIndex = self.model.index(row, 0)
 		# TODO delete one of these commands, they seem to do the same thing.
 		self.setCurrentIndex(nextIndex)
@@ -176,7 +196,7 @@ class SimpleQueryTable(QTableView):
 	def OnEnter(self):
 		if self.selectionModel().hasSelection():
 			row = self.selectionModel().currentIndex().row()
-			data = self.model.data(self.model.index(row, self.dataColumn))
+			data = self.model.GetValue(row, self.dataColumn)
 			if self.onChooseCallback is not None:
 				self.onChooseCallback(data, row)
 
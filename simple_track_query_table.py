@@ -5,16 +5,18 @@
 
 
 from qt import *
+from util import LogicError
 from gbl import ResetCurrentTrackRow, BLibraryChanged, AcceptCurrentLibrary
-from walker import RemoveFileFromDatabase
+from walker import RemoveFilesFromDatabase
 from simple_query_table import SimpleQueryTable
+from query_builder import GetTrackQuery, ParseOrderBy, TRACK_ORDER
 
 
 class SimpleTrackQueryTable(SimpleQueryTable):
 	"""A basic table which loads track results from a query. Doesn't include column headers."""
 	
-	def __init__(self, parent, x=None, y=None, width=None, height=None, selectQueryPart=None, whereQueryPart=None, orderBy=None, columnSizes=None, db=None, bgColor='#ffffff', borderStyle=None, fontName='Arial', fontSize=8, fontColor='#000000', highlightColor='#cfc7d6', bAlternatingRowColors=False, scrollbarStyle=None, bUseSingleClickedAsDouble=False):
-		super(SimpleTrackQueryTable, self).__init__(parent, x, y, width, height, None, None, columnSizes, db, bgColor, borderStyle, fontName, fontSize, fontColor, highlightColor, bAlternatingRowColors, scrollbarStyle, bUseSingleClickedAsDouble)
+	def __init__(self, parent, x=None, y=None, width=None, height=None, selectQueryPart=None, whereQueryPart=None, orderBy=None, columnSizes=None, bgColor='#ffffff', borderStyle=None, fontName='Arial', fontSize=8, fontColor='#000000', highlightColor='#cfc7d6', bAlternatingRowColors=False, scrollbarStyle=None, bUseSingleClickedAsDouble=False):
+		super(SimpleTrackQueryTable, self).__init__(parent, x, y, width, height, None, None, columnSizes, bgColor, borderStyle, fontName, fontSize, fontColor, highlightColor, bAlternatingRowColors, scrollbarStyle, bUseSingleClickedAsDouble, keyColumn='File.fileid')
 		
 		# Set up various important details.
 		self.dataColumn = None   # The path column. Important: This must be set manually later if no selectQueryPart is given.
@@ -28,51 +30,28 @@ class SimpleTrackQueryTable(SimpleQueryTable):
 		QShortcut(QKeySequence('Delete'), self, self.OnDelete, context=Qt.WidgetShortcut)
 	
 	def CreateQuery(self, selectQueryPart, whereQueryPart=None, orderBy=None):
-		self.query = 'SELECT '
-		
-		self.query += selectQueryPart
-		
-		selectParts = selectQueryPart.split(', ')
-		self.dataColumn = selectParts.index('title') if 'path' in selectParts else None
+		"""Make and load a track query. 'selectQueryPart' is a comma-separated list of the columns to show, 'whereQueryPart' is an optional condition that every track must meet, and 'orderBy' is the contents of an ORDER BY clause (see query_builder.ParseOrderBy())."""
+		columns = selectQueryPart.split(', ') if len(selectQueryPart) > 0 else []
+		self.dataColumn = columns.index('path') if 'path' in columns else None
 		if self.dataColumn is None:   # The path needs to be in our results somewhere, so generate and hide it if necessary.
-			if len(selectParts) > 0:
-				self.query += ', path'
-			else:
-				self.query += 'path'
-			self.dataColumn = len(selectParts)
+			self.dataColumn = len(columns)
+			columns.append('path')
 		else:
 			self.bHidePathColumn = False
 		
-		# TODO remove
-		# The initial query behavior. Note that we create an extra column as padding.
-		#self.query += " NULL AS '' FROM File, Artist, Album, Genre WHERE File.artistid == Artist.artistid AND File.albumid == Album.albumid AND File.genreid == Genre.genreid ORDER BY "
-		
-		self.query += ' FROM File, Artist, Album, Genre WHERE File.artistid == Artist.artistid AND File.albumid == Album.albumid AND File.genreid == Genre.genreid '
-		
-		if whereQueryPart is not None and len(whereQueryPart) > 0:
-			self.query += 'AND ' + whereQueryPart
-		
-		if self.query[-1] != ' ':
-			self.query += ' '
-		
 		if orderBy is not None and len(orderBy) > 0:
-			self.query += 'ORDER BY ' + orderBy
+			self.query = GetTrackQuery(columns, ParseOrderBy(orderBy))
 		else:
-			self.query += 'ORDER BY artist COLLATE NOCASE ASC, album COLLATE NOCASE ASC, track'
-		
-		# TODO remove
-		#self.sortedHeader = 'artist'
-		#self.sorted = SORTED_ASC
+			self.query = GetTrackQuery(columns, TRACK_ORDER + [('track', None, False)])
+		if whereQueryPart is not None and len(whereQueryPart) > 0:
+			self.query.conditions.append(whereQueryPart)
 		
 		self._LoadQuery(self.query, bLoadEvenIfSameQuery=True)
 		
-		#print(self.query)   # TODO remove
-		
 		if self.columnSizes is not None:
 			for i in range(len(self.columnSizes)):
 				self.setColumnWidth(i, self.columnSizes[i])
 	
-	
 	def _LoadQuery(self, query=None, bLoadEvenIfSameQuery=False):
 		"""An internal function. Loads the table based on the query, but doesn't modify the various variables that keep track of how the data is sorted, etc. Uses the existing query if None is supplied."""
 		if not bLoadEvenIfSameQuery and not BLibraryChanged() and (query is None or query == self.query):
@@ -84,9 +63,7 @@ class SimpleTrackQueryTable(SimpleQueryTable):
 		#AcceptCurrentLibrary()
 		ResetCurrentTrackRow()   # You should call this, or reset the associated global variable directly, whenever changing track table data.
 		
-		self.model.setQuery(query, self.db)
-		while self.model.canFetchMore():
-			self.model.fetchMore()
+		self.model.SetQuery(query)
 		if self.bHidePathColumn:
 			self.setColumnHidden(self.dataColumn, True)
 		self.query = query
@@ -96,10 +73,10 @@ class SimpleTrackQueryTable(SimpleQueryTable):
 	def GetPrevFileData(self, row):
 		"""Get a tuple: (path, row), for the previous file before the one in the given row."""
 		prevRow = row - 1
-		path = self.model.data(self.model.index(prevRow, self.dataColumn))
+		path = self.model.GetValue(prevRow, self.dataColumn)
 		if path is None:
-			prevRow = self.model.rowCount() - 1
-			path = self.model.data(self.model.index(prevRow, self.dataColumn))
+			prevRow = self.model.GetRowCount() - 1
+			path = self.model.GetValue(prevRow, self.dataColumn)
 			if path is None:
 				raise LogicError("Invalid path. (Out-of-date current track row wasn't reset.)")
 		return path, prevRow
@@ -107,17 +84,17 @@ class SimpleTrackQueryTable(SimpleQueryTable):
 	def GetNextFileData(self, row):
 		"""Get a tuple: (path, row), for the next file after the one in the given row."""
 		nextRow = row + 1
-		path = self.model.data(self.model.index(nextRow, self.dataColumn))
+		path = self.model.GetValue(nextRow, self.dataColumn)
 		if path is None:
 			nextRow = 0
-			path = self.model.data(self.model.index(nextRow, self.dataColumn))
+			path = self.model.GetValue(nextRow, self.dataColumn)
 			if path is None:
 				raise LogicError("Invalid path. (Out-of-date current track row wasn't reset.)")
 		return path, nextRow
 	
 	def GetRowFileData(self, row):
 		"""Get the path for a file on a specific row."""
-		path = self.model.data(self.model.index(row, self.dataColumn))
+		path = self.model.GetValue(row, self.dataColumn)
 		if path is None:
 			raise LogicError("Invalid path. (Out-of-date current track row wasn't reset.)")
 		return path
@@ -138,10 +115,6 @@ class SimpleTrackQueryTable(SimpleQueryTable):
 			reply = QMessageBox.question(self, 'Delete', 'Delete ' + str(deleteNum) + ' ' + trackStr + '?', QMessageBox.Yes | QMessageBox.No)
 			if reply == QMessageBox.Yes:
 				# Note: It's crucial to get all the paths before we start deleting things, or we could be dealing with out-of-date rows.
-				paths = [self.model.data(self.model.index(index.row(), self.dataColumn)) for index in rowIndexes]
-				for path in paths:
-					if self.libChangedCallbackArgs is not None:
-						RemoveFileFromDatabase(path, libChangedCallbackArgs=self.libChangedCallbackArgs)
-					else:
-						RemoveFileFromDatabase(path)
-				self._LoadQuery(self.query, bLoadEvenIfSameQuery=True)   # QtSqlQueryModel is read-only. We can't remove rows, so let's just reload the query.
\ No newline at end of file
+				paths = [self.model.GetValue(index.row(), self.dataColumn) for index in rowIndexes]
+				RemoveFilesFromDatabase(paths, libChangedCallbackArgs=self.libChangedCallbackArgs)
+				self._LoadQuery(self.query, bLoadEvenIfSameQuery=True)   # LazyQueryModel is read-only. We can't remove rows, so let's just reload the query.
\ No newline at end of file
@@ -16,10 +16,11 @@ from util import LogicError, ConfigValueError, PathNotExistError, SQ
 from constants import *
 import gbl
 from gbl import ResetCurrentTrackRow, BLibraryChanged, AcceptCurrentLibrary
-from kea_util import ShowWarning, ShowRestartChangesMessage, RunStdInterface, RunShapedInterface, GetImgDir, CreateStdHotkeys, GetTableDB, StripOrderBy, InsertDirSearchIntoQuery, InsertWordSearchIntoQuery, DrawPixmap, GetAlbumArtFromDir, GetHoverButton, GetHoverButtonData, GetHoverButtonIconData
-from tags import GetFileTags
+from kea_util import ShowWarning, ShowRestartChangesMessage, RunStdInterface, RunShapedInterface, GetImgDir, CreateStdHotkeys, InsertDirSearchIntoQuery, InsertWordSearchIntoQuery, InsertTextSearchIntoQuery, DrawPixmap, GetAlbumArtFromDir, GetAlbumArtCache, GetHoverButton, GetHoverButtonData, GetHoverButtonIconData
+from query_builder import Query, GetTrackQuery, TRACK_FIELDS
+from tags import GetFileTags, PrintableAudioLength
 from db import GetLibraryDirs
-from walker import RemoveFileFromDatabase, SetLibraryChangedCallback
+from walker import RemoveFileFromDatabase, RemoveFilesFromDatabase, SetLibraryChangedCallback
 from config import GetConfigFile, GetConfigValues, WriteConfigFile
-#from watcher import StartWatchDirs, EndWatchDirs   # This triggers the watcher.
+from watcher import RefreshWatchedDirs
 from hotkeys import CreateGlobalHotkey, CreateGlobalWin32Hotkey, DeleteGlobalHotkeys, DeleteGlobalWin32Hotkeys
\ No newline at end of file
@@ -16,7 +16,8 @@ from constants import *
 import gbl
 from kea_util import ShowMessage, ShowRestartChangesMessage
 from db import GetLibraryDirs, BIsLibraryDir, BLibraryDirCovered, ResetDatabaseTags, ResetLibraryDirs
-from walker import AddLibraryDirToDatabase, RemoveLibraryDirOrSubdirFromDatabase, RescanLibraryDirOrSubdir, RunLibraryChangedCallback
+from watcher import RefreshWatchedDirs
+from walker import AddLibraryDirToDatabase, RemoveLibraryDirOrSubdirFromDatabase, RescanLibraryDirOrSubdir, IncrementalRescanLibraryDirOrSubdir, RunLibraryChangedCallback
 from config import GetInterfaceList, SetDefaultInterfaceName, ResetConfigFile
 
 
@@ -175,6 +176,7 @@ class LibraryDialog(QDialog):
 	
 	def DelayedAdd(self):
 		AddLibraryDirToDatabase(self.tempAddDir)
+		RefreshWatchedDirs()
 		self.RefreshList()
 		self.tempDialog.close()
 		self.tempAddDir = None
@@ -188,6 +190,7 @@ class LibraryDialog(QDialog):
 			if reply == QMessageBox.Yes:
 				dir = self.list.currentItem().text()
 				RemoveLibraryDirOrSubdirFromDatabase(dir, bCheckDir=False)
+				RefreshWatchedDirs()
 				self.RefreshList()
 	
 	def Clear(self):
@@ -195,6 +198,7 @@ class LibraryDialog(QDialog):
 		if reply == QMessageBox.Yes:
 			ResetDatabaseTags()
 			ResetLibraryDirs()
+			RefreshWatchedDirs()
 			self.RefreshList()
 			RunLibraryChangedCallback()
 	
@@ -206,14 +210,15 @@ class LibraryDialog(QDialog):
 	'''
 	
 	def Rescan(self):
-		"""Rescan a music library directory or subdirectory."""
+		"""Rescan a music library directory or subdirectory. Only files that have been added, changed, or removed since the last scan are dealt with."""
 		startDir = self.list.currentItem().text() if self.list.currentItem() is not None else QDir.currentPath()
 		dir = QFileDialog.getExistingDirectory(self, 'Open Library Dir or Subdir', startDir, QFileDialog.ShowDirsOnly | QFileDialog.DontResolveSymlinks)
 		if len(dir) > 0:
 			if not BLibraryDirCovered(dir):
 				ShowMessage('Please choose an existing library directory or subdirectory.')
 			else:
-				RescanLibraryDirOrSubdir(dir, True, bCheckDir=False)
+				report = IncrementalRescanLibraryDirOrSubdir(dir, bCheckDir=False)
+				ShowMessage('Rescan complete:', str(report) + '.')
 	
 	def FindNewFiles(self):
 		"""Search for new files in a chosen music library dir or subdir"""
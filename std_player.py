@@ -26,8 +26,16 @@ class StdPlayer:
 		#self.SetTickCallback(self.Tick)   # TODO remove
 	
 	def SetSource(self, path):
+		self.player.clearQueue()
 		self.player.setCurrentSource(Phonon.MediaSource(path))
 	
+	def Enqueue(self, path):
+		"""Queue a file to be played as soon as the current one ends, without a gap."""
+		self.player.enqueue(Phonon.MediaSource(path))
+	
+	def ClearQueue(self):
+		self.player.clearQueue()
+	
 	def SetVolume(self, volumePercent):
 		if volumePercent > 1:
 			volumePercent = 1
@@ -70,6 +78,14 @@ class StdPlayer:
 		"""Set a callback function to be run whenever the player state (paused, unpaused) changes."""
 		self.player.stateChanged.connect(func)
 	
+	def SetAboutToFinishCallback(self, func):
+		"""Set a callback function to be run shortly before the current file ends, which is the time to queue the next one with Enqueue()."""
+		self.player.aboutToFinish.connect(func)
+	
+	def SetSourceChangedCallback(self, func):
+		"""Set a callback function to be run whenever the player moves on to a new file, whether it was set with SetSource() or queued with Enqueue()."""
+		self.player.currentSourceChanged.connect(func)
+	
 	def SetTickCallback(self, func, tickInterval=1000):
 		"""Set a callback function to be called every tickInterval milliseconds (default: 1000) the player plays for. The callback function must take an integer argument representing the player's current position in the track, in milliseconds."""
 		self.player.setTickInterval(tickInterval)
@@ -4,18 +4,37 @@
 #  
 
 
-import os, random
+import os, random, threading
 from util import SQ
 from qt import *
 from constants import DB_PATH
-from util import PathNotExistError
+from util import LogicError, PathNotExistError
 import gbl
 from kea_util import ShowWarning, GetHoverButton, GetHoverButtonData, GetHoverButtonIconData
+from db import GetStoredFileTags
 from tags import GetFileTags
 
 from std_player import StdPlayer
 
 
+def _ReadIntoCache(path):
+	try:
+		with open(path, 'rb') as file:
+			if hasattr(os, 'posix_fadvise'):
+				os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)   # Have the OS read the file ahead, without copying it here.
+			else:
+				while len(file.read(1024 * 1024)) > 0:
+					pass
+	except (IOError, OSError):
+		pass
+
+def WarmFileCache(path):
+	"""Start reading a file into the OS's page cache in a background thread, so that playing it later won't have to wait on the disk. Errors are ignored."""
+	thread = threading.Thread(target=_ReadIntoCache, args=(path,))
+	thread.daemon = True
+	thread.start()
+
+
 class StdPlayerManager(QObject):
 	"""Standard button manager. Takes care of track playback. Designed to interface with a track table."""
 	
@@ -29,9 +48,14 @@ class StdPlayerManager(QObject):
 		
 		self.player = StdPlayer()
 		self.player.SetStateChangedCallback(self.PlayerStateChanged)
+		self.player.SetAboutToFinishCallback(self.PlayerAboutToFinish)
+		self.player.SetSourceChangedCallback(self.PlayerSourceChanged)
 		
 		self.bUserTriggeredState = False   # Keep track of which player states are manual. This will always be set before such a state is activated.
 		
+		self.nextTrack = None   # The (path, row, tags) of the track that's expected to play after the current one. See PrefetchNext().
+		self.queuedTrack = None   # The (path, row, tags) of the track queued in the player to follow the current one without a gap.
+		
 		
 		##--- Buttons
 		
@@ -98,7 +122,7 @@ class StdPlayerManager(QObject):
 	
 	def PlayerStateChanged(self, new, old):
 		if not self.bUserTriggeredState:
-			if new != Phonon.PlayingState:   # A track has stopped playing.
+			if new != Phonon.PlayingState and new != Phonon.BufferingState:   # A track has stopped playing. (The player may buffer while moving on to a queued track.)
 				self.AutoNext()
 		self.bUserTriggeredState = False
 	
@@ -124,24 +148,88 @@ class StdPlayerManager(QObject):
 			self.PlayRandom()
 	
 	def PlayFile(self, path):
-		# It's a bother to grab all the tag data from the table (plus, maybe not all the columns are there), so we'll get it fresh at very little cost.
-		
-		oldDir = os.path.dirname(gbl.currentTrackPath) if gbl.currentTrackPath is not None else None
-		gbl.currentTrackPath = path
-		try:
-			gbl.currentTrackTags = GetFileTags(path)
-		except PathNotExistError as e:
+		# It's a bother to grab all the tag data from the table (plus, maybe not all the columns are there), so we'll get it from the database, which is a single index search. The file itself is only read if it isn't in the database.
+		if not os.path.isfile(path):
 			ShowWarning('No such file:', SQ(path))
 			return
 		
-		tags = gbl.currentTrackTags
+		if self.nextTrack is not None and self.nextTrack[0] == path:
+			tags = self.nextTrack[2]
+		else:
+			tags = self.GetTrackTags(path)
+			if tags is None:
+				ShowWarning('No such file:', SQ(path))
+				return
+		
+		gbl.currentTrackPath = path
+		gbl.currentTrackTags = tags
 		
+		self.queuedTrack = None   # Setting the source clears the player's queue.
 		self.bUserTriggeredState = True
 		self.player.SetSource(tags[DB_PATH])
 		self.SetPaused(False)
 		
 		if self.playFileCallback is not None:
 			self.playFileCallback(tags)
+		
+		self.PrefetchNext()
+	
+	def GetTrackTags(self, path):
+		"""Get the tags of a track from the database, or from the file if it isn't in the database. Returns None if the file doesn't exist."""
+		tags = GetStoredFileTags(path)
+		if tags is None:
+			try:
+				tags = GetFileTags(path)
+			except PathNotExistError:
+				return None
+		return tags
+	
+	def _GetNextTrack(self):
+		"""Get the (path, row, tags) of the track after the current one in the track table, or None if there's no telling what it is yet."""
+		if self.trackTable is None or gbl.currentTrackRow is None:
+			return None
+		try:
+			path, row = self.trackTable.GetNextFileData(gbl.currentTrackRow)
+		except LogicError:   # The table is empty, or still loading.
+			return None
+		if self.nextTrack is not None and self.nextTrack[:2] == (path, row):
+			return self.nextTrack
+		tags = self.GetTrackTags(path)
+		if tags is None:
+			return None
+		return path, row, tags
+	
+	def PrefetchNext(self):
+		"""Predict the track that will play after the current one, read its tags from the database, and start reading the file into the OS's page cache, so that moving on to it doesn't have to wait on the disk."""
+		self.nextTrack = self._GetNextTrack()
+		if self.nextTrack is not None:
+			WarmFileCache(self.nextTrack[0])
+	
+	def PlayerAboutToFinish(self):
+		"""Queue the next track in the player, so that it starts without a gap when the current one ends. If there's no next track, the player stops and AutoNext() takes over, as usual."""
+		nextTrack = self._GetNextTrack()   # The table may have changed since the next track was predicted.
+		if nextTrack is not None:
+			self.queuedTrack = self.nextTrack = nextTrack
+			self.player.Enqueue(nextTrack[0])
+	
+	def PlayerSourceChanged(self, source):
+		"""Catch up with the player after it moves on to a queued track."""
+		if self.queuedTrack is None:   # The source was set by PlayFile() or Replay().
+			return
+		path, row, tags = self.queuedTrack
+		self.queuedTrack = None
+		
+		if gbl.currentTrackRow is not None:   # Otherwise, the table was reloaded since the track was queued, so its row is out of date.
+			self.trackTable.clearSelection()
+			self.trackTable.SelectRow(row)
+			gbl.currentTrackRow = row
+		gbl.currentTrackPath = path
+		gbl.currentTrackTags = tags
+		
+		if self.playFileCallback is not None:
+			self.playFileCallback(tags)
+		
+		self.PrefetchNext()
 	
 	def _SetPausedState(self, bPaused):
 		"""Set the player's paused state, including both the 'paused?' variable and the button image. Does not affect music playback directly."""
@@ -233,6 +321,7 @@ class StdPlayerManager(QObject):
 			if not os.path.isfile(gbl.currentTrackPath):
 				ShowWarning('No such file:', SQ(gbl.currentTrackPath))
 			else:
+				self.queuedTrack = None
 				self.player.SetSource(gbl.currentTrackPath)
 				self.SetPaused(False)
 	
@@ -8,13 +8,19 @@
 # the database's Artist table, with an ID to match. This will allow us to actually use
 # that as a valid artist primary key when making queries.
 #  Both mutagen and hsaudiotag have problems getting correct file lengths from WAV files,
-# so I use a custom solution. mutagen won't even read WAV files at all.
+# so I use a custom solution: header_tags walks their RIFF chunks. mutagen won't even read WAV
+# files at all.
+#  MP3, Ogg Vorbis, and FLAC files are read with header_tags where possible, which only reads the
+# parts of a file that hold the tags we want, and gives the same results as mutagen.
+#  Lengths are given in whole milliseconds, which is how the database stores them, so they can be
+# added up and sorted as numbers. PrintableAudioLength() turns them into text for display.
 
 
 from __future__ import print_function
 import os
 from struct import unpack_from
 from util import RequiredImportError, PathNotExistError, BPython2, SQ
+from header_tags import ReadHeaderTags
 
 # This is commented out until hsaudiotag fixes its ID3v2.4 problems. For now, mutagen is the
 # only library supported. Since mutagen is broken on Python 3, this means that Python 2 is the
@@ -34,16 +40,19 @@ import mutagen
 #from hsaudiotag import auto
 
 
-def PrintableAudioLength(seconds):
-	return '{}:{num:02d}'.format(int(seconds / 60), num=int(seconds) % 60)
+def GetAudioLengthMS(seconds):
+	"""Turn a length in seconds, as given by the tag libraries, into the whole milliseconds the database stores."""
+	return int(round(seconds * 1000))
 
-def GetFileTagsMutagen(path):
-	"""Uses Mutagen to get music file tags. Must return the same output as GetFileTagsHsaudiotag. Returns the list [title, artist, album, track, length, year, genre, path]."""
-	if not os.path.exists(path):
-		raise PathNotExistError('File doesn\'t exist:', SQ(path))
-	
-	audio = mutagen.File(path, easy=True)
-	
+def PrintableAudioLength(ms):
+	"""Turn a length in milliseconds into 'm:ss' text for display, or 'h:mm:ss' for an hour or more. Any fraction of a second is dropped."""
+	seconds = int(ms) // 1000
+	if seconds >= 3600:
+		return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+	return '{}:{:02d}'.format(seconds // 60, seconds % 60)
+
+def _MakeFileTags(path, audio, length):
+	"""Make the tag list returned by GetFileTags() from a mapping of mutagen's 'easy' tag names to lists of values, and a length in seconds. The length is stored in milliseconds."""
 	title = audio.get('title', None)
 	if title is not None and len(title[0]) > 0:   # Note: On Python 2 I got one rare situation where the title was indeed a blank string, which is why I test for it here, but it's usually None if no title is found. (And on Python 3 this rare example gave None.)
 		title = title[0]
@@ -74,7 +83,22 @@ def GetFileTagsMutagen(path):
 	if genre is not None:
 		genre = genre[0]
 	
-	return [title, artist, album, track, PrintableAudioLength(audio.info.length), year, genre, path]
+	return [title, artist, album, track, GetAudioLengthMS(length), year, genre, path]
+
+def GetFileTagsMutagen(path):
+	"""Uses Mutagen to get music file tags. Must return the same output as GetFileTagsHsaudiotag. Returns the list [title, artist, album, track, length, year, genre, path]."""
+	if not os.path.exists(path):
+		raise PathNotExistError('File doesn\'t exist:', SQ(path))
+	
+	audio = mutagen.File(path, easy=True)
+	return _MakeFileTags(path, audio, audio.info.length)
+
+def GetFileTagsFromHeaders(path):
+	"""Gets music file tags by reading only the tag headers (see header_tags). Must return the same output as GetFileTagsMutagen. Returns None if the file has to be read with mutagen instead."""
+	result = ReadHeaderTags(path)
+	if result is None:
+		return None
+	return _MakeFileTags(path, *result)
 '''
 def GetFileTagsHsaudiotag(path):
 	"""Uses hsaudiotag to get music file tags. Must return the same output as GetFileTagsMutagen. (Note: hsaudiotag ignores tracknumbers of 0 due to inbuilt limitations.) Returns the list [title, artist, album, track, length, year, genre, path]."""
@@ -93,35 +117,48 @@ def GetFileTagsHsaudiotag(path):
 		year = None
 	genre = audio.genre if audio.genre != '' else None
 	
-	return [title, artist, album, track, PrintableAudioLength(audio.duration), year, genre, path]
+	return [title, artist, album, track, GetAudioLengthMS(audio.duration), year, genre, path]
 '''
 def GetWAVFileTags(path):
+	"""Gets WAV file tags from the file's RIFF chunks (see header_tags), including any LIST INFO or ID3 tags. Returns the list [title, artist, album, track, length, year, genre, path]."""
 	if not os.path.exists(path):
 		raise PathNotExistError('File doesn\'t exist:', SQ(path))
 	
+	result = ReadHeaderTags(path)
+	if result is not None:
+		return _MakeFileTags(path, *result)
 	title = os.path.basename(path)   # Note loading the filename instead of using a blank title.
 	artist = album = track = year = genre = None
-	
-	return [title, artist, album, track, GetWAVFileLength(path), year, genre, path]
+	return [title, artist, album, track, _GuessWAVFileLength(path), year, genre, path]
 
 def GetFileLengthMutagen(path):
 	"""Uses Mutagen to get music file length. Must return the same output as GetFileLengthHsaudiotag."""
 	if not os.path.exists(path):
 		raise PathNotExistError('File doesn\'t exist:', SQ(path))
 	audio = mutagen.File(path, easy=True)
-	PrintableAudioLength(audio.info.length)
+	return GetAudioLengthMS(audio.info.length)
 '''
 def GetFileLengthHsaudiotag(path):
 	"""Uses hsaudiotag to get music file length. Must return the same output as GetFileLengthMutagen."""
 	if not os.path.exists(path):
 		raise PathNotExistError('File doesn\'t exist:', SQ(path))
 	audio = auto.File(path)
-	return PrintableAudioLength(audio.duration)
+	return GetAudioLengthMS(audio.duration)
 '''
 def GetWAVFileLength(path):
-	with open(path, 'r') as file:
+	"""Gets WAV file length, in milliseconds, from the file's fmt and data chunks (see header_tags)."""
+	result = ReadHeaderTags(path)
+	if result is not None:
+		return GetAudioLengthMS(result[1])
+	return _GuessWAVFileLength(path)
+
+def _GuessWAVFileLength(path):
+	"""Guess the length of a WAV file whose chunks can't be made sense of, assuming the usual 44-byte header. Returns the length in milliseconds, or None if the file is too short to hold a byte rate."""
+	with open(path, 'rb') as file:
 		file.seek(28)   # The WAV ByteRate is located at the 28th byte.
 		byteRateData = file.read(4)
+		if len(byteRateData) < 4:   # The file is empty, or was cut off.
+			return None
 		
 		# Convert the value from a string (stored in little endian, in fact) into an int.
 		''' # Alternative to unpack_from. TODO: Remove, I guess.
@@ -135,8 +172,8 @@ def GetWAVFileLength(path):
 		if byteRate == 0:   # This is probably an error on the part of the file, but we'll accept it.
 			seconds = 0
 		else:
-			seconds = (fileSize - 44) / byteRate   # 44 is the byte position of the actual sound data.
-		return PrintableAudioLength(seconds)
+			seconds = float(max(fileSize - 44, 0)) / byteRate   # 44 is the byte position of the actual sound data.
+		return GetAudioLengthMS(seconds)
 
 
 # TODO: Reenable if hsaudiotag is ever updated to support ID3v2.4.
@@ -157,11 +194,13 @@ except ImportError:
 def GetFileTags(path):
 	if os.path.splitext(path)[1].lower() == '.wav':
 		return GetWAVFileTags(path)
-	else:
-		return GetFileTagsMutagen(path)
+	tags = GetFileTagsFromHeaders(path)   # Much faster, for the files it can handle.
+	if tags is None:
+		tags = GetFileTagsMutagen(path)
+	return tags
 
 def GetFileLength(path):
 	if os.path.splitext(path)[1].lower() == '.wav':
 		return GetWAVFileLength(path)
 	else:
-		return GetFileTagsMutagen(path)
+		return GetFileLengthMutagen(path)
@@ -0,0 +1,39 @@
+# Test setup
+#
+# Notes:
+#  gbl and db are set up as they're first imported, and db opens (and creates) its database right
+# away, so the tests are given a database of their own in a temp dir before anything imports them.
+# The program config file is the real one; it's only read.
+#  The 'library' fixture generates a small synthetic library with the benchmark module's file
+# makers, and adds it to the test database.
+
+
+import sys, os, shutil, tempfile
+import pytest
+
+programDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, programDir)
+
+import gbl_helper
+
+# This has to come before anything that imports gbl.
+workDir = tempfile.mkdtemp(prefix='kea_tests_')
+gbl_helper.programDir = programDir
+gbl_helper.bChangeDir = False
+gbl_helper.dbPath = os.path.join(workDir, 'data.db')
+
+
+def pytest_unconfigure(config):
+	if 'db' in sys.modules:
+		sys.modules['db'].CloseConnections()
+	shutil.rmtree(workDir, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def library():
+	"""A generated library of 60 files in all of the supported formats, added to the test database. Returns the library dir."""
+	import benchmark, walker
+	libraryDir = walker.LibraryPathFormat(os.path.join(workDir, 'library'))
+	benchmark.GenerateLibrary(libraryDir, fileNum=60, artistNum=4, albumNum=8, genreNum=3, dirDepth=2)
+	walker.AddLibraryDirToDatabase(libraryDir)
+	return libraryDir
@@ -0,0 +1,71 @@
+# Database tests
+#
+# Notes:
+#  Upgrades are run on databases of their own, in memory, by pointing the db module's cursor at
+# them for the length of a test.
+
+
+import sqlite3
+import pytest
+
+import db
+
+
+OLD_FILE_COLUMNS = 'fileid INTEGER PRIMARY KEY, title TEXT, artistid INT, albumid INT, track INT, length TEXT, year INT, genreid INT, path TEXT, mtime REAL, size INT'
+
+
+@pytest.fixture
+def oldDatabase(monkeypatch):
+	"""An in-memory database with a version 6 File table, whose lengths are 'm:ss' text, and the tables its indexes need."""
+	conn = sqlite3.connect(':memory:')
+	cursor = conn.cursor()
+	cursor.execute("CREATE TABLE File ({})".format(OLD_FILE_COLUMNS))
+	cursor.execute("CREATE TABLE Artist (artistid INTEGER PRIMARY KEY, artist TEXT)")
+	cursor.execute("CREATE TABLE Album (albumid INTEGER PRIMARY KEY, album TEXT)")
+	cursor.execute("CREATE TABLE Genre (genreid INTEGER PRIMARY KEY, genre TEXT)")
+	cursor.execute("CREATE TABLE AlbumContainsArtist (albumid INT, artistid INT, PRIMARY KEY (albumid, artistid))")
+	monkeypatch.setattr(db, 'conn', conn)
+	monkeypatch.setattr(db, 'c', cursor)
+	yield cursor
+	conn.close()
+
+
+def test_ConvertFileLengths(oldDatabase):
+	lengths = {3: '3:25', 5: '0:07', 8: '61:00', 9: '0:00', 12: '', 13: None, 20: 'garbage'}
+	oldDatabase.executemany("INSERT INTO File VALUES (?, 'Title', 1, 1, 1, ?, 2000, 1, ?, 0, 0)", ((fileID, length, '/music/{}.mp3'.format(fileID)) for fileID, length in lengths.items()))
+	
+	db._ConvertFileLengths()
+	
+	rows = dict((fileID, (length, path)) for fileID, length, path in oldDatabase.execute("SELECT fileid, length, path FROM File"))
+	assert rows == {3: (205000, '/music/3.mp3'), 5: (7000, '/music/5.mp3'), 8: (3660000, '/music/8.mp3'), 9: (0, '/music/9.mp3'), 12: (None, '/music/12.mp3'), 13: (None, '/music/13.mp3'), 20: (None, '/music/20.mp3')}
+	assert oldDatabase.execute("SELECT typeof(length) FROM File WHERE fileid=3").fetchone()[0] == 'integer'
+
+def test_ConvertFileLengthsKeepsIndexes(oldDatabase):
+	db._ConvertFileLengths()
+	
+	indexes = set(name for (name,) in oldDatabase.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='File'"))
+	assert set(['FilePathIndex', 'FileArtistIndex', 'FileAlbumIndex', 'FileGenreIndex']) <= indexes
+	assert not db.BTableExists('NewFile')
+
+def test_CountStatements():
+	"""Statements count as repeats for as long as they'd still be in the connection's statement cache."""
+	conn = sqlite3.connect(':memory:', cached_statements=db.STATEMENT_CACHE_SIZE)
+	db.ResetStatementStats()
+	for i in range(db.STATEMENT_CACHE_SIZE):
+		db.ExecuteCounted(conn, "SELECT {}".format(i))
+	assert db.GetStatementStats() == (db.STATEMENT_CACHE_SIZE, 0)
+	
+	db.ExecuteCounted(conn, "SELECT 0")
+	assert db.ExecuteCounted(conn, "SELECT 0 + ?", (1,)).fetchone() == (1,)
+	assert db.GetStatementStats() == (db.STATEMENT_CACHE_SIZE + 1, 1)
+	
+	# Running "SELECT 0 + ?" pushed out "SELECT 1", the least recently run, since "SELECT 0" was run again before it.
+	db.ExecuteCounted(conn, "SELECT 0")
+	db.ExecuteCounted(conn, "SELECT 1")
+	assert db.GetStatementStats() == (db.STATEMENT_CACHE_SIZE + 2, 2)
+	
+	db.ForgetConnectionStatements(conn)
+	db.ExecuteCounted(conn, "SELECT 0")
+	assert db.GetStatementStats() == (db.STATEMENT_CACHE_SIZE + 3, 2)
+	db.ForgetConnectionStatements(conn)
+	conn.close()
@@ -0,0 +1,64 @@
+# Header tag reader tests
+#
+# Notes:
+#  The header readers have to give the same tags as mutagen (see tags.GetFileTagsFromHeaders()),
+# so files made by the benchmark module's file makers are read both ways and compared. mutagen
+# doesn't read RIFF INFO tags, so only the lengths of WAV files are compared.
+
+
+import os
+import pytest
+
+import benchmark
+from header_tags import ReadHeaderTags
+from tags import GetFileTagsFromHeaders, GetFileTagsMutagen
+
+mutagen = pytest.importorskip('mutagen')
+
+
+TAG_SETS = [
+	{'title': u'Title', 'artist': u'Artist', 'album': u'Album', 'tracknumber': u'7', 'genre': u'Genre', 'date': u'1999'},
+	{'title': u'T\xeftle \u2013 \u65e5\u672c', 'artist': u'\xc4rtist', 'album': u'Album', 'tracknumber': u'3/10', 'genre': u'Rock', 'date': u'2001-05-01'},
+	{'artist': u'Artist', 'tracknumber': u'x'},
+	{},
+]
+
+
+def _MakeFile(tmpdir, format, tags, seconds=2):
+	path = str(tmpdir.join('track.' + format))
+	benchmark.FILE_MAKERS[format](path, tags, seconds)
+	return path
+
+
+@pytest.mark.parametrize('format', ['mp3', 'ogg', 'flac'])
+@pytest.mark.parametrize('tags', TAG_SETS)
+def test_SameAsMutagen(tmpdir, format, tags):
+	path = _MakeFile(tmpdir, format, tags)
+	headerTags = GetFileTagsFromHeaders(path)
+	assert headerTags is not None
+	assert headerTags == GetFileTagsMutagen(path)
+
+@pytest.mark.parametrize('tags', TAG_SETS)
+def test_WAV(tmpdir, tags):
+	path = _MakeFile(tmpdir, 'wav', tags)
+	headerTags = GetFileTagsFromHeaders(path)
+	assert headerTags[1] == tags.get('artist')
+	assert headerTags[4] == 2000
+	if hasattr(mutagen, 'wave'):
+		assert headerTags[4] == GetFileTagsMutagen(path)[4]
+
+@pytest.mark.parametrize('format', ['mp3', 'ogg', 'flac', 'wav'])
+def test_DamagedFilesLeftToMutagen(tmpdir, format):
+	path = _MakeFile(tmpdir, format, TAG_SETS[0])
+	with open(path, 'rb') as file:
+		data = file.read()
+	for size in (0, 4, 20, 40):
+		with open(path, 'wb') as file:
+			file.write(data[:size])
+		assert ReadHeaderTags(path) is None
+
+def test_UnsupportedFilesLeftToMutagen(tmpdir):
+	path = str(tmpdir.join('track.m4a'))
+	open(path, 'wb').close()
+	assert ReadHeaderTags(path) is None
+	assert ReadHeaderTags(str(tmpdir.join('missing.mp3'))) is None
@@ -0,0 +1,105 @@
+# Query pager tests
+#
+# Notes:
+#  Pages are read from a small in-memory table with a tiny page size, so that the rows cross many
+# page boundaries, and the sort columns are full of NULLs and ties, which keyset pagination has to
+# step over correctly. Every pager's rows are compared with those of the same query run in one go.
+#  sqlite3 keeps each connection's prepared statements keyed by their SQL text, so a table reload
+# only has to bind new arguments as long as the pager runs the same SQL for the same query shape.
+# The pager runs its queries through db.ExecuteCounted(), whose counts show whether it does.
+
+
+import sqlite3
+import pytest
+
+import db
+from query_builder import Query
+from query_pager import QueryPager
+
+
+PAGE_SIZE = 3
+
+NAMES = [None, 'b', 'A', None, 'a', 'c', 'B', None, 'b', 'a', None, 'C', 'a', None, 'd', 'b', None]
+
+
+@pytest.fixture
+def conn():
+	conn = sqlite3.connect(':memory:')
+	conn.execute("CREATE TABLE Item (id INTEGER PRIMARY KEY, name TEXT, rank INT)")
+	conn.executemany("INSERT INTO Item VALUES (?, ?, ?)", ((id, name, None if id % 4 == 0 else id % 3) for id, name in enumerate(NAMES, 1)))
+	yield conn
+	db.ForgetConnectionStatements(conn)
+	conn.close()
+
+
+def _GetQuery(order):
+	return Query(['name', 'rank', 'id'], 'Item', order=order)
+
+def _GetExpectedRows(conn, query):
+	"""Get the rows of a query, sorted the way the pager sorts them, in one go."""
+	orderedQuery = query.Copy()
+	orderedQuery.SetOrder(query.order + [('Item.id', None, False)])
+	return conn.execute(orderedQuery.GetSQL(), orderedQuery.GetArgs()).fetchall()
+
+def _GetRows(pager, rowNums):
+	return [tuple(pager.GetValue(row, column) for column in range(pager.GetColumnCount())) for row in rowNums]
+
+ORDERS = [
+	[('name', 'NOCASE', False)],
+	[('name', 'NOCASE', True)],
+	[('name', None, False), ('rank', None, True)],
+	[('rank', None, True), ('name', 'NOCASE', False)],
+]
+
+
+@pytest.mark.parametrize('order', ORDERS)
+def test_ReadInOrder(conn, order):
+	query = _GetQuery(order)
+	pager = QueryPager(query, 'Item.id', conn, pageSize=PAGE_SIZE)
+	expectedRows = _GetExpectedRows(conn, query)
+	assert pager.GetRowCount() == len(NAMES)
+	assert _GetRows(pager, range(len(NAMES))) == expectedRows
+	assert pager.sortTerms is not None
+
+@pytest.mark.parametrize('order', ORDERS)
+def test_JumpToPages(conn, order):
+	query = _GetQuery(order)
+	pager = QueryPager(query, 'Item.id', conn, pageSize=PAGE_SIZE, maxCachedPages=2)
+	expectedRows = _GetExpectedRows(conn, query)
+	
+	# Start at the end, then jump around, so that pages are read both from known boundaries and with offsets, and dropped pages are read again.
+	rowNums = [len(NAMES) - 1, 7, 0, 1, 2, 3, 4, 10, 16, 5, 6, 8, 9, 11, 12, 13, 14, 15, 7]
+	assert _GetRows(pager, rowNums) == [expectedRows[row] for row in rowNums]
+
+def test_OutOfRange(conn):
+	pager = QueryPager(_GetQuery(ORDERS[0]), 'Item.id', conn, pageSize=PAGE_SIZE)
+	assert pager.GetValue(-1, 0) is None
+	assert pager.GetValue(len(NAMES), 0) is None
+	assert pager.GetValue(0, 3) is None
+
+def test_StoreRows(conn):
+	query = _GetQuery(ORDERS[0])
+	pager = QueryPager(query, 'Item.id', conn, pageSize=PAGE_SIZE)
+	assert pager.GetStoredRows() is None
+	_GetRows(pager, range(len(NAMES)))
+	rows = pager.GetStoredRows()
+	assert rows is not None
+	
+	# A new pager for the same query doesn't have to read anything.
+	conn.execute("DELETE FROM Item")
+	newPager = QueryPager(query, 'Item.id', conn, pageSize=PAGE_SIZE, columnNames=pager.GetColumnNames())
+	newPager.StoreRows(rows)
+	assert _GetRows(newPager, range(len(NAMES))) == _GetRows(pager, range(len(NAMES)))
+
+def test_ReloadsReuseStatements(conn):
+	"""Loading the same query shape with other arguments, as clicking another dir does, doesn't have to prepare any statements."""
+	for name in ('a', 'b'):
+		query = _GetQuery(ORDERS[0])
+		query.SetFilter('name', 'name >= ?', name)
+		pager = QueryPager(query, 'Item.id', conn, pageSize=PAGE_SIZE)
+		if name == 'b':
+			db.ResetStatementStats()
+		_GetRows(pager, range(pager.GetRowCount()))
+	firstRuns, repeats = db.GetStatementStats()
+	assert firstRuns == 0
+	assert repeats > 0
@@ -0,0 +1,22 @@
+# Query plan tests
+#
+# Notes:
+#  Makes sure that none of the queries that are run most often (see benchmark.HOT_QUERIES) has to
+# scan a whole table or index.
+
+
+import pytest
+
+import db
+import benchmark
+
+
+@pytest.mark.parametrize('query, args', benchmark.HOT_QUERIES)
+def test_HotQueryUsesIndexes(library, query, args):
+	fullScans = [planDetail for planDetail in db.GetQueryPlan(query, args) if db.BFullScan(planDetail)]
+	assert fullScans == []
+
+def test_TotalsUseCoveringIndexes(library):
+	for idColumn in ('artistid', 'albumid', 'genreid'):
+		plan = db.GetQueryPlan("SELECT COUNT(*), IFNULL(SUM(length), 0) FROM File WHERE {}=?".format(idColumn), (1,))
+		assert any('COVERING INDEX' in planDetail for planDetail in plan), plan
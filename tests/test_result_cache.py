@@ -0,0 +1,64 @@
+# Result cache tests
+#
+# Notes:
+#  Result sizes are given by hand rather than estimated, so that it's easy to follow which results
+# make room for which.
+
+
+from result_cache import ResultCache, EstimateResultSize
+
+
+def test_GetAndPut():
+	cache = ResultCache(maxSize=100, maxResultSize=50)
+	assert cache.Get('a', 1) is None
+	cache.Put('a', 1, ['rows of a'], 10)
+	assert cache.Get('a', 1) == ['rows of a']
+	assert cache.GetStats() == (1, 1, 1, 10)
+
+def test_LeastRecentlyUsedDroppedFirst():
+	cache = ResultCache(maxSize=30, maxResultSize=30)
+	cache.Put('a', 1, 'A', 10)
+	cache.Put('b', 1, 'B', 10)
+	cache.Put('c', 1, 'C', 10)
+	cache.Get('a', 1)   # 'b' is now the least recently used.
+	cache.Put('d', 1, 'D', 10)
+	assert cache.Get('b', 1) is None
+	assert [cache.Get(key, 1) for key in 'acd'] == ['A', 'C', 'D']
+	
+	# A large result drops as many results as it has to.
+	cache.Put('e', 1, 'E', 25)
+	assert [cache.Get(key, 1) for key in 'acde'] == [None, None, None, 'E']
+	assert cache.GetStats()[2:] == (1, 25)
+
+def test_ReplaceResult():
+	cache = ResultCache(maxSize=30, maxResultSize=30)
+	cache.Put('a', 1, 'old', 20)
+	cache.Put('a', 1, 'new', 5)
+	assert cache.Get('a', 1) == 'new'
+	assert cache.GetStats()[2:] == (1, 5)
+
+def test_TooLargeResultNotStored():
+	cache = ResultCache(maxSize=100, maxResultSize=20)
+	cache.Put('a', 1, 'A', 10)
+	cache.Put('b', 1, 'B', 21)
+	assert cache.Get('b', 1) is None
+	assert cache.Get('a', 1) == 'A'
+
+def test_NewGenerationDropsOldResults():
+	cache = ResultCache(maxSize=100, maxResultSize=100)
+	cache.Put('a', 1, 'A', 10)
+	cache.Put('b', 1, 'B', 10)
+	assert cache.Get('a', 2) is None
+	assert cache.GetStats()[2:] == (0, 0)
+	
+	# A result read before the library changed is never stored.
+	cache.Put('b', 1, 'B', 10)
+	assert cache.Get('b', 1) is None
+	cache.Put('b', 2, 'B2', 10)
+	assert cache.Get('b', 2) == 'B2'
+
+def test_EstimateResultSize():
+	smallRows = [(1, 'a')]
+	largeRows = [(1, 'a' * 1000)] * 10
+	assert 0 < EstimateResultSize(smallRows) < EstimateResultSize(largeRows)
+	assert EstimateResultSize(largeRows) > 10000
@@ -0,0 +1,45 @@
+# Music file tag tests
+#
+# Notes:
+#  WAV files are read without mutagen, so these check that damaged ones still get tags instead of
+# raising errors, which would stop a whole scan chunk from being stored.
+
+
+import os, wave
+
+from tags import GetFileTags
+
+
+def _WriteWAV(path, frameCount, sampleRate=8000):
+	wavFile = wave.open(path, 'wb')
+	wavFile.setnchannels(1)
+	wavFile.setsampwidth(2)
+	wavFile.setframerate(sampleRate)
+	wavFile.writeframes(b'\0\0' * frameCount)
+	wavFile.close()
+
+
+def test_WAVLength(tmpdir):
+	path = str(tmpdir.join('full.wav'))
+	_WriteWAV(path, 8000)
+	tags = GetFileTags(path)
+	assert tags[0] == 'full.wav'
+	assert tags[4] == 1000
+
+def test_EmptyWAV(tmpdir):
+	path = str(tmpdir.join('empty.wav'))
+	open(path, 'wb').close()
+	assert GetFileTags(path) == ['empty.wav', None, None, None, None, None, None, path]
+
+def test_TruncatedWAV(tmpdir):
+	fullPath = str(tmpdir.join('full.wav'))
+	_WriteWAV(fullPath, 8000)
+	for size in (12, 30, 40):
+		path = str(tmpdir.join('cut{}.wav'.format(size)))
+		with open(fullPath, 'rb') as fullFile:
+			data = fullFile.read(size)
+		with open(path, 'wb') as cutFile:
+			cutFile.write(data)
+		tags = GetFileTags(path)
+		assert tags[0] == os.path.basename(path)
+		assert tags[4] in (None, 0)
@@ -0,0 +1,51 @@
+# Track table tests
+#
+# Notes:
+#  Checks that the track table and the player manager cope with a table that has no rows, as it
+# does while its query is still loading. These need Qt, and are skipped if it isn't installed.
+
+
+import pytest
+
+import gbl
+from util import LogicError, RequiredImportError
+
+try:
+	from lazy_query_model import LazyQueryModel
+	from simple_track_query_table import SimpleTrackQueryTable
+	from std_player_manager import StdPlayerManager
+except (ImportError, RequiredImportError):
+	LazyQueryModel = None
+
+pytestmark = pytest.mark.skipif(LazyQueryModel is None, reason='Qt is not installed')
+
+
+def _Unbound(method):
+	"""Get the function behind a method, so that it can be called on a stand-in object under Python 2 as well."""
+	return getattr(method, '__func__', method)
+
+class _EmptyTrackTable:
+	"""Stands in for a SimpleTrackQueryTable whose query hasn't loaded yet."""
+	
+	def __init__(self):
+		self.model = LazyQueryModel(None, 'File.fileid')
+		self.dataColumn = 0
+	
+	def GetNextFileData(self, row):
+		return _Unbound(SimpleTrackQueryTable.GetNextFileData)(self, row)
+
+class _PlayerManager:
+	"""Stands in for a StdPlayerManager playing from an empty track table."""
+	
+	def __init__(self):
+		self.trackTable = _EmptyTrackTable()
+		self.nextTrack = None
+
+
+def test_EmptyTableHasNoNextFile():
+	with pytest.raises(LogicError):
+		_EmptyTrackTable().GetNextFileData(0)
+
+def test_NoNextTrackInEmptyTable(monkeypatch):
+	monkeypatch.setattr(gbl, 'currentTrackRow', 0)
+	assert _Unbound(StdPlayerManager._GetNextTrack)(_PlayerManager()) is None
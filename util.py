@@ -4,7 +4,7 @@
 #  Since this is widely imported by other modules, it has to keep imports to a minimum.
 
 
-import sys, os, platform
+import sys, os, errno, platform
 import gbl
 
 
@@ -70,6 +70,27 @@ def BOnLinux():
 def BOnUnix():
 	return BOnMac() or BOnLinux()   # Not technically exact, terminologically.
 
+def BProcessRunning(pid):
+	"""Is a process with the given ID running? Assumes it is if that can't be found out."""
+	if BOnWindows():
+		import ctypes
+		PROCESS_QUERY_LIMITED_INFORMATION, STILL_ACTIVE = 0x1000, 259
+		handle = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+		if not handle:
+			return ctypes.windll.kernel32.GetLastError() == 5   # ERROR_ACCESS_DENIED means it exists.
+		try:
+			exitCode = ctypes.c_ulong()
+			if not ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exitCode)):
+				return True
+			return exitCode.value == STILL_ACTIVE
+		finally:
+			ctypes.windll.kernel32.CloseHandle(handle)
+	try:
+		os.kill(pid, 0)   # Signal 0 only checks that the process exists.
+	except OSError as e:
+		return e.errno == errno.EPERM   # It exists, but belongs to someone else.
+	return True
+
 
 #  ----------
 # --- Python
@@ -162,11 +183,37 @@ def SlashedDir(dir):
 	"""Utility function that ensures that a dir path ends with a slash."""
 	return dir if dir.endswith('/') else dir + '/'
 
+def GetDirPathRange(dir):
+	"""Get the (start, end) bounds of the half-open range of paths which lie within a dir, for use in queries of the form "path >= start AND path < end". Unlike "path LIKE 'dir/%'", these can be answered with an index seek, and they aren't affected by wildcard characters in the dir's name. Pass in a dir with forwards slashes only."""
+	start = SlashedDir(dir)
+	return start, start[:-1] + '0'   # '0' is the character after '/'.
+
+def GetParentDir(path):
+	"""Get the dir that holds a file or dir, or None if the path is the root of the filesystem or of a drive. Pass in a path with forwards slashes only, and no final slash (unless it's a root)."""
+	pos = path.rfind('/')
+	if pos == -1 or pos == len(path) - 1:
+		return None
+	if pos == 0 or path[pos - 1] == ':':   # Keep the slash of the root.
+		return path[:pos + 1]
+	return path[:pos]
+
 
 #  ---------
 # --- Files
 #  ---------
 
+def FindAlbumArtInDir(dir):
+	"""Find the album art image in a dir, trying each of the usual filenames in order. The dir is listed once, rather than each filename being checked, and filenames are matched regardless of case. Returns the path, or None if there isn't any."""
+	try:
+		names = dict((name.lower(), name) for name in os.listdir(dir))
+	except OSError:
+		return None
+	for filename in gbl.albumArtFilenames:
+		name = names.get(filename.lower())
+		if name is not None:
+			return SlashedDir(dir) + name
+	return None
+
 def FileChoice(path1, path2):
 	if os.path.isfile(path1):
 		return path1
@@ -6,48 +6,178 @@
 #  We stick with one type of path separator only in internally-stored file paths, to keep things
 # simple and searchable. Library dirs, by contrast, are stored using the user's operating system's
 # preferred path separator.
-#
-# To do:
-#  Real-time music library monitoring, as a later (post-Independent Study) task. This will be
-#  preferable to manually clicking a Refresh button to recognize changes to the files or directory
-#  structures.
 
 
 from __future__ import print_function
-import os
+import os, stat, itertools, multiprocessing
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir   # The os.scandir() backport, for Python 2.
+	except ImportError:
+		scandir = None
 
-from util import SepException, SQ, SlashedDir
+from util import SepException, SQ, SlashedDir, GetDirPathRange, GetParentDir, FindAlbumArtInDir
 from constants import *
 import db
-from db import LibraryDirFormat, BIsLibraryDir, BLibraryDirCovered, AddLibraryDirToList, RemoveLibraryDirFromList
+from db import LibraryDirFormat, BIsLibraryDir, BLibraryDirCovered, AddLibraryDirToList, RemoveLibraryDirFromList, PruneOrphanedTags
 import gbl
 from gbl import SetLibraryChanged
-from tags import GetFileTagsMutagen, GetWAVFileTags, GetFileLength
+from tags import GetFileTags
+from config import GetTagReaderSetup, GetBFollowDirLinks, GetScanChunkSize
+
+
+# The number of paths handed to a tag reader worker at a time. Small enough to keep results streaming back steadily, big enough to keep the cost of passing data to the workers low.
+TAG_READER_CHUNK_SIZE = 16
+# Batches of fewer files than this are read in the calling thread, since starting a worker pool would take longer than reading them.
+MIN_POOLED_FILES = 32
+# The number of paths looked up or deleted per statement when removing files. Older versions of SQLite allow no more than 999 parameters in a statement.
+REMOVE_CHUNK_SIZE = 500
 
 
 # Globals
 _libChangedCallback = None
 _libChangedCallbackArgs = None
 _libChangedCallbackKwArgs = None
+_scanProgressCallback = None
+_autoTagReaderPoolType = 'thread'   # The kind of worker pool used when the config file says 'auto'. See SetAutoTagReaderPoolType().
 
 
 class LibraryDirError(SepException):
 	pass
 
 
+class NameIDIndex:
+	"""Resolves the names stored in an Artist, Album, or Genre table to their IDs (primary keys) with a dict lookup, allocating IDs for names that aren't in the table yet. New names are kept track of so they can be inserted into the table later."""
+	
+	def __init__(self, rows):
+		"""Pass in the existing (id, name) rows of the table, in order of ID."""
+		self.ids = {}
+		for id, name in rows:
+			if name not in self.ids:   # Be consistent about which ID is used if a name is stored more than once.
+				self.ids[name] = id
+		self.nextID = rows[-1][0] + 1 if len(rows) > 0 else 1
+		self.newNames = {}   # Maps new IDs to names.
+	
+	def GetID(self, name):
+		"""Get the ID for a name, allocating a new one if necessary."""
+		id = self.ids.get(name)
+		if id is None:
+			id = self.nextID
+			self.nextID += 1
+			self.ids[name] = id
+			self.newNames[id] = name
+		return id
+
+
 def LibraryPathFormat(dir):
 	"""Returns an absolute, normalized path with forwards slashes only and no final slash at the end (unless the dir is a drive)."""
 	return os.path.abspath(os.path.realpath(dir)).replace('\\', '/')
 
+class _ListDirEntry:
+	"""A stand-in for the DirEntry objects returned by scandir(), for when it isn't available."""
+	
+	def __init__(self, dir, name):
+		self.name = name
+		self.path = os.path.join(dir, name)
+	
+	def is_dir(self, follow_symlinks=True):
+		return os.path.isdir(self.path) if follow_symlinks else stat.S_ISDIR(os.lstat(self.path).st_mode)
+	
+	def is_file(self, follow_symlinks=True):
+		return os.path.isfile(self.path) if follow_symlinks else stat.S_ISREG(os.lstat(self.path).st_mode)
+	
+	def stat(self, follow_symlinks=True):
+		return os.stat(self.path) if follow_symlinks else os.lstat(self.path)
+
+def _ScanDir(dir):
+	"""Get a list of the entries in a dir, as DirEntry objects or stand-ins for them."""
+	if scandir is not None:
+		return list(scandir(dir))   # Read the whole dir at once, so we're not holding it open while the walk is suspended.
+	return [_ListDirEntry(dir, name) for name in os.listdir(dir)]
+
+def IterMusicFiles(dir, bWithFingerprints=False, bFollowDirLinks=None, bRecursive=True):
+	"""A generator which walks a dir, yielding the paths of the music files inside it, in LibraryPathFormat() format, as they're found. The order is the same as that of a top-down os.walk(). If 'bWithFingerprints' is set, (path, fingerprint) pairs are yielded instead (see GetFileFingerprint()), using the stat data gathered by the walk itself where possible. Linked dirs are only followed if 'bFollowDirLinks' is set (which, if it's None, is taken from the program config file), in which case any dir that has already been walked is skipped, so link loops can't trap the walk. Dirs that can't be read are skipped. If 'bRecursive' is False, subdirs aren't walked."""
+	if bFollowDirLinks is None:
+		bFollowDirLinks = GetBFollowDirLinks()
+	
+	dirStack = [LibraryPathFormat(dir)]
+	walkedDirs = set()   # Identifies dirs by (device, inode), if we're following links.
+	while len(dirStack) > 0:
+		dir = dirStack.pop()
+		try:
+			if bFollowDirLinks:
+				dirStat = os.stat(dir)
+				dirKey = (dirStat.st_dev, dirStat.st_ino)
+				if dirKey in walkedDirs:
+					continue
+				walkedDirs.add(dirKey)
+			entries = _ScanDir(dir)
+		except OSError:
+			continue
+		
+		slashedDir = SlashedDir(dir)
+		subdirs = []
+		for entry in entries:
+			name = entry.name
+			try:
+				if name.lower().endswith(gbl.musicExts):   # Check the name before anything else, since it doesn't cost a system call.
+					if bWithFingerprints:
+						entryStat = entry.stat()
+						if stat.S_ISREG(entryStat.st_mode):
+							yield slashedDir + name, (entryStat.st_mtime, entryStat.st_size)
+							continue
+					elif entry.is_file():
+						yield slashedDir + name
+						continue
+				if bRecursive and entry.is_dir(follow_symlinks=bFollowDirLinks):
+					subdirs.append(slashedDir + name)
+			except OSError:   # The entry vanished, or is a broken link.
+				pass
+		
+		subdirs.reverse()   # So that the first subdir is popped first.
+		dirStack.extend(subdirs)
+
+def IterDirs(dir, bFollowDirLinks=None):
+	"""A generator which walks a dir, yielding the dir itself and then each of its subdirs, in LibraryPathFormat() format, in the same order as IterMusicFiles(). Linked dirs are dealt with as in IterMusicFiles()."""
+	if bFollowDirLinks is None:
+		bFollowDirLinks = GetBFollowDirLinks()
+	
+	dirStack = [LibraryPathFormat(dir)]
+	walkedDirs = set()
+	while len(dirStack) > 0:
+		dir = dirStack.pop()
+		try:
+			if bFollowDirLinks:
+				dirStat = os.stat(dir)
+				dirKey = (dirStat.st_dev, dirStat.st_ino)
+				if dirKey in walkedDirs:
+					continue
+				walkedDirs.add(dirKey)
+			entries = _ScanDir(dir)
+		except OSError:
+			continue
+		
+		yield dir
+		
+		slashedDir = SlashedDir(dir)
+		subdirs = []
+		for entry in entries:
+			try:
+				if entry.is_dir(follow_symlinks=bFollowDirLinks):
+					subdirs.append(slashedDir + entry.name)
+			except OSError:
+				pass
+		
+		subdirs.reverse()
+		dirStack.extend(subdirs)
+
 def GetMusicFiles(dir):
-	dir = os.path.abspath(os.path.realpath(dir))
-	paths = []
-	for root, dirs, filenames in os.walk(dir, topdown=True):
-		for name in filenames:
-			ext = os.path.splitext(name)[1].lower()
-			if ext in gbl.musicExts:
-				paths.append(os.path.join(root, name).replace('\\', '/'))
-	return paths
+	return list(IterMusicFiles(dir))
 
 def GetMusicFilesInRootOnly(dir):
 	dir = os.path.abspath(os.path.realpath(dir))
@@ -59,152 +189,204 @@ def GetMusicFilesInRootOnly(dir):
 	return paths
 
 
+def SetAutoTagReaderPoolType(poolType):
+	"""Set the kind of worker pool, 'process' or 'thread', used to read tags when the program config file leaves it up to the program ('auto'). The GUI uses threads, since forking or spawning a process which holds running threads and open database connections is asking for trouble. Command-line tools, which have neither, can use processes."""
+	global _autoTagReaderPoolType
+	_autoTagReaderPoolType = poolType
+
+def GetTagReaderPool():
+	"""Returns a worker pool to read music file tags with, as set up in the program config file, or None if tags should be read serially. Close the pool when you're done with it."""
+	workers, poolType = GetTagReaderSetup()
+	if poolType == 'auto':
+		poolType = _autoTagReaderPoolType
+	if workers <= 0:
+		workers = multiprocessing.cpu_count()
+	if workers < 2:
+		return None
+	if poolType == 'thread':
+		return ThreadPool(workers)
+	return multiprocessing.Pool(workers)
+
+def GetFileFingerprint(path):
+	"""Get a file's (mtime, size) fingerprint. If a file's fingerprint hasn't changed, its tags are assumed not to have changed either."""
+	stat = os.stat(path)
+	return stat.st_mtime, stat.st_size
+
+def GetFileTagsAndFingerprint(path, fingerprint=None):
+	"""Get a file's tags (see GetFileTags()), followed by its mtime and size. The fingerprint is taken before the tags are read, so a file modified in the meantime will look changed on the next rescan. You can pass in a fingerprint you've already gotten, say, while walking a dir."""
+	if fingerprint is None:
+		fingerprint = GetFileFingerprint(path)
+	tags = GetFileTags(path)
+	tags.extend(fingerprint)
+	return tags
+
+def _GetFingerprintedFileTags(entry):
+	"""Calls GetFileTagsAndFingerprint() with a (path, fingerprint) pair. Defined at module level so that worker processes can use it."""
+	return GetFileTagsAndFingerprint(*entry)
+
+def ReadFileTagsInOrder(paths, pool=None, bFingerprinted=False, maxPending=None):
+	"""A generator which yields the tags and fingerprint (see GetFileTagsAndFingerprint()) of each of a series of files, in the same order as the paths. If 'bFingerprinted' is set, the paths are (path, fingerprint) pairs, as yielded by IterMusicFiles(). If a worker pool is given, the files are read in parallel, ahead of the consumer, but no more than 'maxPending' files (GetScanChunkSize() by default) are handed to the pool before the consumer has taken their tags, so that neither the paths nor the results pile up when the consumer falls behind."""
+	readFunc = _GetFingerprintedFileTags if bFingerprinted else GetFileTagsAndFingerprint
+	if pool is None:
+		for path in paths:
+			yield readFunc(path)
+		return
+	
+	if maxPending is None:
+		maxPending = GetScanChunkSize()
+	paths = iter(paths)
+	pending = deque()   # The results of the batches of paths handed to the pool, in order.
+	while True:
+		while len(pending) * TAG_READER_CHUNK_SIZE < maxPending:
+			batch = list(itertools.islice(paths, TAG_READER_CHUNK_SIZE))
+			if len(batch) == 0:
+				break
+			pending.append(pool.map_async(readFunc, batch))
+		if len(pending) == 0:
+			break
+		for tags in pending.popleft().get():
+			yield tags
+
+
 def AddLibraryDirToDatabase(dir):
 	"""Load the contents of a new music library dir into the database. Only succeeds in a situation where no existing library dir includes this dir. (This means that the application shouldn't be allowed to remove subdirs from the library, or this function won't be able to add them back.) Note that, if the passed-in dir doesn't clash with an existing library dir, then we won't check whether the files in the new dir already exist in the database. This should not present a problem as long as the library dir list is kept up-to-date. Returns a bool indicating whether the dir was added or not."""
-	result = AddLibraryDirToList(dir)
-	if result == FAILURE:   # This dir is already covered by an existing library dir.
+	dir = LibraryDirFormat(dir)
+	if BLibraryDirCovered(dir):   # This dir is already covered by an existing library dir.
 		return False
+	
+	# The scan is journaled in the same transaction that adds the dir to the list, so the dir can't be listed without the scan being journaled. Any interrupted scans of library dirs this one subsumes are replaced by it.
+	db.RemoveScanJournals(dir)
+	db.BeginScanJournal(dir, SCAN_ADD)
+	result = AddLibraryDirToList(dir, bCheckCovered=False)
 	bCheckFileClashes = result == PARTIAL_SUCCESS   # We subsumed an existing library dir, so some of our files might already be in the database.
 	
-	paths = GetMusicFiles(dir)
-	return _AddFilesToDatabase(paths, bCheckFileClashes=bCheckFileClashes, bAddNothingIfAnyClash=False)
+	# Tags are read while the dir is still being walked.
+	paths = IterMusicFiles(dir, bWithFingerprints=True)
+	failed = _AddFilesToDatabase(paths, bCheckFileClashes=bCheckFileClashes, bAddNothingIfAnyClash=False, bFingerprinted=True, journalDir=dir)
+	db.EndScanJournal(dir)
+	db.conn.commit()
+	return failed
 
-def _AddFilesToDatabase(paths, bCheckFileClashes=True, bAddNothingIfAnyClash=False):
-	"""Add tags from a list of files to the database. It's inefficient to call this function for files one by one, so only do that (using a tuple with one element in it) if you must. Returns a list of any files that failed to be added. Although this function is designed with later extensibility in mind (thus the arguments that can be set), currently it is only intended to be used with official library dirs, which is why this function is marked as private."""
+def _AddFilesToDatabase(paths, bCheckFileClashes=True, bAddNothingIfAnyClash=False, bCommit=True, bFingerprinted=False, journalDir=None, bTagsRead=False):
+	"""Add tags from a list of files to the database. It's inefficient to call this function for files one by one, so only do that (using a tuple with one element in it) if you must. Returns a list of any files that failed to be added. Although this function is designed with later extensibility in mind (thus the arguments that can be set), currently it is only intended to be used with official library dirs, which is why this function is marked as private. If 'bCommit' is set to False, the changes aren't committed and the library changed callback isn't run, so that the caller can make them part of a larger transaction.
+	The paths can be any iterable, including a generator such as IterMusicFiles(), in which case files are read as they're found. If 'bFingerprinted' is set, the paths must be (path, fingerprint) pairs. If 'bTagsRead' is set, the tags have been read already, and the 'paths' are the tags and fingerprints of the files, as yielded by ReadFileTagsInOrder(); clashes can't be checked for in that case.
+	The files are stored in chunks (see GetScanChunkSize()), so that memory use doesn't grow with the number of files. If 'bCommit' is set, each chunk is committed as it's stored, so if the program is stopped partway through, the files stored so far are kept, and a rescan will pick up the rest. If a 'journalDir' is given, each chunk is recorded in the scan journal entry of that dir (see db.BeginScanJournal()), so the scan can be resumed with ResumeInterruptedScan().
+	"""
 	# Note that we're going to insert the artists, albums, etc., in the order in which they're retrieved by the dir-walking functionality. This might come in handy later.
 	# This function generates its own new primary keys for new artists, albums, and genres.
 	# Note that even a track with, say, no artist, actually has an artist ID, automatically set to a special row in the Artist table. This will help simplify things later when we make queries. We can always assume that each File has a valid artistid, etc.
-	# Possibly TODO: I could program Python 2 to replace every instance of a call to items() in this function with viewitems(), but there's little performance gain to be had from that.
 	
-	# Note that for artists, albums, and genres, we'll create and store IDs (primary keys) as well as the rest of the values. This is so that we can have ready access to those IDs, so we can connect albums to artists easily as well as easily turn tag strings into IDs.
+	# Note that for artists, albums, and genres, we'll create and store IDs (primary keys) as well as the rest of the values. This is so that we can have ready access to those IDs, so we can connect albums to artists easily as well as easily turn tag strings into IDs. The IDs are carried over from chunk to chunk.
 	files = []
-	artists = {}
-	albums = {}
-	genres = {}
-	
-	oldArtistsList = db.c.execute("SELECT * FROM Artist").fetchall()
-	oldArtists = dict((id, artist) for id, artist in oldArtistsList)
-	nextArtistID = oldArtistsList[-1][0] + 1 if len(oldArtistsList) > 0 else 1
-	
-	oldAlbumsList = db.c.execute("SELECT * FROM Album").fetchall()
-	oldAlbums = dict((id, album) for id, album in oldAlbumsList)
-	nextAlbumID = oldAlbumsList[-1][0] + 1 if len(oldAlbumsList) > 0 else 1
-	
-	oldGenresList = db.c.execute("SELECT * FROM Genre").fetchall()
-	oldGenres = dict((id, genre) for id, genre in oldGenresList)
-	nextGenreID = oldGenresList[-1][0] + 1 if len(oldGenresList) > 0 else 1
+	artists = NameIDIndex(db.c.execute("SELECT * FROM Artist").fetchall())
+	albums = NameIDIndex(db.c.execute("SELECT * FROM Album").fetchall())
+	genres = NameIDIndex(db.c.execute("SELECT * FROM Genre").fetchall())
 	
 	albumContainsArtistList = []
-	oldAlbumContainsArtistList = db.c.execute("SELECT * FROM AlbumContainsArtist").fetchall()
-	#print("OLD", oldAlbumContainsArtistList)   # TODO REMOVE
+	albumContainsArtistSet = set(tuple(e) for e in db.c.execute("SELECT * FROM AlbumContainsArtist").fetchall())   # Both old and new pairs.
 	
+	artDirs = set()   # The dirs whose album art has been looked up.
+	chunkSize = GetScanChunkSize()
 	failed = []
 	
+	# We'll check for clashes against a snapshot of the stored paths, taken before any new files are stored, rather than querying the database for each path.
+	if bCheckFileClashes:
+		oldPaths = set(path for (path,) in db.c.execute("SELECT path FROM File"))
+	
 	if bCheckFileClashes and bAddNothingIfAnyClash:   # TODO possibly: Remove bCheckFileClashes check. Or not, it's based on a subjective interpretation of how arguments work.
+		paths = list(paths)   # We'll go through the paths twice.
 		for path in paths:
-			if db.c.execute("SELECT COUNT(*) FROM File WHERE path=?", (path,)).fetchone()[0] > 0:
+			if bFingerprinted:
+				path = path[0]
+			if path in oldPaths:
 				failed.append(path)
 		if len(failed) > 0:
 			return failed
 	
-	for path in paths:
-		if bCheckFileClashes:
-			if db.c.execute("SELECT COUNT(*) FROM File WHERE path=?", (path,)).fetchone()[0] > 0:
-				failed.append(path)
-				continue
-		
-		# TODO remove this block
-		'''if os.path.splitext(path)[1].lower() == '.wav':   # WAV files don't officially support tags, so we'll handle them differently.
-			# Note loading the filename instead of using a blank title.
-			tags = [os.path.basename(path), None, None, None, GetFileLength(path), None, None, path]
+	if bCheckFileClashes:
+		def _UnclashedPaths():
+			for path in paths:
+				pathStr = path[0] if bFingerprinted else path
+				if pathStr in oldPaths:
+					failed.append(pathStr)
+				else:
+					yield path
+		readPaths = _UnclashedPaths()
+	else:
+		readPaths = paths
+	
+	# Small batches, such as the few files the watcher rescans at a time, aren't worth starting a pool for.
+	pool = None
+	if not bTagsRead:
+		readPaths = iter(readPaths)
+		firstPaths = list(itertools.islice(readPaths, MIN_POOLED_FILES))
+		if len(firstPaths) >= MIN_POOLED_FILES:
+			pool = GetTagReaderPool()
+		readPaths = itertools.chain(firstPaths, readPaths)
+	try:
+		for tags in (readPaths if bTagsRead else ReadFileTagsInOrder(readPaths, pool, bFingerprinted)):
+			if _scanProgressCallback is not None:
+				_scanProgressCallback(tags[DB_PATH], tags[DB_SIZE])
+			
+			# Turn the artist, album, and genre names into IDs, allocating new IDs if necessary.
+			artistID = tags[DB_ARTIST] = artists.GetID(tags[DB_ARTIST])
+			albumID = tags[DB_ALBUM] = albums.GetID(tags[DB_ALBUM])
+			genreID = tags[DB_GENRE] = genres.GetID(tags[DB_GENRE])
+			
 			files.append(tags)
-			continue'''
-		if os.path.splitext(path)[1].lower() == '.wav':
-			tags = GetWAVFileTags(path)   # mutagen and hsaudiotag currently have problems with WAV files.
-		else:
-			tags = GetFileTagsMutagen(path)
-		artistID = albumID = genreID = None
-		
-		# Obtain the artist ID and store a new row in the artists dict if necessary.
-		artistName = tags[DB_ARTIST]
-		for k, v in oldArtists.items():
-			if v == artistName:
-				artistID = k
-				break
-		if artistID is None:
-			for k, v in artists.items():
-				if v == artistName:
-					artistID = k
-					break
-			if artistID is None:
-				artistID = nextArtistID
-				artists[artistID] = artistName
-				nextArtistID += 1
-		tags[DB_ARTIST] = artistID
-		
-		# Do the same for the album.
-		albumName = tags[DB_ALBUM]
-		for k, v in oldAlbums.items():
-			if v == albumName:
-				albumID = k
-				break
-		if albumID is None:
-			for k, v in albums.items():
-				if v == albumName:
-					albumID = k
-					break
-			if albumID is None:
-				albumID = nextAlbumID
-				albums[albumID] = albumName
-				nextAlbumID += 1
-		tags[DB_ALBUM] = albumID
-		
-		# Do the same for the genre.
-		genreName = tags[DB_GENRE]
-		for k, v in oldGenres.items():
-			if v == genreName:
-				genreID = k
-				break
-		if genreID is None:
-			for k, v in genres.items():
-				if v == genreName:
-					genreID = k
-					break
-			if genreID is None:
-				genreID = nextGenreID
-				genres[genreID] = genreName
-				nextGenreID += 1
-		tags[DB_GENRE] = genreID
-		
-		files.append(tags)
+			
+			albumContainsArtistData = (albumID, artistID)
+			if albumContainsArtistData not in albumContainsArtistSet:
+				albumContainsArtistSet.add(albumContainsArtistData)
+				albumContainsArtistList.append(albumContainsArtistData)
+			
+			if len(files) >= chunkSize:
+				_StoreFileChunk(files, artists, albums, genres, albumContainsArtistList, artDirs, bCommit, journalDir)
+				files = []
+				albumContainsArtistList = []
 		
-		albumContainsArtistData = (albumID, artistID)
-		if albumContainsArtistData not in oldAlbumContainsArtistList and albumContainsArtistData not in albumContainsArtistList:
-			albumContainsArtistList.append(albumContainsArtistData)
-			#print("NEW", (albumName, artistName), albumContainsArtistData)   # TODO REMOVE
+		if len(files) > 0:
+			_StoreFileChunk(files, artists, albums, genres, albumContainsArtistList, artDirs, bCommit, journalDir)
+	except:
+		if bCommit:
+			db.conn.rollback()   # Only the chunk being stored is lost.
+		raise
+	finally:
+		if pool is not None:
+			pool.terminate()
 	
-	# TODO remove
-	#print('OLDART', oldArtists)
-	#print('NEWART', artists)
+	if bCommit:
+		db.conn.commit()
+		SetLibraryChanged()
+		RunLibraryChangedCallback()
 	
+	return failed
+
+def _StoreFileChunk(files, artists, albums, genres, albumContainsArtistList, artDirs, bCommit, journalDir=None):
+	"""Insert a chunk of files (whose artists, albums, and genres have been turned into IDs) into the database, along with the artists, albums, genres, and album-artist pairs that are new since the last chunk, and commit them if 'bCommit' is set. The new names are cleared from the name indexes, and the dirs whose album art is looked up are added to 'artDirs'. If a 'journalDir' is given, the chunk is recorded in its scan journal entry."""
 	# Note that for the data we insert from dictionaries, insertion order doesn't matter since we've precomputed the primary keys to use.
-	if len(files) > 0:
-		db.c.executemany("INSERT INTO File VALUES (NULL, ?,?,?,?,?,?,?,?)", files)
-	if len(artists) > 0:
-		db.c.executemany("INSERT INTO Artist VALUES (?, ?)", artists.items())
-	if len(albums) > 0:
-		db.c.executemany("INSERT INTO Album VALUES (?, ?)", albums.items())
-	if len(genres) > 0:
-		db.c.executemany("INSERT INTO Genre VALUES (?, ?)", genres.items())
+	firstFileID = db.c.execute("SELECT IFNULL(MAX(fileid), 0) + 1 FROM File").fetchone()[0]   # The new files get consecutive IDs from here on.
+	db.c.executemany("INSERT INTO File VALUES (NULL, ?,?,?,?,?,?,?,?,?,?)", files)
+	db.UpdateDirTotals(addedFiles=[(tags[DB_PATH], tags[DB_LENGTH]) for tags in files])
+	
+	# Look up the album art of each dir now, so that playback doesn't have to.
+	newArtDirs = set(GetParentDir(tags[DB_PATH]) for tags in files) - artDirs
+	db.SetDirArtPaths(dict((dir, FindAlbumArtInDir(dir) or '') for dir in newArtDirs))
+	artDirs.update(newArtDirs)
+	
+	for index, tableName in ((artists, 'Artist'), (albums, 'Album'), (genres, 'Genre')):
+		if len(index.newNames) > 0:
+			db.c.executemany("INSERT INTO {} VALUES (?, ?)".format(tableName), index.newNames.items())
+			index.newNames = {}
 	if len(albumContainsArtistList) > 0:
 		db.c.executemany("INSERT INTO AlbumContainsArtist VALUES (?, ?)", albumContainsArtistList)
+	db.IndexFilesForSearch(firstFileID)   # This needs the new artists, albums, and genres to be inserted first.
 	
-	db.conn.commit()
-	SetLibraryChanged()
-	RunLibraryChangedCallback()
-	
-	return failed
-
+	if journalDir is not None:
+		db.UpdateScanJournal(journalDir, files[-1][DB_PATH], len(files))
+	if bCommit:
+		db.conn.commit()
+		SetLibraryChanged()   # The chunk can be seen by readers now, so cached results from before it are out of date.
 
 def RescanLibraryDirOrSubdir(dir, bRescanTags, bUpdateAll=True, bCheckDir=True):
 	"""Rescan the contents of a library dir or subdir. Clashes are expected, so all files are tested. If 'bUpdateAll' is set, Artists, Albums, and Genres of deleted files are tested for rationalization of continued existence."""
@@ -212,11 +394,137 @@ def RescanLibraryDirOrSubdir(dir, bRescanTags, bUpdateAll=True, bCheckDir=True):
 	if bCheckDir and not BLibraryDirCovered(dir):
 		raise LibraryDirError('Invalid library dir or subdir:', SQ(dir))
 	
+	# The scan is journaled in the same transaction that removes the old files, if they're being removed.
+	db.BeginScanJournal(dir, SCAN_RESCAN_TAGS if bRescanTags else SCAN_RESCAN)
 	if bRescanTags:
 		RemoveLibraryDirOrSubdirFromDatabase(dir, bRemoveDirFromList=False, bUpdateAll=bUpdateAll, bCheckDir=False)
+	else:
+		db.conn.commit()
+	
+	paths = IterMusicFiles(dir, bWithFingerprints=True)
+	failed = _AddFilesToDatabase(paths, bCheckFileClashes=not bRescanTags, bAddNothingIfAnyClash=False, bFingerprinted=True, journalDir=dir)
+	db.EndScanJournal(dir)
+	db.conn.commit()
+	return failed
+
+def ResumeInterruptedScan(dir):
+	"""Finish a library scan that was interrupted (see db.GetInterruptedScans()). The dir is walked again, but only the files that weren't stored before the scan stopped have their tags read. If the dir is no longer in the library, the scan is just forgotten. Returns the number of files added."""
+	if not BLibraryDirCovered(dir):
+		db.EndScanJournal(dir)
+		db.conn.commit()
+		return 0
+	
+	countQuery = "SELECT COUNT(*) FROM File WHERE path >= ? AND path < ?"
+	oldFileCount = db.c.execute(countQuery, GetDirPathRange(dir)).fetchone()[0]
+	paths = IterMusicFiles(dir, bWithFingerprints=True)
+	_AddFilesToDatabase(paths, bCheckFileClashes=True, bAddNothingIfAnyClash=False, bFingerprinted=True, journalDir=dir)   # The clashes are the files that were already stored.
+	db.EndScanJournal(dir)
+	db.conn.commit()
+	return db.c.execute(countQuery, GetDirPathRange(dir)).fetchone()[0] - oldFileCount
+
+class RescanReport:
+	"""The results of an incremental rescan: the numbers of files that were added, updated, removed, and unchanged, and a list of any files that failed to be added."""
+	
+	def __init__(self):
+		self.added = self.updated = self.removed = self.unchanged = 0
+		self.failed = []
+	
+	def __str__(self):
+		return '{} added, {} updated, {} removed, {} unchanged'.format(self.added, self.updated, self.removed, self.unchanged)
+
+def IncrementalRescanLibraryDirOrSubdir(dir, bUpdateAll=True, bCheckDir=True):
+	"""Rescan the contents of a library dir or subdir, only reading the tags of files that are new or whose fingerprints (see GetFileFingerprint()) have changed since they were stored. Files that no longer exist are removed. All the changes are made in one transaction. If 'bUpdateAll' is set, Artists, Albums, and Genres of removed or changed files are pruned. Returns a RescanReport."""
+	dir = LibraryDirFormat(dir)
+	if bCheckDir and not BLibraryDirCovered(dir):
+		raise LibraryDirError('Invalid library dir or subdir:', SQ(dir))
 	
-	paths = GetMusicFiles(dir)
-	return _AddFilesToDatabase(paths, bCheckFileClashes=not bRescanTags, bAddNothingIfAnyClash=False)
+	return IncrementalRescanLibraryDirs((dir,), bUpdateAll=bUpdateAll)
+
+def IncrementalRescanLibraryDirs(dirs, flatDirs=(), bUpdateAll=True):
+	"""Incrementally rescan a group of library subdirs in one transaction, as IncrementalRescanLibraryDirOrSubdir() does, running the library changed callback once at most. The 'dirs' are rescanned along with their subdirs, and the 'flatDirs' without them. Dirs that no longer exist have their files removed. The dirs aren't checked, and must be in LibraryDirFormat() format. Returns a RescanReport."""
+	return ApplyIncrementalRescan(ReadIncrementalRescan(dirs, flatDirs), bUpdateAll=bUpdateAll)
+
+class IncrementalRescan:
+	"""The changes found in a group of library subdirs by ReadIncrementalRescan(), waiting to be made to the database by ApplyIncrementalRescan()."""
+	
+	def __init__(self):
+		self.report = RescanReport()
+		self.readPaths = []   # The (path, fingerprint) pairs of the new and changed files.
+		self.files = None   # The tags of the new and changed files, if they've been read already.
+		self.staleFiles = []   # The stored (path, fileid, mtime, size, length) rows of the files that are being removed or replaced.
+
+def ReadIncrementalRescan(dirs, flatDirs=(), conn=None, bReadTags=False):
+	"""Find out which files in a group of library subdirs are new, changed, or gone, without changing the database, and return the changes as an IncrementalRescan. The 'dirs' and 'flatDirs' are as for IncrementalRescanLibraryDirs(). The stored files are read through 'conn', which defaults to the module's writer connection, so this can be run in another thread as long as that thread's own connection is given. If 'bReadTags' is set, the tags of the new and changed files are read as well, so that applying the changes is quick; otherwise they're read while the changes are being applied."""
+	if conn is None:
+		conn = db.conn
+	
+	# Leave out any dirs that another dir's rescan already covers.
+	dirs = set(dirs)
+	dirs = [dir for dir in dirs if not any(dir != otherDir and SlashedDir(dir).startswith(SlashedDir(otherDir)) for otherDir in dirs)]
+	flatDirs = [dir for dir in set(flatDirs) if not any(SlashedDir(dir).startswith(SlashedDir(otherDir)) for otherDir in dirs)]
+	
+	rescan = IncrementalRescan()
+	report = rescan.report
+	
+	storedFiles = {}
+	for dir in dirs:
+		for row in conn.execute("SELECT path, fileid, mtime, size, length FROM File WHERE path >= ? AND path < ?", GetDirPathRange(dir)):
+			storedFiles[row[0]] = row
+	for dir in flatDirs:
+		start, end = GetDirPathRange(dir)
+		for row in conn.execute("SELECT path, fileid, mtime, size, length FROM File WHERE path >= ? AND path < ? AND instr(substr(path, ?), '/') = 0", (start, end, len(start) + 1)):
+			storedFiles[row[0]] = row
+	
+	foundFiles = [IterMusicFiles(dir, bWithFingerprints=True) for dir in dirs] + [IterMusicFiles(dir, bWithFingerprints=True, bRecursive=False) for dir in flatDirs]
+	for path, fingerprint in itertools.chain(*foundFiles):
+		storedFile = storedFiles.pop(path, None)
+		if storedFile is None:
+			rescan.readPaths.append((path, fingerprint))
+			report.added += 1
+		elif fingerprint == storedFile[2:4]:
+			report.unchanged += 1
+		else:
+			rescan.readPaths.append((path, fingerprint))
+			rescan.staleFiles.append(storedFile)
+			report.updated += 1
+	
+	# Whatever is left over wasn't found in the dirs.
+	rescan.staleFiles.extend(storedFiles.values())
+	report.removed = len(storedFiles)
+	
+	if bReadTags:
+		pool = GetTagReaderPool() if len(rescan.readPaths) >= MIN_POOLED_FILES else None
+		try:
+			rescan.files = list(ReadFileTagsInOrder(rescan.readPaths, pool, bFingerprinted=True))
+		finally:
+			if pool is not None:
+				pool.terminate()
+	return rescan
+
+def ApplyIncrementalRescan(rescan, bUpdateAll=True):
+	"""Make the changes found by ReadIncrementalRescan() to the database, in one transaction, then run the library changed callback, if anything changed. The database mustn't have been changed since the rescan was read. If 'bUpdateAll' is set, Artists, Albums, and Genres of removed or changed files are pruned. Returns a RescanReport."""
+	report = rescan.report
+	if len(rescan.staleFiles) == 0 and len(rescan.readPaths) == 0:
+		return report
+	
+	try:
+		db.c.executemany("DELETE FROM File WHERE fileid=?", ((storedFile[1],) for storedFile in rescan.staleFiles))
+		db.UpdateDirTotals(removedFiles=[(storedFile[0], storedFile[4]) for storedFile in rescan.staleFiles])
+		if rescan.files is not None:
+			report.failed = _AddFilesToDatabase(rescan.files, bCheckFileClashes=False, bCommit=False, bTagsRead=True)
+		else:
+			report.failed = _AddFilesToDatabase(rescan.readPaths, bCheckFileClashes=False, bCommit=False, bFingerprinted=True)
+		if bUpdateAll:
+			PruneOrphanedTags()   # Note that this happens after the new tags are added, so that artists, etc., which are still in use keep their IDs.
+	except:
+		db.conn.rollback()
+		raise
+	
+	db.conn.commit()
+	SetLibraryChanged()
+	RunLibraryChangedCallback()
+	
+	return report
 
 
 # TODO test further
@@ -226,70 +534,41 @@ def RemoveLibraryDirOrSubdirFromDatabase(dir, bRemoveDirFromList=True, bUpdateAl
 	if bCheckDir and not BLibraryDirCovered(dir):
 		raise LibraryDirError('Invalid library dir or subdir:', SQ(dir))
 	
-	slashedDir = SlashedDir(dir)
+	removedFiles = db.c.execute("SELECT path, length FROM File WHERE path >= ? AND path < ?", GetDirPathRange(dir)).fetchall()
+	db.c.execute("DELETE FROM File WHERE path >= ? AND path < ?", GetDirPathRange(dir))
+	db.UpdateDirTotals(removedFiles=removedFiles)
 	
 	if bUpdateAll:
-		values = db.c.execute("SELECT artistid, albumid, genreid FROM File WHERE path LIKE ?", (slashedDir + '%',)).fetchall()
-	
-	db.c.execute("DELETE FROM File WHERE path LIKE ?", (slashedDir + '%',))
-	
-	if bUpdateAll:
-		# Use values retrieved earlier to test for deletion.
-		artistIDs = set([e[0] for e in values])
-		albumIDs = set([e[1] for e in values])
-		genreIDs = set([e[2] for e in values])
-		for artistID in artistIDs:
-			if artistID is not None:
-				if db.c.execute("SELECT COUNT(*) FROM File WHERE artistid=?", (artistID,)).fetchone()[0] == 0:
-					db.c.execute("DELETE FROM Artist WHERE artistid=?", (artistID,))
-					db.c.execute("DELETE FROM AlbumContainsArtist WHERE artistid=?", (artistID,))
-		for albumID in albumIDs:
-			if albumID is not None:
-				if db.c.execute("SELECT COUNT(*) FROM File WHERE albumid=?", (albumID,)).fetchone()[0] == 0:
-					db.c.execute("DELETE FROM Album WHERE albumid=?", (albumID,))
-					db.c.execute("DELETE FROM AlbumContainsArtist WHERE albumid=?", (albumID,))
-		for genreID in genreIDs:
-			if genreID is not None:
-				if db.c.execute("SELECT COUNT(*) FROM File WHERE genreid=?", (genreID,)).fetchone()[0] == 0:
-					db.c.execute("DELETE FROM Genre WHERE genreid=?", (genreID,))
+		PruneOrphanedTags()
+	if bRemoveDirFromList:
+		db.RemoveScanJournals(dir)   # There's no need to finish scanning files that are being removed.
 	
 	db.conn.commit()
 	
 	if bRemoveDirFromList and BIsLibraryDir(dir):
 		RemoveLibraryDirFromList(dir)
 	
-	# TODO remove the dir from the watched dirs list, once i implement that
-	
 	SetLibraryChanged()
 	RunLibraryChangedCallback()
 
 
 def RemoveFileFromDatabase(path, bUpdateAll=True, libChangedCallbackArgs=None):
 	"""Removes a file from the database. If 'bUpdateAll' is set, Artists, Albums, and Genres of deleted files are pruned. Optionally, you can pass a set of arguments to pass to the library changed callback function. This is because that function will be called, but it's common not to need to refresh/redraw certain GUI elements just because a file was deleted. You can alert the callback function to this fact."""
-	path = LibraryPathFormat(path)
-	
-	if bUpdateAll:
-		values = db.c.execute("SELECT artistid, albumid, genreid FROM File WHERE path=?", (path,)).fetchone()
-		if values is not None:   # No match in database.
-			artistID, albumID, genreID = values   # Note that never-set values are None, as usual.
-		else:
-			artistID = albumID = genreID = None
-	
-	db.c.execute("DELETE FROM File WHERE path=?", (path,))
+	RemoveFilesFromDatabase((path,), bUpdateAll, libChangedCallbackArgs)
+
+def RemoveFilesFromDatabase(paths, bUpdateAll=True, libChangedCallbackArgs=None):
+	"""Removes a group of files from the database, in one transaction, running the library changed callback only once. The files are looked up and deleted a chunk of paths at a time (see REMOVE_CHUNK_SIZE), rather than one by one. Otherwise, this works like RemoveFileFromDatabase()."""
+	paths = list(set(LibraryPathFormat(path) for path in paths))
+	removedFiles = []
+	for i in range(0, len(paths), REMOVE_CHUNK_SIZE):
+		chunk = paths[i:i + REMOVE_CHUNK_SIZE]
+		pathList = ', '.join('?' * len(chunk))
+		removedFiles += db.c.execute("SELECT path, length FROM File WHERE path IN ({})".format(pathList), chunk).fetchall()
+		db.c.execute("DELETE FROM File WHERE path IN ({})".format(pathList), chunk)
+	db.UpdateDirTotals(removedFiles=removedFiles)
 	
 	if bUpdateAll:
-		# Reuse variables created earlier.
-		if artistID is not None:
-			if db.c.execute("SELECT COUNT(*) FROM File WHERE artistid=?", (artistID,)).fetchone()[0] == 0:
-				db.c.execute("DELETE FROM Artist WHERE artistid=?", (artistID,))
-				db.c.execute("DELETE FROM AlbumContainsArtist WHERE artistid=?", (artistID,))
-		if albumID is not None:
-			if db.c.execute("SELECT COUNT(*) FROM File WHERE albumid=?", (albumID,)).fetchone()[0] == 0:
-				db.c.execute("DELETE FROM Album WHERE albumid=?", (albumID,))
-				db.c.execute("DELETE FROM AlbumContainsArtist WHERE albumid=?", (albumID,))
-		if genreID is not None:
-			if db.c.execute("SELECT COUNT(*) FROM File WHERE genreid=?", (genreID,)).fetchone()[0] == 0:
-				db.c.execute("DELETE FROM Genre WHERE genreid=?", (genreID,))
+		PruneOrphanedTags()
 	
 	db.conn.commit()
 	SetLibraryChanged()
@@ -323,6 +602,11 @@ def SetLibraryChangedCallback(func, *args, **kw_args):
 		_libChangedCallbackArgs = args
 	_libChangedCallbackKwArgs = kw_args
 
+def SetScanProgressCallback(func):
+	"""Set a callback function to be run as each file's tags are read while files are being added to the database. It must take the file's path and its size in bytes as arguments. Pass None to remove the callback."""
+	global _scanProgressCallback
+	_scanProgressCallback = func
+
 def RunLibraryChangedCallback(*args, **kw_args):
 	"""Run the callback function that was set to run when the library changes. You can supply custom arguments or use the initially set ones."""
 	if _libChangedCallback is not None:
@@ -1,95 +1,432 @@
 # Library monitoring
 #
-# Important:
-#   This functionality is not yet working, which is why it isn't in use currently.
-#
 # Notes:
-#   Initialize this module by calling StartWatchDirs(), and make sure you call
-#  EndWatchDirs() at the end of your program (or the list of directories to watch next
-#  time the program runs won't be updated.)
-#   The watcher system doesn't always pick up directories that have the same path as
-#  other directories, if you're renaming or deleting and recreating directories. To fix
-#  this, every time a modification is made inside a directory, every single directory or
-#  subdirectory inside the affected directory is quickly checked for existence.
-#   Qt will add new directories to its directory list in the order in which they're made.
-#
-# Bugs:
-#   When you delete a directory that's being monitored, Qt is apt to produce the following
-#  error message: "QFileSystemWatcher: FindNextChangeNotification failed!! (Access is
-#  denied.)" This is an unhelpful error message, and a known bug.
+#  Keeps the database up to date with changes made to the music library dirs while the program
+# runs, so that they don't have to be rescanned by hand.
+#  On Linux, changes are reported by inotify, which is used through ctypes. Elsewhere, or if
+# inotify can't be used (say, because the system's limit on watches has been reached), the watched
+# dirs are polled instead. Adding, removing or renaming an entry in a dir changes the dir's mtime,
+# so polling only has to stat each dir. Polling can't see files that are rewritten in place, though.
+#  Changes are debounced. Once a change is seen, the watcher waits until changes stop arriving for
+# a moment (or until a maximum delay has passed, for long copies), then rescans the changed dirs
+# all at once, in one transaction. A dir is rescanned without its subdirs unless it was itself
+# added or removed.
+#  The slow part of a rescan, walking the changed dirs and reading the tags of new and changed
+# files, is done by a worker thread of the watcher's own (see query_executor), so that the GUI
+# doesn't freeze while music is being copied into the library. The changes are then made to the
+# database, and the library changed callback is run, back in the GUI thread, since that's where
+# the database's writer connection lives. If the library was changed by something else while the
+# worker was reading, what it read may be out of date, so it's read again. Only one rescan runs
+# at a time; changes seen in the meantime wait for the next one.
+#  The watched dirs and their mtimes are stored in the database. When the watcher starts, any dirs
+# whose mtimes changed while the program wasn't running are rescanned, so the library never has to
+# be walked from the top. A library dir that doesn't exist is left alone, since it's most likely
+# on a drive that isn't mounted.
+#  Initialize this module by calling StartWatchDirs() once the QApplication exists, and call
+# EndWatchDirs() at the end of your program. Call RefreshWatchedDirs() when the list of library
+# dirs changes.
 
 
-from __future__ import print_function
-import sys, os
+import sys, os, errno, struct, time, ctypes, ctypes.util
 
-from util import RequiredImportError
+from qt import *
+from util import SlashedDir
+import gbl
+from db import GetLibraryDirs, GetWatchedDirs, UpdateWatchedDirs
+from walker import IterDirs, ReadIncrementalRescan, ApplyIncrementalRescan
+from query_executor import QueryExecutor
+from config import GetWatcherSetup
 
-try:
-	from PySide import QtCore
-	from PySide.QtCore import QFileSystemWatcher
-except ImportError:
-	try:
-		from PyQt4 import QtCore
-		from PyQt4.QtCore import QFileSystemWatcher
-	except ImportError:
-		raise RequiredImportError('No Qt library found.')
 
-import gbl
-#from db import SetWatchedDirs   # TODO uncomment, maybe
-from walker import LibraryPathFormat
+# How long to wait for changes to stop arriving before rescanning, and the longest to put off a rescan while they keep arriving (in ms).
+DEBOUNCE_DELAY = 1500
+MAX_DEBOUNCE_DELAY = 10000
+
+# inotify values, from <sys/inotify.h>.
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR
+_EVENT_HEADER = struct.Struct('iIII')
+
+_watcher = None
+
+
+def _EncodePath(path):
+	if isinstance(path, bytes):
+		return path
+	if hasattr(os, 'fsencode'):
+		return os.fsencode(path)
+	return path.encode(sys.getfilesystemencoding() or 'utf-8')
 
+def _DecodePath(path):
+	if hasattr(os, 'fsdecode'):
+		return os.fsdecode(path)
+	return path.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
 
-# TODO check all files that are in listdir for a changed dir, and add them to the database if they aren't in there
-def DirChanged(dir):
-	print('Directory Changed: {}'.format(dir))
+def _GetMtime(dir):
+	"""Get the mtime of a dir, or None if it isn't there anymore."""
+	try:
+		return os.stat(dir).st_mtime
+	except OSError:
+		return None
+
+
+class _Inotify:
+	"""A minimal wrapper around the Linux inotify API. Raises OSError if inotify can't be used."""
 	
-	watchedDirs = _watcher.directories()
+	def __init__(self):
+		if not sys.platform.startswith('linux'):
+			raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+		try:
+			self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+			self.libc.inotify_init1   # Old C libraries don't have it.
+		except (OSError, AttributeError):
+			raise OSError(errno.ENOSYS, 'inotify is not available')
+		
+		self.fd = self.libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+		if self.fd < 0:
+			err = ctypes.get_errno()
+			raise OSError(err, os.strerror(err))
+		
+		self.dirs = {}   # Watch descriptor: dir.
+		self.watchDescriptors = {}   # Dir: watch descriptor.
 	
-	# This is a little inconvenient, but Qt doesn't remove references to renamed or deleted directories, which means that it doesn't pick up on new versions of old-named directories that may come along later.
-	if gbl.bMonitorRemovedDirs:
-		for watchedDir in watchedDirs:
-			if not os.path.isdir(watchedDir):
-				_watcher.removePath(watchedDir)
+	def AddDir(self, dir):
+		"""Watch a dir. Raises OSError if it can't be watched, in which case ENOSPC means the system's limit on watches has been reached."""
+		if dir in self.watchDescriptors:
+			return
+		wd = self.libc.inotify_add_watch(self.fd, _EncodePath(dir), _WATCH_MASK)
+		if wd < 0:
+			err = ctypes.get_errno()
+			raise OSError(err, os.strerror(err))
+		self.dirs[wd] = dir
+		self.watchDescriptors[dir] = wd
 	
-	for root, dirs, files in os.walk(dir):
-		for name in dirs:
-			checkDir = LibraryPathFormat(os.path.join(root, name))
-			if checkDir not in watchedDirs:
-				print('ADDED', checkDir)
-				_watcher.addPath(checkDir)
-	print(_watcher.directories(), '\n')
-
-''' # TODO: Remove
-def FileChanged(path):
-	print('File Changed: {}'.format(path))'''
+	def RemoveDir(self, dir):
+		wd = self.watchDescriptors.pop(dir, None)
+		if wd is not None:
+			self.dirs.pop(wd, None)
+			self.libc.inotify_rm_watch(self.fd, wd)
+	
+	def ReadEvents(self):
+		"""Read the events that are waiting, and return them as a list of (dir, name, mask) tuples. 'dir' is None for events that don't belong to a watched dir (such as IN_Q_OVERFLOW), and 'name' is empty for events on the dir itself."""
+		events = []
+		while True:
+			try:
+				data = os.read(self.fd, 65536)
+			except OSError as e:
+				if e.errno in (errno.EAGAIN, errno.EINTR):
+					break
+				raise
+			if len(data) == 0:
+				break
+			
+			pos = 0
+			while pos < len(data):
+				wd, mask, cookie, nameLength = _EVENT_HEADER.unpack_from(data, pos)
+				pos += _EVENT_HEADER.size
+				name = _DecodePath(data[pos:pos + nameLength].rstrip(b'\0'))
+				pos += nameLength
+				
+				dir = self.dirs.get(wd) if wd >= 0 else None
+				if mask & _IN_IGNORED:   # The watch is gone, because its dir was removed or unmounted.
+					if dir is not None:
+						del self.dirs[wd]
+						self.watchDescriptors.pop(dir, None)
+					continue
+				events.append((dir, name, mask))
+		return events
+	
+	def Close(self):
+		os.close(self.fd)
+		self.dirs = {}
+		self.watchDescriptors = {}
 
-watchDirs = []
 
-# TODO: make this function and make it work
-def StartWatchDirs():
-	# TODO: Remove
-	rootDirs = []
-	#rootDirs = rootDirs[:1]
+class LibraryWatcher(QObject):
+	"""
+	Watches the music library dirs, and rescans the dirs that change.
+	Quick guide:
+	Call Start() to start watching, and Stop() to stop.
+	Call RefreshLibraryDirs() when the list of library dirs changes.
+	"""
 	
-	#watchDirs = []   # TODO uncomment
+	def __init__(self, pollInterval):
+		"""Set up the watcher. 'pollInterval' is in seconds, and is only used if inotify can't be."""
+		super(LibraryWatcher, self).__init__()
+		self.pollInterval = pollInterval
+		self.libraryDirs = []
+		self.dirMtimes = {}   # Watched dir: mtime as of the last time it was checked.
+		self.changedDirs = set()   # Dirs to rescan without their subdirs.
+		self.changedTrees = set()   # Dirs to rescan along with their subdirs.
+		self.firstChangeTime = None   # When the oldest change waiting to be rescanned was seen.
+		self.inotify = None
+		self.notifier = None
+		self.executor = None   # The worker thread that rescans are read in.
+		self.bRescanning = False
+		
+		self.flushTimer = QTimer(self)
+		self.flushTimer.setSingleShot(True)
+		self.flushTimer.timeout.connect(self.Flush)
+		self.pollTimer = QTimer(self)
+		self.pollTimer.timeout.connect(self.Poll)
 	
-	for rootDir in rootDirs:
-		watchDirs.append(rootDir)
-		for root, dirs, files in os.walk(rootDir):
-			for name in dirs:
-				watchDirs.append(os.path.join(root, name))
-
-def EndWatchDirs():
-	pass   # TODO
+	def Start(self):
+		self.executor = QueryExecutor()
+		self.executor.start()
+		try:
+			self.inotify = _Inotify()
+		except OSError:
+			self.inotify = None
+		else:
+			self.notifier = QSocketNotifier(self.inotify.fd, QSocketNotifier.Read, self)
+			self.notifier.activated.connect(self.OnInotifyEvents)
+		
+		storedMtimes = GetWatchedDirs()
+		newMtimes = {}
+		removedDirs = []
+		self.libraryDirs = GetLibraryDirs()
+		for libraryDir in self.libraryDirs:
+			if not os.path.isdir(libraryDir):
+				continue
+			
+			start = SlashedDir(libraryDir)
+			storedDirs = [dir for dir in storedMtimes if dir == libraryDir or dir.startswith(start)]
+			if len(storedDirs) == 0:   # The watcher hasn't seen this dir before, so there's nothing to compare it with.
+				newMtimes.update(self._WatchTree(libraryDir))
+				continue
+			
+			# Rescan whatever changed since the last time the dirs were checked.
+			for dir in storedDirs:
+				self.dirMtimes[dir] = storedMtimes[dir]
+				self._WatchDir(dir)
+			self.CheckDirs(storedDirs)
+		
+		# Forget about dirs that aren't in the library anymore.
+		for dir in storedMtimes:
+			if not any(dir == libraryDir or dir.startswith(SlashedDir(libraryDir)) for libraryDir in self.libraryDirs):
+				removedDirs.append(dir)
+		
+		if len(newMtimes) > 0 or len(removedDirs) > 0:
+			UpdateWatchedDirs(newMtimes, removedDirs)
+		
+		if self.inotify is None:
+			self.pollTimer.start(self.pollInterval * 1000)
+		if len(self.changedDirs) > 0 or len(self.changedTrees) > 0:
+			self.Flush()
+	
+	def Stop(self):
+		"""Stop watching. Changes that haven't been rescanned yet are left for the next time the watcher starts, since the stored mtimes of their dirs are out of date."""
+		self.flushTimer.stop()
+		self.pollTimer.stop()
+		if self.notifier is not None:
+			self.notifier.setEnabled(False)
+			self.notifier = None
+		if self.inotify is not None:
+			self.inotify.Close()
+			self.inotify = None
+		if self.executor is not None:
+			self.executor.Stop()
+			self.executor = None
+		self.bRescanning = False
+	
+	def RefreshLibraryDirs(self):
+		"""Start watching new library dirs, and stop watching removed ones. New library dirs are expected to have just been scanned."""
+		libraryDirs = GetLibraryDirs()
+		removedLibraryDirs = [dir for dir in self.libraryDirs if dir not in libraryDirs]
+		newLibraryDirs = [dir for dir in libraryDirs if dir not in self.libraryDirs]
+		self.libraryDirs = libraryDirs
+		
+		# Remove dirs first, since a new library dir might contain an old one.
+		for libraryDir in removedLibraryDirs:
+			self._ForgetTree(libraryDir)
+		newMtimes = {}
+		for libraryDir in newLibraryDirs:
+			if os.path.isdir(libraryDir):
+				newMtimes.update(self._WatchTree(libraryDir))
+		UpdateWatchedDirs(newMtimes, removedLibraryDirs)
+	
+	def _WatchDir(self, dir):
+		if self.inotify is None:
+			return
+		try:
+			self.inotify.AddDir(dir)
+		except OSError as e:
+			if e.errno not in (errno.ENOSPC, errno.EMFILE, errno.ENOMEM):   # The dir is gone, or isn't a dir anymore, which CheckDirs() and Flush() take care of.
+				return
+			# The system's limits have been reached, so fall back to polling. The dirs that are already watched by inotify stay that way, but polling covers them too.
+			if not self.pollTimer.isActive():
+				self.pollTimer.start(self.pollInterval * 1000)
+	
+	def _WatchTree(self, dir):
+		"""Watch a dir and its subdirs, recording their current mtimes. Returns a dict of the mtimes."""
+		dirMtimes = {}
+		for subdir in IterDirs(dir):
+			mtime = _GetMtime(subdir)
+			if mtime is not None:
+				self._WatchDir(subdir)
+				dirMtimes[subdir] = mtime
+		self.dirMtimes.update(dirMtimes)
+		return dirMtimes
+	
+	def _ForgetTree(self, dir, keptDirs=()):
+		"""Stop watching a dir and its subdirs, except for any 'keptDirs' (a set)."""
+		start = SlashedDir(dir)
+		for watchedDir in [watchedDir for watchedDir in self.dirMtimes if watchedDir == dir or watchedDir.startswith(start)]:
+			if watchedDir in keptDirs:
+				continue
+			del self.dirMtimes[watchedDir]
+			if self.inotify is not None:
+				self.inotify.RemoveDir(watchedDir)
+	
+	def _GetNewSubdirs(self, dir):
+		"""Get the subdirs of a dir that aren't being watched."""
+		try:
+			names = os.listdir(dir)
+		except OSError:
+			return []
+		start = SlashedDir(dir)
+		return [start + name for name in names if start + name not in self.dirMtimes and os.path.isdir(start + name)]
+	
+	def CheckDirs(self, dirs):
+		"""Compare the mtimes of watched dirs with their stored ones, marking the dirs that changed (and any new subdirs inside them) to be rescanned. Returns whether anything changed."""
+		bChanged = False
+		for dir in dirs:
+			mtime = _GetMtime(dir)
+			if mtime is None:
+				self.changedTrees.add(dir)
+				bChanged = True
+			elif mtime != self.dirMtimes.get(dir):
+				self.changedDirs.add(dir)
+				self.changedTrees.update(self._GetNewSubdirs(dir))
+				bChanged = True
+		return bChanged
+	
+	def Poll(self):
+		if self.CheckDirs(list(self.dirMtimes)):
+			self.Flush()
+	
+	def OnInotifyEvents(self):
+		for dir, name, mask in self.inotify.ReadEvents():
+			if mask & _IN_Q_OVERFLOW:   # Some events were lost, so look for changes the slow way.
+				self.CheckDirs(list(self.dirMtimes))
+			elif dir is None:
+				continue
+			elif mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+				self.changedTrees.add(dir)
+			elif mask & _IN_ISDIR:
+				path = SlashedDir(dir) + name
+				self.changedTrees.add(path)
+				self.changedDirs.add(dir)   # Keep the stored mtime of the parent dir up to date.
+				if mask & (_IN_CREATE | _IN_MOVED_TO):
+					# Watch the new dirs right away, so that anything copied into them is noticed.
+					for subdir in IterDirs(path):
+						self._WatchDir(subdir)
+			elif name.lower().endswith(gbl.musicExts):
+				self.changedDirs.add(dir)
+			else:
+				continue
+			self._ScheduleFlush()
+	
+	def _ScheduleFlush(self):
+		"""Rescan the changed dirs once changes stop arriving, or once the maximum delay has passed."""
+		now = time.time()
+		if self.firstChangeTime is None:
+			self.firstChangeTime = now
+		timeLeft = MAX_DEBOUNCE_DELAY - (now - self.firstChangeTime) * 1000
+		self.flushTimer.start(int(max(0, min(DEBOUNCE_DELAY, timeLeft))))
+	
+	def Flush(self):
+		"""Start rescanning the dirs that changed. Their new mtimes are stored once the rescan is done. If a rescan is already running, the dirs are rescanned after it."""
+		self.flushTimer.stop()
+		self.firstChangeTime = None
+		if self.bRescanning:
+			return
+		changedDirs = self.changedDirs
+		changedTrees = self.changedTrees
+		self.changedDirs = set()
+		self.changedTrees = set()
+		
+		# Record the mtimes before rescanning, so that any changes made during the rescan are seen later.
+		newMtimes = {}
+		removedDirs = []
+		for dir in changedDirs:
+			mtime = _GetMtime(dir)
+			if mtime is None:
+				changedTrees.add(dir)
+			else:
+				newMtimes[dir] = mtime
+				self.dirMtimes[dir] = mtime
+				changedTrees.update(self._GetNewSubdirs(dir))
+		for dir in list(changedTrees):
+			if dir in self.libraryDirs and not os.path.isdir(dir):   # Don't empty out a library dir just because its drive isn't mounted.
+				changedTrees.discard(dir)
+				continue
+			removedDirs.append(dir)   # The tree's stored dirs are replaced by whatever is there now.
+			treeMtimes = self._WatchTree(dir) if os.path.isdir(dir) else {}
+			self._ForgetTree(dir, treeMtimes)
+			newMtimes.update(treeMtimes)
+		changedDirs = [dir for dir in changedDirs if dir in self.dirMtimes]
+		
+		if len(changedTrees) > 0 or len(changedDirs) > 0:
+			self._Rescan(changedTrees, changedDirs, newMtimes, removedDirs)
+		else:
+			UpdateWatchedDirs(newMtimes, removedDirs)
+	
+	def _Rescan(self, dirs, flatDirs, newMtimes, removedDirs):
+		"""Read a rescan of some dirs in the worker thread, then apply it, and store the new mtimes of the watched dirs, in the GUI thread."""
+		self.bRescanning = True
+		generation = gbl.GetLibraryGeneration()
+		self.executor.Submit(lambda conn: ReadIncrementalRescan(dirs, flatDirs, conn, bReadTags=True), lambda rescan: self._OnRescanRead(rescan, generation, dirs, flatDirs, newMtimes, removedDirs), errorCallback=lambda error: self._OnRescanFailed())
+	
+	def _OnRescanRead(self, rescan, generation, dirs, flatDirs, newMtimes, removedDirs):
+		if self.executor is None:   # The watcher was stopped.
+			return
+		if gbl.GetLibraryGeneration() != generation:   # The library changed while the rescan was being read, so it might not match the database anymore.
+			self._Rescan(dirs, flatDirs, newMtimes, removedDirs)
+			return
+		
+		ApplyIncrementalRescan(rescan)
+		UpdateWatchedDirs(newMtimes, removedDirs)
+		self._OnRescanDone()
+	
+	def _OnRescanFailed(self):
+		"""The error has been logged already. The new mtimes of the dirs aren't stored, so they're rescanned the next time the watcher starts."""
+		if self.executor is not None:
+			self._OnRescanDone()
+	
+	def _OnRescanDone(self):
+		self.bRescanning = False
+		if len(self.changedDirs) > 0 or len(self.changedTrees) > 0:   # More changes were seen during the rescan.
+			self._ScheduleFlush()
 
 
-#StartWatchDirs()   # TODO remove
-'''
-app = QtCore.QCoreApplication(sys.argv)   # TODO: Remove
+def StartWatchDirs():
+	"""Start watching the music library dirs, if the program config file allows it. The QApplication must already exist."""
+	global _watcher
+	bWatchLibrary, pollInterval = GetWatcherSetup()
+	if bWatchLibrary and _watcher is None:
+		_watcher = LibraryWatcher(pollInterval)
+		_watcher.Start()
 
-_watcher = QFileSystemWatcher(watchDirs)
-print('dirs', _watcher.directories())
-_watcher.directoryChanged.connect(DirChanged)
-#_watcher.fileChanged.connect(FileChanged)   # TODO: Remove
+def EndWatchDirs():
+	global _watcher
+	if _watcher is not None:
+		_watcher.Stop()
+		_watcher = None
 
-sys.exit(app.exec_())   # TODO: Remove'''
\ No newline at end of file
+def RefreshWatchedDirs():
+	"""Bring the watched dirs up to date with the list of music library dirs. Does nothing if the watcher isn't running."""
+	if _watcher is not None:
+		_watcher.RefreshLibraryDirs()